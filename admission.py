@@ -0,0 +1,158 @@
+import asyncio
+import collections
+import time
+
+import numpy as np
+
+# Replies sent in place of a transcription when a chunk is not decoded.
+BUSY_REPLY = "[busy]"
+DROPPED_REPLY = "[dropped]"
+
+OVERFLOW_POLICIES = ("merge", "drop", "reject")
+
+
+class Entry:
+    """One queued item: audio to decode, or a fixed reply, standing in for `messages` client messages.
+
+    Clients expect exactly one reply per message, in order, so chunks that are merged, dropped or
+    rejected keep a place in the queue and are answered when their turn comes. sequence is the
+    client's sequence number of the newest message the entry covers, when the protocol has them,
+    and received_at the monotonic time its oldest message arrived.
+    """
+
+    def __init__(self, audio=None, reply=None, messages=1, sequence=None, received_at=None):
+        self.audio = audio
+        self.reply = reply
+        self.messages = messages
+        self.sequence = sequence
+        self.received_at = time.monotonic() if received_at is None else received_at
+
+    @property
+    def live(self):
+        """Holds audio that still has to be decoded."""
+        return self.audio is not None and self.reply is None
+
+
+class AdmissionController:
+    """Server wide limits shared by every session.
+
+    max_inflight caps concurrent inference calls across all sessions, shed_threshold is the
+    number of queued chunks (over all sessions) above which new audio is answered with busy.
+    In cascade mode, final decodes by the large model have their own max_final_inflight slots,
+    so however many finals are waiting, partials never queue behind them.
+    """
+
+    def __init__(self, max_inflight=8, shed_threshold=64, max_final_inflight=None):
+        self.inflight = asyncio.Semaphore(max_inflight)
+        self.final_inflight = asyncio.Semaphore(max_final_inflight or max(1, max_inflight // 2))
+        self.shed_threshold = shed_threshold
+        self.queued = 0
+        self.shed = 0
+
+    @property
+    def overloaded(self):
+        return self.queued >= self.shed_threshold
+
+
+class SessionQueue:
+    """Bounded queue between a connection's reader and its inference worker.
+
+    The reader never blocks: once maxsize chunks are waiting, the overflow policy decides what
+    happens to the next one.
+      merge   the new chunk is appended to the queued chunks at the back of the queue, so they are
+              decoded together (audio older than max_merge_seconds is cut off).
+      drop    the oldest waiting chunk is dropped in favour of the new one.
+      reject  the new chunk is answered with a busy reply.
+    """
+
+    def __init__(self, controller, maxsize=4, policy="merge", max_merge_seconds=30.0, sample_rate=16000):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{policy}', expected one of {OVERFLOW_POLICIES}")
+        self.controller = controller
+        self.maxsize = maxsize
+        self.policy = policy
+        self.max_merge_samples = int(max_merge_seconds * sample_rate)
+        self._entries = collections.deque()
+        self._live = 0
+        self._ready = asyncio.Event()
+        # Messages put so far, each one is answered in this order.
+        self.enqueued = 0
+        self.merged = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return self._live
+
+    def put_audio(self, audio_np, sequence=None):
+        """Queue a chunk, applying load shedding and the overflow policy. None marks a silent chunk."""
+        self.enqueued += 1
+        if audio_np is None:
+            self._append(Entry(sequence=sequence))
+        elif self.controller.overloaded:
+            self.controller.shed += 1
+            self.rejected += 1
+            self._append(Entry(reply=BUSY_REPLY, sequence=sequence))
+        elif self._live < self.maxsize:
+            self._append(Entry(audio_np, sequence=sequence))
+            self._set_live(self._live + 1)
+        elif self.policy == "merge":
+            self._merge(audio_np, sequence)
+        elif self.policy == "drop":
+            oldest = next(entry for entry in self._entries if entry.live)
+            oldest.audio, oldest.reply = None, DROPPED_REPLY
+            self.dropped += oldest.messages
+            self._append(Entry(audio_np, sequence=sequence))
+        else:
+            self.rejected += 1
+            self._append(Entry(reply=BUSY_REPLY, sequence=sequence))
+
+    def put_reply(self, reply, sequence=None):
+        """Queue a fixed reply, e.g. for a message that isn't audio."""
+        self.enqueued += 1
+        self._append(Entry(reply=reply, sequence=sequence))
+
+    async def get(self):
+        while not self._entries:
+            self._ready.clear()
+            await self._ready.wait()
+        entry = self._entries.popleft()
+        if entry.live:
+            self._set_live(self._live - 1)
+        return entry
+
+    def close(self):
+        """Forget everything still queued, e.g. when the client went away."""
+        self._set_live(0)
+        self._entries.clear()
+
+    def _append(self, entry):
+        last = self._entries[-1] if self._entries else None
+        if last is not None and entry.reply is not None and last.reply == entry.reply:
+            # A run of identical replies only needs one slot.
+            last.messages += entry.messages
+            last.sequence = entry.sequence
+        else:
+            self._entries.append(entry)
+        self._ready.set()
+
+    def _merge(self, audio_np, sequence):
+        # Fold the new chunk and the waiting chunks right in front of it into one entry.
+        parts = [audio_np]
+        messages = 1
+        received_at = time.monotonic()
+        while self._entries and self._entries[-1].live:
+            entry = self._entries.pop()
+            parts.append(entry.audio)
+            messages += entry.messages
+            received_at = entry.received_at
+            self._set_live(self._live - 1)
+        merged = np.concatenate(parts[::-1])[-self.max_merge_samples:]
+        # Every folded entry is one decode saved.
+        self.merged += len(parts) - 1
+        self._append(Entry(merged, messages=messages, sequence=sequence, received_at=received_at))
+        self._set_live(self._live + 1)
+
+    def _set_live(self, live):
+        self.controller.queued += live - self._live
+        self._live = live
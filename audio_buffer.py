@@ -0,0 +1,132 @@
+import collections
+
+import numpy as np
+
+PCM_SCALE = np.float32(1 / 32768.0)
+
+
+class AudioRingBuffer:
+    """Fixed size float32 audio buffer that hands out contiguous views.
+
+    Storage for a quarter more than the capacity is allocated once. New audio is written behind
+    the live region and consumed from its front; when the write would run past the end of the
+    storage the live region is first moved back to the start. Unlike a wrap-around ring, the live
+    audio is therefore always one contiguous slice and view() never copies. The spare quarter
+    bounds how often that move happens. int16 PCM is scaled straight into the storage, so ingest
+    allocates nothing per chunk.
+
+    The memory ceiling is fixed: once capacity_seconds of audio are held, appending drops the
+    oldest samples (dropped counts them). A view is only valid until the next append or consume.
+    """
+
+    def __init__(self, capacity_seconds=30.0, sample_rate=16000):
+        self.sample_rate = sample_rate
+        self.capacity = int(capacity_seconds * sample_rate)
+        self._storage = np.zeros(self.capacity + max(self.capacity // 4, 1), dtype=np.float32)
+        self._start = 0
+        self._end = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    @property
+    def seconds(self):
+        return len(self) / self.sample_rate
+
+    @property
+    def nbytes(self):
+        return self._storage.nbytes
+
+    def view(self):
+        """The buffered audio, oldest first, as a zero-copy view."""
+        return self._storage[self._start:self._end]
+
+    def append(self, audio_np):
+        """Copy float32 samples in."""
+        self._reserve(len(audio_np))[:] = audio_np[-self.capacity:]
+
+    def append_pcm(self, pcm_bytes):
+        """Convert int16 PCM to float32 in [-1, 1) directly into the storage."""
+        pcm = np.frombuffer(pcm_bytes, dtype=np.int16)
+        target = self._reserve(len(pcm))
+        # Cast in place, then scale in place. A mixed-type multiply would need NumPy's cast buffer.
+        np.copyto(target, pcm[-self.capacity:])
+        np.multiply(target, PCM_SCALE, out=target)
+
+    def consume(self, samples):
+        """Drop samples from the front, e.g. audio that has been transcribed for good."""
+        self._start = min(self._start + samples, self._end)
+
+    def clear(self):
+        self._start = self._end = 0
+
+    def _reserve(self, samples):
+        """Make room for samples at the back and return the slice to fill."""
+        if samples > self.capacity:
+            self.dropped += samples - self.capacity
+            samples = self.capacity
+        overflow = len(self) + samples - self.capacity
+        if overflow > 0:
+            self.dropped += overflow
+            self._start += overflow
+        if self._end + samples > len(self._storage):
+            # Move the live audio back to the front, in blocks no longer than the distance moved.
+            # Blocks never overlap themselves, so NumPy copies without a temporary array, and the
+            # live audio starts past the spare quarter, so that is at most a handful of copies.
+            live, shift = len(self), self._start
+            for block in range(0, live, shift):
+                size = min(shift, live - block)
+                self._storage[block:block + size] = self._storage[shift + block:shift + block + size]
+            self._start, self._end = 0, live
+        target = self._storage[self._end:self._end + samples]
+        self._end += samples
+        return target
+
+
+class FrameArena:
+    """Preallocated float32 storage for decoded frames while they wait in a queue.
+
+    reserve(samples, tag) returns a contiguous slice behind the newest reservation, or wrapped
+    around to the front of the storage, and None when neither has room so the caller allocates
+    instead. Frames are consumed in the order they were reserved: release(tag) frees every
+    reservation with a smaller tag. The storage holds frames frames of the largest size seen, up
+    to max_samples in all; it only grows while nothing is reserved. A frame larger than
+    max_samples is never reserved.
+    """
+
+    def __init__(self, frames=6, max_samples=2 ** 21):
+        self.frames = frames
+        self.max_samples = max_samples
+        self._storage = np.zeros(0, dtype=np.float32)
+        # (start, end, tag) of every reservation still in use, oldest first.
+        self._reserved = collections.deque()
+
+    @property
+    def nbytes(self):
+        return self._storage.nbytes
+
+    def reserve(self, samples, tag):
+        if samples > self.max_samples:
+            return None
+        if not self._reserved:
+            if samples > len(self._storage):
+                self._storage = np.zeros(min(samples * self.frames, self.max_samples), dtype=np.float32)
+            start = 0
+        else:
+            head, tail = self._reserved[0][0], self._reserved[-1][1]
+            if tail > head and tail + samples <= len(self._storage):
+                start = tail
+            elif tail > head and samples <= head:
+                start = 0
+            elif tail <= head and tail + samples <= head:
+                start = tail
+            else:
+                return None
+        if samples:
+            self._reserved.append((start, start + samples, tag))
+        return self._storage[start:start + samples]
+
+    def release(self, tag):
+        while self._reserved and self._reserved[0][2] < tag:
+            self._reserved.popleft()
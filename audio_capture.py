@@ -0,0 +1,238 @@
+import asyncio
+import collections
+import queue
+import threading
+import time
+import wave
+from sys import platform
+
+import numpy as np
+
+from audio_recording import RecordingReader
+from resampler import Resampler
+
+SAMPLE_RATE = 16000
+
+# One fixed-size block of int16 PCM, interleaved when there are several channels. captured_at is
+# the time.monotonic() its last sample was captured, for latency; timestamp is the same moment as
+# time.time(), for recordings.
+Frame = collections.namedtuple("Frame", ["data", "captured_at", "timestamp"])
+
+
+def _to_mono_16k(audio, sample_rate):
+    return Resampler(sample_rate, SAMPLE_RATE, channels=audio.shape[1]).resample(audio.reshape(-1))
+
+
+def load_audio(path):
+    """A file's audio as 16 kHz mono float32.
+
+    Recordings from microphone_recorder.py are read directly. Anything else goes through
+    faster_whisper's decoder (any format ffmpeg reads), or soundfile or the wave module when it
+    isn't installed.
+    """
+    if path.endswith(".wrta"):
+        with RecordingReader(path) as recording:
+            frames = [np.array(frame, dtype=np.float32) / 32768.0 for frame in recording]
+            audio = np.concatenate(frames) if frames else np.zeros(0, dtype=np.float32)
+            return _to_mono_16k(audio.reshape(-1, recording.channels), recording.sample_rate)
+    try:
+        from faster_whisper import decode_audio
+        return decode_audio(path, sampling_rate=SAMPLE_RATE)
+    except ImportError:
+        pass
+    if path.lower().endswith(".wav"):
+        with wave.open(path) as wav:
+            if wav.getsampwidth() != 2:
+                raise ValueError(f"{path}: only 16 bit WAV can be read without faster_whisper or soundfile")
+            pcm = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16)
+            return _to_mono_16k(pcm.reshape(-1, wav.getnchannels()) / 32768.0, wav.getframerate())
+    import soundfile
+    audio, sample_rate = soundfile.read(path, dtype="float32", always_2d=True)
+    return _to_mono_16k(audio, sample_rate)
+
+
+class AudioSource:
+    """Delivers captured audio as fixed-size frames of frame_ms, from the capture thread.
+
+    start(callback) calls callback(frame) for every Frame and callback(None) once the source has
+    ended or was stopped. blocking_queue() and async_queue() start the source into a queue.Queue
+    or an asyncio.Queue instead, so consumers wait on the queue rather than polling it.
+    """
+
+    def __init__(self, sample_rate=SAMPLE_RATE, frame_ms=100, channels=1):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_samples = int(sample_rate * frame_ms / 1000)
+
+    @property
+    def frame_seconds(self):
+        return self.frame_samples / self.sample_rate
+
+    def start(self, callback):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+    def blocking_queue(self):
+        frames = queue.Queue()
+        self.start(frames.put)
+        return frames
+
+    def async_queue(self, loop=None):
+        """Must be called on the event loop thread, or with the loop that will read the queue."""
+        loop = loop or asyncio.get_running_loop()
+        frames = asyncio.Queue()
+        self.start(lambda frame: loop.call_soon_threadsafe(frames.put_nowait, frame))
+        return frames
+
+
+class MicrophoneSource(AudioSource):
+    """A PyAudio input stream whose callback fires once per frame on PortAudio's thread."""
+
+    def __init__(self, device_index=None, sample_rate=SAMPLE_RATE, frame_ms=100, channels=1):
+        super().__init__(sample_rate, frame_ms, channels)
+        self.device_index = device_index
+        self._audio = None
+        self._stream = None
+        self._callback = None
+
+    @staticmethod
+    def list_names():
+        import pyaudio
+        audio = pyaudio.PyAudio()
+        try:
+            return [audio.get_device_info_by_index(index)["name"] for index in range(audio.get_device_count())]
+        finally:
+            audio.terminate()
+
+    def start(self, callback):
+        import pyaudio
+        self._callback = callback
+
+        def on_frame(in_data, frame_count, time_info, status):
+            callback(Frame(in_data, time.monotonic(), time.time()))
+            return None, pyaudio.paContinue
+
+        self._audio = pyaudio.PyAudio()
+        self._stream = self._audio.open(format=pyaudio.paInt16, channels=self.channels, rate=self.sample_rate, input=True,
+                                        input_device_index=self.device_index, frames_per_buffer=self.frame_samples,
+                                        stream_callback=on_frame)
+        self._stream.start_stream()
+
+    def stop(self):
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._audio.terminate()
+            self._stream = None
+            self._callback(None)
+
+
+class FileSource(AudioSource):
+    """A virtual microphone: plays a file's audio as frames paced like a live capture.
+
+    speed 1 delivers frames in real time, higher is faster and 0 delivers them all at once. Each
+    frame's captured_at is the moment it would have been captured, so a late thread shows up as
+    latency like a stalled capture would. With loop the file repeats until stop(). Another
+    sample_rate or channel count plays the audio as a device with that native format would capture
+    it, e.g. to test server side resampling.
+    """
+
+    def __init__(self, path, sample_rate=SAMPLE_RATE, frame_ms=100, speed=1.0, loop=False, channels=1):
+        super().__init__(sample_rate, frame_ms, channels)
+        audio = load_audio(path)
+        if sample_rate != SAMPLE_RATE:
+            audio = Resampler(SAMPLE_RATE, sample_rate).resample(audio)
+        # The last frame is padded with silence, every frame has the same size.
+        pcm = np.zeros(-(-len(audio) // self.frame_samples) * self.frame_samples, dtype=np.int16)
+        pcm[:len(audio)] = np.clip(audio, -1.0, 32767 / 32768) * 32768
+        self.pcm = np.repeat(pcm, channels) if channels > 1 else pcm
+        self.speed = speed
+        self.loop = loop
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, callback):
+        self._thread = threading.Thread(target=self._play, args=(callback,), daemon=True)
+        self._thread.start()
+
+    def _play(self, callback):
+        started = time.monotonic()
+        wall_offset = time.time() - started
+        frames = 0
+        while not self._stopped.is_set():
+            step = self.frame_samples * self.channels
+            for offset in range(0, len(self.pcm), step):
+                frames += 1
+                captured_at = started + frames * self.frame_seconds / self.speed if self.speed else time.monotonic()
+                # Event.wait sleeps until the frame is due and wakes up at once on stop().
+                if self._stopped.wait(max(0.0, captured_at - time.monotonic())):
+                    break
+                callback(Frame(self.pcm[offset:offset + step].tobytes(), captured_at,
+                               captured_at + wall_offset))
+            if not self.loop:
+                break
+        callback(None)
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+class LatencyStats:
+    """Per-frame latencies, e.g. from capture to the websocket send."""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+
+    def observe(self, captured_at):
+        self.latencies.append(time.monotonic() - captured_at)
+
+    def summary(self):
+        if not self.latencies:
+            return f"{self.name}: no frames"
+        p50, p95, p99 = np.percentile(self.latencies, [50, 95, 99]) * 1000
+        return (f"{self.name} latency over {len(self.latencies)} frames: p50 {p50:.1f} ms, p95 {p95:.1f} ms, "
+                f"p99 {p99:.1f} ms, max {max(self.latencies) * 1000:.1f} ms")
+
+
+def add_capture_arguments(parser, frame_ms=100):
+    """The audio input flags every capture script shares."""
+    parser.add_argument("--frame_ms", default=frame_ms, help="Audio frame size in milliseconds, 20 to 100 "
+                                                             "keeps capture latency low.", type=int)
+    parser.add_argument("--input_file", default=None,
+                        help="Play this file (WAV, a .wrta recording, or anything ffmpeg reads) as a virtual "
+                             "microphone instead of capturing, e.g. to test or benchmark headless.", type=str)
+    parser.add_argument("--speed", default=1.0,
+                        help="Pace of --input_file, 1 is real time and 0 as fast as possible.", type=float)
+    if 'linux' in platform:
+        parser.add_argument("--default_microphone", default='pulse',
+                            help="Default microphone name. Run this with 'list' to view available Microphones.",
+                            type=str)
+
+
+def open_source(args):
+    """The AudioSource the capture flags ask for, or None after listing the microphones."""
+    # Only scripts that can send native audio have --sample_rate and --channels, the rest take 16 kHz mono.
+    sample_rate, channels = getattr(args, "sample_rate", SAMPLE_RATE), getattr(args, "channels", 1)
+    if args.input_file:
+        return FileSource(args.input_file, sample_rate, frame_ms=args.frame_ms, speed=args.speed, channels=channels)
+    # Important for linux users.
+    # Prevents permanent application hang and crash by using the wrong Microphone
+    mic_name = getattr(args, "default_microphone", None)
+    if mic_name is None:
+        return MicrophoneSource(sample_rate=sample_rate, frame_ms=args.frame_ms, channels=channels)
+    names = MicrophoneSource.list_names()
+    if not mic_name or mic_name == 'list':
+        print("Available microphone devices are: ")
+        for name in names:
+            print(f"Microphone with name \"{name}\" found")
+        return None
+    index = next((index for index, name in enumerate(names) if mic_name in name), None)
+    if index is None:
+        print(f"No microphone matching '{mic_name}' found.")
+        return None
+    return MicrophoneSource(index, sample_rate, frame_ms=args.frame_ms, channels=channels)
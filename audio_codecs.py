@@ -0,0 +1,220 @@
+import io
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+from audio_buffer import PCM_SCALE
+from protocol import ProtocolError
+
+# Wire codecs for audio frames. encode(pcm_int16, sample_rate) -> bytes runs in the clients,
+# decode(payload, sample_rate, out=None) -> float32 in [-1, 1) runs in the server's ingest path and
+# produces the array the model consumes directly, in one allocation or written into out.
+# samples(payload) is how many samples a payload decodes to, so out can be set aside first, or None
+# when only decoding tells. Every payload decodes on its own, so frames can be replayed, dropped or
+# merged without codec state.
+Codec = namedtuple("Codec", ["name", "encode", "decode", "samples"])
+
+
+def pcm_samples(payload):
+    return len(payload) // 2
+
+
+def encode_pcm(pcm, sample_rate=16000):
+    return np.asarray(pcm, dtype="<i2").tobytes()
+
+
+def decode_pcm(payload, sample_rate=16000, out=None):
+    # Convert data from 16 bit wide integers to floating point with a width of 32 bits, casting and
+    # then scaling in place instead of through an intermediate float array.
+    pcm = np.frombuffer(payload, dtype="<i2")
+    out = np.empty(len(pcm), dtype=np.float32) if out is None else out
+    np.copyto(out, pcm)
+    return np.multiply(out, PCM_SCALE, out=out)
+
+
+# G.711 companding, 8 bits per sample. Decoding is one lookup into a 256 entry float32 table.
+_SEGMENT_ENDS_ULAW = np.array([0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+_SEGMENT_ENDS_ALAW = np.array([0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF])
+
+
+def _ulaw_to_linear(codes):
+    codes = ~codes.astype(np.int32) & 0xFF
+    magnitude = (((codes & 0x0F) << 3) + 0x84) << ((codes & 0x70) >> 4)
+    return np.where(codes & 0x80, 0x84 - magnitude, magnitude - 0x84)
+
+
+def _alaw_to_linear(codes):
+    codes = codes.astype(np.int32) ^ 0x55
+    segment = (codes & 0x70) >> 4
+    magnitude = ((codes & 0x0F) << 4) + np.where(segment == 0, 8, 0x108)
+    magnitude = np.where(segment > 1, magnitude << np.maximum(segment - 1, 0), magnitude)
+    return np.where(codes & 0x80, magnitude, -magnitude)
+
+
+_ULAW_TABLE = (_ulaw_to_linear(np.arange(256)) / 32768.0).astype(np.float32)
+_ALAW_TABLE = (_alaw_to_linear(np.arange(256)) / 32768.0).astype(np.float32)
+
+
+def encode_ulaw(pcm, sample_rate=16000):
+    pcm = np.asarray(pcm, dtype=np.int32) >> 2
+    mask = np.where(pcm < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(pcm), 8159) + 0x21
+    segment = np.searchsorted(_SEGMENT_ENDS_ULAW, magnitude)
+    codes = np.where(segment >= 8, 0x7F, (np.minimum(segment, 7) << 4) | ((magnitude >> (segment + 1)) & 0x0F))
+    return (codes ^ mask).astype(np.uint8).tobytes()
+
+
+def g711_samples(payload):
+    return len(payload)
+
+
+def decode_ulaw(payload, sample_rate=16000, out=None):
+    return np.take(_ULAW_TABLE, np.frombuffer(payload, dtype=np.uint8), out=out)
+
+
+def encode_alaw(pcm, sample_rate=16000):
+    pcm = np.asarray(pcm, dtype=np.int32) >> 3
+    mask = np.where(pcm >= 0, 0xD5, 0x55)
+    magnitude = np.where(pcm >= 0, pcm, -pcm - 1)
+    segment = np.searchsorted(_SEGMENT_ENDS_ALAW, magnitude)
+    shift = np.where(segment < 2, 1, segment)
+    codes = np.where(segment >= 8, 0x7F, (np.minimum(segment, 7) << 4) | ((magnitude >> shift) & 0x0F))
+    return (codes ^ mask).astype(np.uint8).tobytes()
+
+
+def decode_alaw(payload, sample_rate=16000, out=None):
+    return np.take(_ALAW_TABLE, np.frombuffer(payload, dtype=np.uint8), out=out)
+
+
+# IMA-ADPCM, 4 bits per sample, in independent blocks like WAV's: a header with the first sample
+# and step index, then 4 bit codes for the rest, low nibble first. The recurrence is sequential
+# within a block, so the loop runs over sample positions and NumPy works across all blocks of a
+# frame at once. The payload starts with the total sample count.
+ADPCM_BLOCK_SAMPLES = 505
+_ADPCM_BLOCK_HEADER = struct.Struct("<hBB")
+_ADPCM_BLOCK_BYTES = _ADPCM_BLOCK_HEADER.size + (ADPCM_BLOCK_SAMPLES - 1) // 2
+_ADPCM_INDEX_TABLE = np.array([-1, -1, -1, -1, 2, 4, 6, 8] * 2)
+_ADPCM_STEP_TABLE = np.array([
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45, 50, 55, 60, 66, 73, 80, 88, 97,
+    107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796,
+    876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871,
+    5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623,
+    27086, 29794, 32767])
+_ADPCM_HEADER_DTYPE = np.dtype([("predictor", "<i2"), ("index", "u1"), ("reserved", "u1")])
+
+
+def _adpcm_step(predictor, index, codes):
+    """Apply one 4 bit code per block, returning the new predictor and step index."""
+    step = _ADPCM_STEP_TABLE[index]
+    delta = step >> 3
+    delta = delta + np.where(codes & 4, step, 0) + np.where(codes & 2, step >> 1, 0) + np.where(codes & 1, step >> 2, 0)
+    predictor = np.clip(np.where(codes & 8, predictor - delta, predictor + delta), -32768, 32767)
+    index = np.clip(index + _ADPCM_INDEX_TABLE[codes], 0, 88)
+    return predictor, index
+
+
+def encode_ima_adpcm(pcm, sample_rate=16000):
+    pcm = np.asarray(pcm, dtype=np.int32)
+    count = len(pcm)
+    if not count:
+        # An empty capture chunk is just the sample count, no blocks.
+        return struct.pack("<I", 0)
+    blocks = -(-count // ADPCM_BLOCK_SAMPLES)
+    samples = np.zeros((blocks, ADPCM_BLOCK_SAMPLES), dtype=np.int32)
+    samples.flat[:count] = pcm
+    predictor = samples[:, 0].copy()
+    # Blocks are encoded in parallel, so each starts from a step sized to its own opening samples.
+    opening = np.abs(np.diff(samples[:, :9], axis=1)).mean(axis=1)
+    index = np.minimum(np.searchsorted(_ADPCM_STEP_TABLE, opening), 88)
+    header = np.zeros(blocks, dtype=_ADPCM_HEADER_DTYPE)
+    header["predictor"], header["index"] = predictor, index
+    codes = np.zeros((blocks, ADPCM_BLOCK_SAMPLES - 1), dtype=np.int32)
+    for position in range(1, ADPCM_BLOCK_SAMPLES):
+        step = _ADPCM_STEP_TABLE[index]
+        difference = samples[:, position] - predictor
+        magnitude = np.abs(difference)
+        code = np.where(difference < 0, 8, 0)
+        for bit, scale in ((4, step), (2, step >> 1), (1, step >> 2)):
+            hit = magnitude >= scale
+            code |= np.where(hit, bit, 0)
+            magnitude = np.where(hit, magnitude - scale, magnitude)
+        codes[:, position - 1] = code
+        predictor, index = _adpcm_step(predictor, index, code)
+    packed = (codes[:, 0::2] | (codes[:, 1::2] << 4)).astype(np.uint8)
+    body = np.concatenate([header.view(np.uint8).reshape(blocks, -1), packed], axis=1)
+    return struct.pack("<I", count) + body.tobytes()
+
+
+def ima_adpcm_samples(payload):
+    # The count comes from the client, so it must fit the blocks that follow before anything is
+    # sized by it.
+    (count,) = struct.unpack_from("<I", payload)
+    blocks, remainder = divmod(len(payload) - 4, _ADPCM_BLOCK_BYTES)
+    if remainder or count > blocks * ADPCM_BLOCK_SAMPLES:
+        raise ProtocolError(f"IMA-ADPCM frame declares {count} samples in {len(payload) - 4} bytes of "
+                            f"{_ADPCM_BLOCK_BYTES} byte blocks")
+    return count
+
+
+def decode_ima_adpcm(payload, sample_rate=16000, out=None):
+    count = ima_adpcm_samples(payload)
+    body = np.frombuffer(payload, dtype=np.uint8, offset=4).reshape(-1, _ADPCM_BLOCK_BYTES)
+    header = body[:, :_ADPCM_HEADER_DTYPE.itemsize].copy().view(_ADPCM_HEADER_DTYPE)[:, 0]
+    packed = body[:, _ADPCM_HEADER_DTYPE.itemsize:].astype(np.int32)
+    codes = np.empty((len(body), ADPCM_BLOCK_SAMPLES - 1), dtype=np.int32)
+    codes[:, 0::2], codes[:, 1::2] = packed & 0x0F, packed >> 4
+    audio = np.empty((len(body), ADPCM_BLOCK_SAMPLES), dtype=np.float32)
+    predictor, index = header["predictor"].astype(np.int32), header["index"].astype(np.int32)
+    audio[:, 0] = predictor
+    for position in range(1, ADPCM_BLOCK_SAMPLES):
+        predictor, index = _adpcm_step(predictor, index, codes[:, position - 1])
+        audio[:, position] = predictor
+    audio = audio.reshape(-1)[:count]
+    return np.multiply(audio, PCM_SCALE, out=out if out is not None else audio)
+
+
+# FLAC is lossless and needs the optional soundfile package (libsndfile).
+def encode_flac(pcm, sample_rate=16000):
+    import soundfile
+    buffer = io.BytesIO()
+    soundfile.write(buffer, np.asarray(pcm, dtype=np.int16), sample_rate, format="FLAC", subtype="PCM_16")
+    return buffer.getvalue()
+
+
+def decode_flac(payload, sample_rate=16000, out=None):
+    import soundfile
+    audio, _ = soundfile.read(io.BytesIO(payload), dtype="float32")
+    audio = audio if audio.ndim == 1 else audio.mean(axis=1)
+    if out is not None:
+        out[:] = audio
+        return out
+    return audio
+
+
+CODECS = {codec.name: codec for codec in [
+    Codec("pcm_s16le", encode_pcm, decode_pcm, pcm_samples),
+    Codec("mulaw", encode_ulaw, decode_ulaw, g711_samples),
+    Codec("alaw", encode_alaw, decode_alaw, g711_samples),
+    Codec("ima_adpcm", encode_ima_adpcm, decode_ima_adpcm, ima_adpcm_samples),
+    # A FLAC frame's length is only known once it is decoded.
+    Codec("flac", encode_flac, decode_flac, lambda payload: None),
+]}
+
+
+def available_codecs():
+    """Names of the codecs that work in this environment."""
+    names = [name for name in CODECS if name != "flac"]
+    try:
+        import soundfile
+        if "FLAC" in soundfile.available_formats():
+            names.append("flac")
+    except (ImportError, OSError):
+        pass
+    return names
+
+
+def get_codec(name):
+    if name not in available_codecs():
+        raise ValueError(f"Unsupported encoding '{name}', expected one of {available_codecs()}")
+    return CODECS[name]
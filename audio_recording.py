@@ -0,0 +1,180 @@
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+# File layout, all little endian:
+#   header   magic "WRTA", version u16, channels u16, sample_rate u32, reserved u32   (16 bytes)
+#   frames   timestamp f64, payload bytes u32, reserved u32, then int16 PCM payload  (16 + n bytes)
+#   index    per frame: file offset of its header u64, timestamp f64, samples u32, reserved u32
+#   trailer  index offset u64, frame count u32, magic "WRTI"                            (16 bytes)
+# Frames are length prefixed, so PCM containing any byte value round trips, and every payload
+# starts on an even offset so it can be viewed as int16 straight out of the mmap.
+MAGIC = b"WRTA"
+INDEX_MAGIC = b"WRTI"
+VERSION = 1
+HEADER = struct.Struct("<4sHHII")
+FRAME_HEADER = struct.Struct("<dII")
+INDEX_ENTRY = np.dtype([("offset", "<u8"), ("timestamp", "<f8"), ("samples", "<u4"), ("reserved", "<u4")])
+TRAILER = struct.Struct("<QI4s")
+
+
+class RecordingWriter:
+    """Appends timestamped PCM frames to a recording and writes the index on close.
+
+    Frames are collected in memory and written in one bulk write every flush_bytes. Opening an
+    existing recording continues it: the old index is read back and overwritten by new frames.
+    """
+
+    def __init__(self, path, sample_rate=16000, channels=1, flush_bytes=1 << 20):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.flush_bytes = flush_bytes
+        self._pending = []
+        self._pending_bytes = 0
+        self._index = []
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with RecordingReader(path) as reader:
+                if (reader.sample_rate, reader.channels) != (sample_rate, channels):
+                    raise ValueError(f"{path} holds {reader.sample_rate} Hz {reader.channels} channel audio, "
+                                     f"cannot append {sample_rate} Hz {channels} channel audio")
+                self._index = [tuple(entry) for entry in reader.index.tolist()]
+                end = reader.data_end
+            self._file = open(path, "r+b")
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._file = open(path, "wb")
+            self._file.write(HEADER.pack(MAGIC, VERSION, channels, sample_rate, 0))
+        self._offset = self._file.tell()
+
+    def write(self, pcm_bytes, timestamp=None):
+        """Add one frame of int16 PCM, timestamped now unless a capture time is given."""
+        if len(pcm_bytes) % (2 * self.channels):
+            raise ValueError(f"Frame of {len(pcm_bytes)} bytes is not a whole number of int16 samples")
+        timestamp = time.time() if timestamp is None else timestamp
+        self._pending.append(FRAME_HEADER.pack(timestamp, len(pcm_bytes), 0))
+        self._pending.append(pcm_bytes)
+        self._index.append((self._offset, timestamp, len(pcm_bytes) // (2 * self.channels), 0))
+        self._offset += FRAME_HEADER.size + len(pcm_bytes)
+        self._pending_bytes += FRAME_HEADER.size + len(pcm_bytes)
+        if self._pending_bytes >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        self._file.writelines(self._pending)
+        self._file.flush()
+        self._pending = []
+        self._pending_bytes = 0
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        index = np.array(self._index, dtype=INDEX_ENTRY)
+        self._file.write(index.tobytes())
+        self._file.write(TRAILER.pack(self._offset, len(self._index), INDEX_MAGIC))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RecordingReader:
+    """Memory maps a recording and hands out zero-copy int16 views of its frames.
+
+    A recording that was never closed (no index trailer) is still readable: the frames are
+    scanned once to rebuild the index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.channels, self.sample_rate, _ = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a recording (bad magic {magic!r})")
+        if version != VERSION:
+            raise ValueError(f"{path} has unsupported recording version {version}")
+        self.index, self.data_end = self._read_index()
+        # Recording time of each frame's first sample, relative to the first frame.
+        self.starts = self.index["timestamp"] - (self.index["timestamp"][0] if len(self.index) else 0.0)
+
+    def _read_index(self):
+        size = len(self._mmap)
+        if size >= HEADER.size + TRAILER.size:
+            index_offset, count, magic = TRAILER.unpack_from(self._mmap, size - TRAILER.size)
+            if magic == INDEX_MAGIC and index_offset + count * INDEX_ENTRY.itemsize + TRAILER.size == size:
+                index = np.frombuffer(self._mmap, dtype=INDEX_ENTRY, count=count, offset=index_offset)
+                return index, index_offset
+        entries = []
+        offset = HEADER.size
+        while offset + FRAME_HEADER.size <= size:
+            timestamp, length, _ = FRAME_HEADER.unpack_from(self._mmap, offset)
+            if offset + FRAME_HEADER.size + length > size:
+                # Torn write at the end of an interrupted recording.
+                break
+            entries.append((offset, timestamp, length // (2 * self.channels), 0))
+            offset += FRAME_HEADER.size + length
+        return np.array(entries, dtype=INDEX_ENTRY), offset
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def duration(self):
+        return float(self.index["samples"].sum()) / self.sample_rate
+
+    def frame(self, number):
+        """Zero-copy int16 view of one frame's samples, shaped (samples,) or (samples, channels)."""
+        entry = self.index[number]
+        samples = int(entry["samples"])
+        view = np.frombuffer(self._mmap, dtype="<i2", count=samples * self.channels,
+                             offset=int(entry["offset"]) + FRAME_HEADER.size)
+        return view if self.channels == 1 else view.reshape(samples, self.channels)
+
+    def timestamp(self, number):
+        return float(self.index[number]["timestamp"])
+
+    def __iter__(self):
+        for number in range(len(self)):
+            yield self.frame(number)
+
+    def time_range(self, start, end):
+        """Zero-copy views covering [start, end) seconds of recording time, one per frame touched.
+
+        Times are measured from the first frame's timestamp, so gaps between captures are kept.
+        """
+        views = []
+        ends = self.starts + self.index["samples"] / self.sample_rate
+        for number in np.flatnonzero((ends > start) & (self.starts < end)):
+            first = max(0, int(round((start - self.starts[number]) * self.sample_rate)))
+            last = int(round((end - self.starts[number]) * self.sample_rate))
+            views.append(self.frame(number)[first:last])
+        return views
+
+    def read_range(self, start, end):
+        """Like time_range but joined into one contiguous array (this one copies)."""
+        views = self.time_range(start, end)
+        return np.concatenate(views) if views else np.zeros(0, dtype=np.int16)
+
+    def close(self):
+        # Views handed out keep the mmap alive, only close what nobody references any more.
+        self.index = self.index.copy()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,208 @@
+import asyncio
+import time
+
+import numpy as np
+
+from inference_executor import InferenceResult
+
+
+class BatchScheduler:
+    """Micro-batches chunks from many connections into single model calls.
+
+    Requests are collected until max_batch_size chunks are waiting or max_wait seconds have
+    passed since the first one arrived, then run_batch(model, [audio, ...], languages=[...],
+    prompts=[...], **batch_kwargs) is submitted to the executor and each result is routed back to
+    the awaiting caller. A new batch is only formed once a worker is free, so while every worker
+    is busy requests pile up and batches grow with load.
+
+    Knobs for the latency/throughput tradeoff:
+      max_batch_size  upper bound on chunks per model call, 1 disables batching.
+      max_wait        how long the first chunk of a batch may wait for company.
+      max_inflight    batches running at once, defaults to the executor's worker count.
+    """
+
+    def __init__(self, executor, run_batch, max_batch_size=8, max_wait=0.01, max_inflight=None,
+                 **batch_kwargs):
+        self.executor = executor
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batch_kwargs = batch_kwargs
+        self._inflight = asyncio.Semaphore(max_inflight or executor.max_workers)
+        self._queue = asyncio.Queue()
+        self._collector = None
+        self._running = set()
+
+    def start(self):
+        if self._collector is None:
+            self._collector = asyncio.create_task(self._collect_batches())
+
+    async def close(self):
+        if self._collector is not None:
+            self._collector.cancel()
+            self._collector = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    async def submit(self, audio_np, language=None, prompt=None):
+        """Queue one chunk and await its InferenceResult. language None lets the model detect it,
+        prompt is earlier text for the decoder to continue from."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((audio_np, future, time.monotonic(), language, prompt))
+        return await future
+
+    async def _next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        # Callers that went away while we were collecting don't need a decode.
+        return [item for item in batch if not item[1].done()]
+
+    async def _collect_batches(self):
+        while True:
+            await self._inflight.acquire()
+            try:
+                batch = await self._next_batch()
+            except BaseException:
+                self._inflight.release()
+                raise
+            if not batch:
+                self._inflight.release()
+                continue
+            task = asyncio.create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run_batch(self, batch):
+        try:
+            submitted = time.monotonic()
+            result = await self.executor.submit(self.run_batch, [item[0] for item in batch],
+                                                languages=[item[3] for item in batch],
+                                                prompts=[item[4] for item in batch], **self.batch_kwargs)
+        except Exception as e:
+            for _, future, _, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._inflight.release()
+        for (_, future, enqueued, _, _), value in zip(batch, result.value):
+            if not future.done():
+                queue_wait = submitted - enqueued + result.queue_wait
+                future.set_result(InferenceResult(value, queue_wait, result.compute, len(batch)))
+
+
+def run_faster_whisper_batch(audio_model, audio_batch, beam_size=5, languages=None, prompts=None,
+                             timestamps=False):
+    """Encode and decode a batch of chunks with a single faster_whisper forward pass.
+
+    Each chunk is turned into log-mel features and zero padded to the model's 30 second window,
+    the padded batch goes through the encoder once, and the decoder generates every sequence in
+    the same call. Chunks longer than one window can't share a pass and fall back to the normal
+    transcribe path. languages gives a known language per chunk, language detection only runs
+    for chunks without one. prompts gives each chunk's previous text as token ids (or None), it
+    goes in front of the start sequence the way faster_whisper's own prompts do. Returns a list of
+    (text, language, language_probability, avg_logprob), where the probability is None for a
+    language that was given. With timestamps the decoder predicts timestamp tokens too, and each
+    result ends with its segments as (start, end, text) in seconds from the start of the chunk.
+    """
+    import ctranslate2
+    from faster_whisper.tokenizer import Tokenizer
+
+    feature_extractor = audio_model.feature_extractor
+    languages = languages or [None] * len(audio_batch)
+    prompts = prompts or [None] * len(audio_batch)
+    results = [None] * len(audio_batch)
+    batched = []
+    for index, audio in enumerate(audio_batch):
+        if len(audio) <= feature_extractor.n_samples:
+            batched.append(index)
+        else:
+            segments, info = audio_model.transcribe(audio, beam_size=beam_size, language=languages[index],
+                                                    initial_prompt=prompts[index])
+            segments = list(segments)
+            text = ' '.join([segment.text for segment in segments]).strip()
+            avg_logprob = sum(segment.avg_logprob for segment in segments) / len(segments) if segments else None
+            results[index] = (text, info.language, None if languages[index] else info.language_probability,
+                              avg_logprob)
+            if timestamps:
+                results[index] += ([(segment.start, segment.end, segment.text.strip()) for segment in segments],)
+    if not batched:
+        return results
+
+    # Pad every chunk's features to the fixed encoder input size.
+    features = [feature_extractor(audio_batch[index]) for index in batched]
+    padded = np.zeros((len(features), features[0].shape[0], feature_extractor.nb_max_frames),
+                      dtype=np.float32)
+    for row, feature in enumerate(features):
+        frames = min(feature.shape[-1], feature_extractor.nb_max_frames)
+        padded[row, :, :frames] = feature[:, :frames]
+    encoder_output = audio_model.model.encode(ctranslate2.StorageView.from_array(padded), to_cpu=False)
+
+    chosen = [(languages[index], None) for index in batched]
+    if not audio_model.model.is_multilingual:
+        chosen = [("en", None)] * len(batched)
+    elif any(language is None for language, _ in chosen):
+        # Detection runs for the whole encoder batch, its result is only used where no language was given.
+        detected = [candidates[0] for candidates in audio_model.model.detect_language(encoder_output)]
+        chosen = [(language, None) if language else (token[2:-2], probability)
+                  for (language, _), (token, probability) in zip(chosen, detected)]
+
+    tokenizers = [Tokenizer(audio_model.hf_tokenizer, audio_model.model.is_multilingual,
+                            task="transcribe", language=language) for language, _ in chosen]
+    sequences = [([tokenizer.sot_prev] + list(prompts[index]) if prompts[index] else [])
+               + list(tokenizer.sot_sequence) + ([] if timestamps else [tokenizer.no_timestamps])
+               for index, tokenizer in zip(batched, tokenizers)]
+    # 448 is the decoder's maximum sequence length for every Whisper checkpoint. Scores are the
+    # length normalized log probability, i.e. the average token log probability.
+    generated = audio_model.model.generate(encoder_output, sequences,
+                                           beam_size=beam_size, max_length=448, suppress_blank=True,
+                                           suppress_tokens=[-1], return_scores=True)
+    for index, tokenizer, (language, probability), output in zip(batched, tokenizers, chosen, generated):
+        # decode() leaves out timestamp tokens, they all come after the end of text token.
+        results[index] = (tokenizer.decode(output.sequences_ids[0]).strip(), language, probability,
+                          output.scores[0])
+        if timestamps:
+            duration = len(audio_batch[index]) / feature_extractor.sampling_rate
+            results[index] += (_timestamped_segments(tokenizer, output.sequences_ids[0], duration),)
+    return results
+
+
+def _timestamped_segments(tokenizer, tokens, duration):
+    """Split generated tokens at their timestamps into (start, end, text) segments.
+
+    Whisper brackets every segment with a start and an end timestamp token, 20 ms apart per step.
+    Text after the last timestamp, cut off by the window, ends at duration.
+    """
+    segments = []
+    start, text_tokens = None, []
+    for token in tokens:
+        if token < tokenizer.timestamp_begin:
+            text_tokens.append(token)
+            continue
+        seconds = min((token - tokenizer.timestamp_begin) * 0.02, duration)
+        if start is None:
+            start = seconds
+            continue
+        text = tokenizer.decode(text_tokens).strip()
+        if text:
+            segments.append((start, seconds, text))
+        start, text_tokens = None, []
+    text = tokenizer.decode(text_tokens).strip()
+    if text:
+        segments.append((start if start is not None else 0.0, duration, text))
+    return segments
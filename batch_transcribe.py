@@ -0,0 +1,243 @@
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import time
+
+import numpy as np
+
+from audio_capture import SAMPLE_RATE, load_audio
+from engines import ENGINES, load_engine
+from model_manager import select_compute_type, select_device
+from vad import VoiceActivityGate
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".ogg", ".mp3", ".m4a", ".opus", ".wrta")
+
+
+def find_audio_files(paths):
+    """The given files, and every audio file under the given directories, in a stable order."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names)
+                             if name.lower().endswith(AUDIO_EXTENSIONS))
+        else:
+            files.append(path)
+    return files
+
+
+def split_on_silence(audio_np, max_chunk_seconds=30.0, block_seconds=30.0):
+    """Cut audio into chunks of at most max_chunk_seconds at pauses, leaving out the silence
+    between chunks.
+
+    The voice activity gate runs over the file in blocks, so its noise floor follows the recording.
+    Speech runs are packed greedily into chunks as long as Whisper's window allows, since every
+    decode pays for the full window anyway, so a chunk keeps the pauses between the runs it holds;
+    a run longer than that is cut where it has to be. Returns a list of (start, end) sample offsets.
+    """
+    gate = VoiceActivityGate(sample_rate=SAMPLE_RATE)
+    frame = gate.frame_length
+    block = max(1, int(block_seconds * SAMPLE_RATE) // frame) * frame
+    if not len(audio_np):
+        return []
+    mask = np.concatenate([gate.speech_mask(audio_np[start:start + block])
+                           for start in range(0, len(audio_np), block)])
+    # Speech runs as [start, end) frame ranges.
+    edges = np.flatnonzero(np.diff(np.concatenate([[False], mask, [False]]).astype(np.int8)))
+    runs = [(start * frame, min(end * frame, len(audio_np))) for start, end in zip(edges[::2], edges[1::2])]
+    max_samples = int(max_chunk_seconds * SAMPLE_RATE)
+    chunks = []
+    for start, end in runs:
+        if chunks and end - chunks[-1][0] <= max_samples:
+            chunks[-1] = (chunks[-1][0], end)
+            continue
+        while end - start > max_samples:
+            chunks.append((start, start + max_samples))
+            start += max_samples
+        chunks.append((start, end))
+    return chunks
+
+
+def prepare_file(path, max_chunk_seconds):
+    """Decode and split one file. Runs in the decoder processes. Returns (duration, chunks) with
+    chunks a list of (start seconds, end seconds, audio)."""
+    audio_np = load_audio(path)
+    chunks = [(start / SAMPLE_RATE, end / SAMPLE_RATE, audio_np[start:end])
+              for start, end in split_on_silence(audio_np, max_chunk_seconds)]
+    return len(audio_np) / SAMPLE_RATE, chunks
+
+
+def read_checkpoint(output):
+    """Files already in output, as (transcribed, failed) sets. A line cut off by an interruption is
+    removed. A file retried after a failure has a later line, the last one counts."""
+    done, failed = set(), set()
+    if not os.path.exists(output):
+        return done, failed
+    with open(output, "rb+") as file:
+        data = file.read()
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            file.truncate(end)
+    for line in data[:end].splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if "error" in record:
+            failed.add(record["file"])
+            done.discard(record["file"])
+        else:
+            done.add(record["file"])
+            failed.discard(record["file"])
+    return done, failed
+
+
+class Throughput:
+    """Audio hours transcribed per wall clock hour, over the files processed by this run."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.files = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+        self.speech_seconds = 0.0
+        self.decode_seconds = 0.0
+
+    def summary(self):
+        wall = time.monotonic() - self.started
+        rate = self.audio_seconds / wall if wall else 0.0
+        return (f"{self.files} file(s), {self.failed} failed, {self.audio_seconds / 3600:.2f} audio hours "
+                f"({self.speech_seconds / 3600:.2f} speech) in {wall / 3600:.3f} wall hours: "
+                f"{rate:.1f} audio-hours per wall-hour, model busy {self.decode_seconds / wall if wall else 0:.0%}")
+
+
+def transcribe(args):
+    files = find_audio_files(args.inputs)
+    done, failed = read_checkpoint(args.output)
+    skip = done if args.retry_failed else done | failed
+    todo = [path for path in files if path not in skip]
+    print(f"{len(files)} file(s), {len(files) - len(todo)} already in {args.output}, {len(todo)} to transcribe")
+    if not todo:
+        return
+    device = select_device(args.device)
+    engine = load_engine(args.engine, args.model, device=device,
+                         compute_type=select_compute_type(device, args.compute_type),
+                         cpu_threads=args.cpu_threads, beam_size=args.beam_size)
+    stats = Throughput()
+    last_report = time.monotonic()
+    # Files whose chunks are waiting to be decoded: path -> [duration, results, chunks left].
+    open_files = collections.OrderedDict()
+    batch = []
+
+    with open(args.output, "a") as output, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=args.decoders) as decoders:
+
+        def write(record):
+            output.write(json.dumps(record) + "\n")
+            output.flush()
+            # Every line on disk is a checkpoint, a killed run loses at most the files in flight.
+            os.fsync(output.fileno())
+
+        def finish(path):
+            duration, segments, _ = open_files.pop(path)
+            languages = collections.Counter()
+            for segment in segments:
+                languages[segment.pop("language")] += segment["end"] - segment["start"]
+            write({"file": path, "duration": round(duration, 3),
+                   "language": languages.most_common(1)[0][0] if languages else None, "segments": segments})
+            stats.files += 1
+            stats.audio_seconds += duration
+            stats.speech_seconds += sum(segment["end"] - segment["start"] for segment in segments)
+
+        def decode_batch():
+            started = time.monotonic()
+            results = engine.transcribe_batch([audio for _, _, _, audio in batch],
+                                              [args.language] * len(batch) if args.language else None,
+                                              timestamps=True)
+            stats.decode_seconds += time.monotonic() - started
+            for (path, start, end, _), (_, language, _, avg_logprob, segments) in zip(batch, results):
+                state = open_files[path]
+                # The model's own segments, moved from chunk time to file time.
+                for segment_start, segment_end, text in segments:
+                    state[1].append({"start": round(start + segment_start, 3),
+                                     "end": round(min(start + segment_end, end), 3), "text": text,
+                                     "avg_logprob": None if avg_logprob is None else round(avg_logprob, 4),
+                                     "language": language})
+                state[2] -= 1
+                if not state[2]:
+                    finish(path)
+            batch.clear()
+
+        # Decode a bounded number of files ahead of the model, so memory doesn't grow with the directory.
+        pending = collections.deque()
+        remaining = iter(todo)
+        try:
+            while True:
+                while len(pending) < 2 * args.decoders:
+                    path = next(remaining, None)
+                    if path is None:
+                        break
+                    pending.append((path, decoders.submit(prepare_file, path, args.max_chunk_seconds)))
+                if not pending:
+                    break
+                path, future = pending.popleft()
+                try:
+                    duration, chunks = future.result()
+                except Exception as e:
+                    print(f"{path}: {e!r}")
+                    stats.failed += 1
+                    write({"file": path, "error": repr(e)})
+                    continue
+                open_files[path] = [duration, [], len(chunks)]
+                if not chunks:
+                    finish(path)
+                for start, end, audio in chunks:
+                    batch.append((path, start, end, audio))
+                    if len(batch) >= args.batch_size:
+                        decode_batch()
+                if time.monotonic() - last_report > args.report_seconds:
+                    last_report = time.monotonic()
+                    print(stats.summary())
+            if batch:
+                decode_batch()
+        except KeyboardInterrupt:
+            for _, future in pending:
+                future.cancel()
+            print(f"Interrupted, {len(open_files)} file(s) in flight will be transcribed again on the next run")
+    print(stats.summary())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe directories of recordings offline, with batched "
+                                                 "inference and resumable JSONL output.")
+    parser.add_argument("inputs", nargs="+", help="Audio files or directories searched for "
+                                                  f"{', '.join(AUDIO_EXTENSIONS)} files.")
+    parser.add_argument("--output", default="transcripts.jsonl",
+                        help="JSONL file with one line per file. Files already in it are skipped.", type=str)
+    parser.add_argument("--retry_failed", action='store_true',
+                        help="Transcribe files again that failed to decode in an earlier run.")
+    parser.add_argument("--engine", default="faster_whisper", choices=list(ENGINES), help="Inference backend.")
+    parser.add_argument("--model", default="base", help="Model size.", type=str)
+    parser.add_argument("--device", default="auto", choices=["auto", "cuda", "cpu"],
+                        help="Where to run the model, auto picks cuda when a GPU is available.")
+    parser.add_argument("--compute_type", default="auto",
+                        help="CTranslate2 compute type, auto picks float16 on GPU and int8 on CPU.", type=str)
+    parser.add_argument("--cpu_threads", default=0, help="Threads per model on CPU, 0 is the library default.",
+                        type=int)
+    parser.add_argument("--beam_size", default=5, help="Beam width of every decode, 1 is greedy.", type=int)
+    parser.add_argument("--language", default=None, help="Language of every file, detected per chunk when "
+                                                         "omitted.", type=str)
+    parser.add_argument("--batch_size", default=8, help="Chunks decoded in one forward pass.", type=int)
+    parser.add_argument("--decoders", default=2, help="Processes decoding and splitting files ahead of the model.",
+                        type=int)
+    parser.add_argument("--max_chunk_seconds", default=30.0,
+                        help="Longest chunk after splitting on silence, Whisper's window is 30 seconds.", type=float)
+    parser.add_argument("--report_seconds", default=60, help="Seconds between throughput reports.", type=float)
+    transcribe(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
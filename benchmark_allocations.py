@@ -0,0 +1,84 @@
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from audio_buffer import AudioRingBuffer
+
+SAMPLE_RATE = 16000
+
+
+class ConcatenateBuffer:
+    """The previous ingest path: convert each chunk through a temporary float array, then
+    concatenate it onto the rolling buffer."""
+
+    def __init__(self):
+        self.audio = np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.audio)
+
+    def append_pcm(self, pcm_bytes):
+        audio_np = np.frombuffer(pcm_bytes, dtype=np.int16).astype(np.float32) / 32768.0
+        self.audio = np.concatenate([self.audio, audio_np])
+
+    def consume(self, samples):
+        self.audio = self.audio[samples:]
+
+
+def run(make_buffer, chunks, sessions, keep_seconds):
+    """Feed every chunk to every session, trimming each buffer back to keep_seconds like a commit
+    would. Returns (peak bytes, bytes held at the end, transient bytes per chunk, microseconds per
+    chunk)."""
+    keep = int(keep_seconds * SAMPLE_RATE)
+    tracemalloc.start()
+    buffers = [make_buffer() for _ in range(sessions)]
+    transient = 0
+    started = time.perf_counter()
+    for pcm_bytes in chunks:
+        for buffer in buffers:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            buffer.append_pcm(pcm_bytes)
+            if len(buffer) > keep:
+                buffer.consume(len(buffer) - keep)
+            transient += tracemalloc.get_traced_memory()[1] - before
+    elapsed = time.perf_counter() - started
+    held, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    calls = len(chunks) * sessions
+    return peak, held, transient / calls, elapsed / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Allocations of the ingest path, concatenation against the "
+                                                 "preallocated ring buffer.")
+    parser.add_argument("--sessions", default=32, help="Concurrent sessions, each with its own buffer.", type=int)
+    parser.add_argument("--chunks", default=100, help="Chunks sent by every session.", type=int)
+    parser.add_argument("--chunk_seconds", default=0.5, help="Audio per chunk.", type=float)
+    parser.add_argument("--keep_seconds", default=15, help="Uncommitted audio each buffer holds at most.",
+                        type=float)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    chunks = [rng.integers(-3000, 3000, int(args.chunk_seconds * SAMPLE_RATE), dtype=np.int16).tobytes()
+              for _ in range(args.chunks)]
+    chunk_float_bytes = int(args.chunk_seconds * SAMPLE_RATE) * 4
+    print(f"{args.sessions} sessions x {args.chunks} chunks of {args.chunk_seconds}s, "
+          f"buffers trimmed to {args.keep_seconds}s")
+    print(f"{'buffer':>12} {'peak MiB':>9} {'held MiB':>9} {'alloc KiB/chunk':>16} {'x chunk size':>13} "
+          f"{'us/chunk':>9}")
+    for name, make_buffer in [("concatenate", ConcatenateBuffer),
+                              # The least capacity that holds keep_seconds and the chunk appended before the trim.
+                              ("ring", lambda: AudioRingBuffer(args.keep_seconds + args.chunk_seconds))]:
+        peak, held, transient, micros = run(make_buffer, chunks, args.sessions, args.keep_seconds)
+        print(f"{name:>12} {peak / 2 ** 20:>9.1f} {held / 2 ** 20:>9.1f} {transient / 1024:>16.1f} "
+              f"{transient / chunk_float_bytes:>13.2f} {micros:>9.1f}")
+    print("The ring's peak and held memory are its storage, allocated once per session at capacity plus a "
+          "spare quarter and kept for the session's lifetime, so they can exceed concatenation's. What it "
+          "removes is the allocation and copy of every chunk (alloc KiB/chunk) and the time they take.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import functools
+import time
+
+import numpy as np
+
+from batch_scheduler import BatchScheduler, run_faster_whisper_batch
+from engines import load_engine, run_batch_transcription
+from inference_executor import InferenceExecutor
+
+SAMPLE_RATE = 16000
+
+
+def load_faster_whisper(model_size):
+    from faster_whisper import WhisperModel
+    return WhisperModel(model_size, device="cpu", compute_type="int8")
+
+
+def make_chunk(rng, min_seconds, max_seconds):
+    """Synthetic speech-like chunk: a few modulated tones plus a little noise."""
+    seconds = rng.uniform(min_seconds, max_seconds)
+    t = np.arange(int(seconds * SAMPLE_RATE), dtype=np.float32) / SAMPLE_RATE
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+    tone = sum(np.sin(2 * np.pi * frequency * t) for frequency in rng.uniform(120, 900, 3)) / 3
+    noise = rng.normal(0, 0.01, len(t))
+    return (0.3 * envelope * tone + noise).astype(np.float32)
+
+
+async def run_clients(scheduler, clients, requests_per_client, chunks):
+    """Closed loop clients: each sends its next chunk as soon as the previous one is answered."""
+    latencies = []
+    batch_sizes = []
+
+    async def client(index):
+        for request in range(requests_per_client):
+            audio = chunks[(index * requests_per_client + request) % len(chunks)]
+            started = time.perf_counter()
+            result = await scheduler.submit(audio)
+            latencies.append(time.perf_counter() - started)
+            batch_sizes.append(result.batch_size)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client(index) for index in range(clients)])
+    return time.perf_counter() - started, latencies, batch_sizes
+
+
+async def benchmark(args):
+    rng = np.random.default_rng(0)
+    chunks = [make_chunk(rng, args.min_seconds, args.max_seconds) for _ in range(32)]
+    audio_seconds_per_request = sum(len(chunk) for chunk in chunks) / len(chunks) / SAMPLE_RATE
+
+    if args.engine == "stub":
+        # The server's StubEngine, which takes the beam size when it is loaded.
+        load_model = functools.partial(load_engine, "stub", "stub", beam_size=args.beam_size,
+                                       call_overhead=args.stub_overhead, item_cost=args.stub_item_cost)
+        run_batch, batch_kwargs = run_batch_transcription, {}
+    else:
+        load_model = functools.partial(load_faster_whisper, args.model)
+        run_batch, batch_kwargs = run_faster_whisper_batch, {"beam_size": args.beam_size}
+    executor = InferenceExecutor(load_model, max_workers=args.workers, shared_model=True)
+    # Load the model before timing anything.
+    await executor.submit(lambda model: None)
+
+    print(f"{'batch':>5} {'chunks/s':>9} {'audio s/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'avg batch':>9}")
+    for batch_size in args.batch_sizes:
+        scheduler = BatchScheduler(executor, run_batch, max_batch_size=batch_size,
+                                   max_wait=args.batch_wait_ms / 1000, **batch_kwargs)
+        elapsed, latencies, batch_sizes = await run_clients(scheduler, args.clients, args.requests, chunks)
+        await scheduler.close()
+        throughput = len(latencies) / elapsed
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        print(f"{batch_size:>5} {throughput:>9.2f} {throughput * audio_seconds_per_request:>10.2f} "
+              f"{p50:>8.0f} {p95:>8.0f} {np.mean(batch_sizes):>9.2f}")
+    executor.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput vs. p95 latency of cross-connection batching.")
+    parser.add_argument("--engine", default="stub", choices=["stub", "faster_whisper"],
+                        help="Use the simulated stub model or a real faster_whisper model on CPU.")
+    parser.add_argument("--model", default="tiny", help="faster_whisper model size.", type=str)
+    parser.add_argument("--batch_sizes", default=[1, 2, 4, 8, 16], nargs="+", type=int,
+                        help="Max batch sizes to compare.")
+    parser.add_argument("--batch_wait_ms", default=20, help="Max time to wait to fill a batch.", type=float)
+    parser.add_argument("--clients", default=16, help="Concurrent simulated clients.", type=int)
+    parser.add_argument("--requests", default=10, help="Chunks sent by each client.", type=int)
+    parser.add_argument("--workers", default=1, help="Inference workers.", type=int)
+    parser.add_argument("--beam_size", default=5, type=int)
+    parser.add_argument("--min_seconds", default=2, help="Shortest chunk length.", type=float)
+    parser.add_argument("--max_seconds", default=5, help="Longest chunk length.", type=float)
+    parser.add_argument("--stub_overhead", default=0.15, help="Stub fixed cost per model call.", type=float)
+    parser.add_argument("--stub_item_cost", default=0.02, help="Stub cost per chunk in a batch.", type=float)
+    asyncio.run(benchmark(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import stub_engine
+from audio_recording import RecordingReader
+from benchmark_codecs import load_faster_whisper, word_error_rate
+from streaming_transcriber import StreamingTranscriber, faster_whisper_word_segments, join_words
+
+SAMPLE_RATE = 16000
+# Queued after a phrase's last chunk, once the pause that ends it has passed.
+END_OF_PHRASE = "end of phrase"
+
+
+def segments_text(segments):
+    return ' '.join(text.strip() for _, words in segments for _, _, text in words)
+
+
+def load_phrases(args):
+    """Phrases as lists of float32 chunks. A recording is split at its silent frames."""
+    if args.file:
+        phrases, current = [], []
+        with RecordingReader(args.file) as recording:
+            for frame in recording:
+                chunk = np.array(frame, dtype=np.float32) / 32768.0
+                if np.sqrt(np.mean(np.square(chunk))) >= args.silence_rms:
+                    current.append(chunk)
+                elif current:
+                    phrases.append(current)
+                    current = []
+        return phrases + [current] if current else phrases
+    rng = np.random.default_rng(0)
+    samples = int(args.chunk_seconds * SAMPLE_RATE)
+    chunks = int(round(args.phrase_seconds / args.chunk_seconds))
+    return [[rng.uniform(-0.3, 0.3, samples).astype(np.float32) for _ in range(chunks)]
+            for _ in range(args.phrases)]
+
+
+async def run(phrases, partial_model, final_model, args):
+    """Stream the phrases in real time the way a protocol session would. Returns, per phrase,
+    (seconds to the first text, seconds from its end to the final, partial text, final text)."""
+    loop = asyncio.get_running_loop()
+    # Like the server: partials and finals decode on separate executors, so a long final never
+    # holds up the partials of the next phrase.
+    partial_pool = ThreadPoolExecutor(max_workers=1)
+    final_pool = ThreadPoolExecutor(max_workers=1)
+    arrivals = asyncio.Queue()
+    results = []
+
+    async def feed():
+        for phrase in phrases:
+            for chunk in phrase:
+                await asyncio.sleep(args.chunk_seconds)
+                arrivals.put_nowait((time.perf_counter(), chunk))
+            await asyncio.sleep(args.pause_seconds)
+            arrivals.put_nowait((time.perf_counter(), END_OF_PHRASE))
+        arrivals.put_nowait((time.perf_counter(), None))
+
+    async def final(audio, ended, result):
+        segments = await loop.run_in_executor(final_pool, faster_whisper_word_segments, final_model, audio, None)
+        result[1], result[3] = time.perf_counter() - ended, segments_text(segments)
+
+    feeder = asyncio.create_task(feed())
+    finals = []
+    stream, audio, started, first_text = StreamingTranscriber(), [], None, None
+    while True:
+        arrived, item = await arrivals.get()
+        if item is None:
+            break
+        if item is END_OF_PHRASE:
+            stream.finish()
+            partial_text = join_words(stream.committed)
+            result = [first_text, time.perf_counter() - arrived, partial_text, partial_text]
+            if final_model is not None:
+                finals.append(asyncio.create_task(final(np.concatenate(audio), arrived, result)))
+            results.append(result)
+            stream, audio, started, first_text = StreamingTranscriber(), [], None, None
+            continue
+        started = started or arrived
+        stream.insert_audio(item)
+        audio.append(item)
+        # Catch up on everything that arrived during the last decode with a single decode.
+        if not arrivals.empty():
+            continue
+        segments = await loop.run_in_executor(partial_pool, faster_whisper_word_segments, partial_model,
+                                              *stream.prepare())
+        stream.update(segments)
+        if first_text is None and (stream.committed or stream.tentative):
+            first_text = time.perf_counter() - started
+    await asyncio.gather(feeder, *finals)
+    partial_pool.shutdown()
+    final_pool.shutdown()
+    return results
+
+
+def benchmark(args):
+    phrases = load_phrases(args)
+    if args.engine == "stub":
+        small = stub_engine.load_stub_model(call_overhead=args.stub_small_seconds, item_cost=0,
+                                            word_error_rate=args.stub_small_errors)
+        large = stub_engine.load_stub_model(call_overhead=args.stub_large_seconds, item_cost=0,
+                                            word_error_rate=args.stub_large_errors)
+        exact = stub_engine.load_stub_model(call_overhead=0, item_cost=0)
+        references = [segments_text(faster_whisper_word_segments(exact, np.concatenate(phrase), None))
+                      for phrase in phrases]
+    else:
+        small, large = load_faster_whisper(args.partial_model), load_faster_whisper(args.model)
+        if args.reference:
+            with open(args.reference) as reference:
+                references = [line.strip() for line in reference]
+        else:
+            # Without a reference the large model's offline transcript of each phrase is the truth.
+            references = [segments_text(faster_whisper_word_segments(large, np.concatenate(phrase), None))
+                          for phrase in phrases]
+
+    audio_seconds = sum(len(chunk) for phrase in phrases for chunk in phrase) / SAMPLE_RATE
+    print(f"{len(phrases)} phrases, {audio_seconds:.1f}s of audio in {args.chunk_seconds}s chunks")
+    print(f"{'mode':>8} {'first text s':>13} {'max':>6} {'final delay s':>14} {'max':>6} "
+          f"{'partial WER':>12} {'final WER':>10}")
+    for mode, partial_model, final_model in [("small", small, None), ("large", large, None),
+                                             ("cascade", small, large)]:
+        results = asyncio.run(run(phrases, partial_model, final_model, args))
+        # A phrase the partials never caught up with only shows text with its final, it is left out.
+        first = [first_text for first_text, *_ in results if first_text is not None]
+        delays = [delay for _, delay, _, _ in results]
+        partial_wer = np.mean([word_error_rate(reference, partial)
+                               for reference, (_, _, partial, _) in zip(references, results)])
+        final_wer = np.mean([word_error_rate(reference, final)
+                             for reference, (_, _, _, final) in zip(references, results)])
+        print(f"{mode:>8} {np.mean(first) if first else float('nan'):>13.2f} "
+              f"{max(first, default=float('nan')):>6.2f} {np.mean(delays):>14.2f} {max(delays):>6.2f} {partial_wer:>12.3f} {final_wer:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time to first text and final accuracy of a small model, a large "
+                                                 "model and the cascade of both.")
+    parser.add_argument("--engine", default="stub", choices=["stub", "faster_whisper"],
+                        help="Models to compare.")
+    parser.add_argument("--partial_model", default="tiny", help="faster_whisper model for the partials.", type=str)
+    parser.add_argument("--model", default="small", help="faster_whisper model for the finals.", type=str)
+    parser.add_argument("--reference", default=None, help="Text file with the reference transcript, one line per "
+                                                          "phrase. Defaults to the large model's offline output.",
+                        type=str)
+    parser.add_argument("--file", default=None, help="Recording made by microphone_recorder.py, split into "
+                                                     "phrases at its silent frames. Synthetic phrases when omitted.",
+                        type=str)
+    parser.add_argument("--silence_rms", default=0.005, help="Frames quieter than this end a phrase.", type=float)
+    parser.add_argument("--phrases", default=4, help="Synthetic phrases.", type=int)
+    parser.add_argument("--phrase_seconds", default=4, help="Length of each synthetic phrase.", type=float)
+    parser.add_argument("--chunk_seconds", default=0.5, help="Length of each synthetic chunk.", type=float)
+    parser.add_argument("--pause_seconds", default=0.5, help="Pause after a phrase before it counts as ended.",
+                        type=float)
+    parser.add_argument("--stub_small_seconds", default=0.05, help="Decode time of the small stub model.",
+                        type=float)
+    parser.add_argument("--stub_large_seconds", default=1.0, help="Decode time of the large stub model.",
+                        type=float)
+    parser.add_argument("--stub_small_errors", default=0.2, help="Share of words the small stub gets wrong.",
+                        type=float)
+    parser.add_argument("--stub_large_errors", default=0.02, help="Share of words the large stub gets wrong.",
+                        type=float)
+    benchmark(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
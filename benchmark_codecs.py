@@ -0,0 +1,98 @@
+import argparse
+import time
+
+import numpy as np
+
+import stub_engine
+from audio_codecs import CODECS, available_codecs
+from audio_recording import RecordingReader
+from model_manager import make_warmup_clip
+
+SAMPLE_RATE = 16000
+
+
+def load_faster_whisper(model_size):
+    from faster_whisper import WhisperModel
+    return WhisperModel(model_size, device="cpu", compute_type="int8")
+
+
+def transcribe_chunk(audio_model, audio_np, beam_size=5):
+    segments, _ = audio_model.transcribe(audio_np, beam_size=beam_size)
+    return ' '.join(segment.text for segment in segments).strip()
+
+
+def word_error_rate(reference, hypothesis):
+    """Word level edit distance divided by the reference length."""
+    reference, hypothesis = reference.lower().split(), hypothesis.lower().split()
+    distances = np.arange(len(hypothesis) + 1)
+    for n, word in enumerate(reference, 1):
+        previous, distances = distances, np.empty_like(distances)
+        distances[0] = n
+        for m, other in enumerate(hypothesis, 1):
+            distances[m] = min(previous[m] + 1, distances[m - 1] + 1, previous[m - 1] + (word != other))
+    return distances[-1] / max(len(reference), 1)
+
+
+def load_frames(args):
+    """int16 frames as the clients would send them, from a recording or a synthetic clip."""
+    if args.file:
+        with RecordingReader(args.file) as recording:
+            return [np.array(frame) for frame in recording]
+    clip = make_warmup_clip(args.chunk_seconds)
+    return [(clip * 32767).astype(np.int16)] * args.frames
+
+
+def benchmark(args):
+    frames = load_frames(args)
+    audio_seconds = sum(len(frame) for frame in frames) / SAMPLE_RATE
+    if args.engine == "stub":
+        # Stub words follow the loudness in coarse steps, only a codec that changes it much changes them.
+        print("The stub engine only checks the pipeline, use --engine faster_whisper for a meaningful WER")
+        audio_model = stub_engine.load_stub_model(call_overhead=0, item_cost=0)
+    else:
+        audio_model = load_faster_whisper(args.model)
+    reference = None
+
+    print(f"{len(frames)} frames, {audio_seconds:.1f}s of audio, WER against the uncompressed transcript")
+    print(f"{'encoding':>10} {'kbit/s':>8} {'ratio':>6} {'enc ms/s':>9} {'dec ms/s':>9} {'SNR dB':>7} {'WER':>6}")
+    for name in args.encodings:
+        codec = CODECS[name]
+        # Capture can hand over a zero-length chunk, every codec has to round-trip it.
+        empty = codec.decode(codec.encode(np.zeros(0, dtype=np.int16), SAMPLE_RATE), SAMPLE_RATE)
+        if len(empty):
+            print(f"{name} decodes an empty frame to {len(empty)} samples")
+        started = time.perf_counter()
+        payloads = [codec.encode(frame, SAMPLE_RATE) for frame in frames]
+        encode_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        decoded = [codec.decode(payload, SAMPLE_RATE) for payload in payloads]
+        decode_seconds = time.perf_counter() - started
+
+        original = np.concatenate(frames) / 32768.0
+        restored = np.concatenate(decoded)
+        noise = np.sum((original - restored) ** 2)
+        snr = 10 * np.log10(np.sum(original ** 2) / noise) if noise > 0 else float("inf")
+        text = ' '.join(transcribe_chunk(audio_model, audio) for audio in decoded)
+        reference = text if reference is None else reference
+        wire_bytes = sum(len(payload) for payload in payloads)
+        print(f"{name:>10} {wire_bytes * 8 / audio_seconds / 1000:>8.1f} "
+              f"{wire_bytes / (2 * len(original)):>6.2f} {encode_seconds / audio_seconds * 1000:>9.2f} "
+              f"{decode_seconds / audio_seconds * 1000:>9.2f} {snr:>7.1f} {word_error_rate(reference, text):>6.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes on the wire, CPU cost and accuracy of the audio codecs.")
+    parser.add_argument("--engine", default="stub", choices=["stub", "faster_whisper"],
+                        help="Model used to compare transcripts.")
+    parser.add_argument("--model", default="tiny", help="faster_whisper model size.", type=str)
+    parser.add_argument("--file", default=None, help="Recording made by microphone_recorder.py, "
+                                                     "a synthetic clip is used when omitted.", type=str)
+    parser.add_argument("--frames", default=10, help="Synthetic frames to encode.", type=int)
+    parser.add_argument("--chunk_seconds", default=2, help="Length of each synthetic frame.", type=float)
+    parser.add_argument("--encodings", default=available_codecs(), nargs="+", choices=available_codecs(),
+                        help="Codecs to compare, the first one is the WER reference.")
+    benchmark(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import time
+
+import numpy as np
+
+from audio_recording import RecordingReader
+from benchmark_codecs import word_error_rate
+from chunk_context import ChunkContext
+from engines import ENGINES, load_engine
+from model_manager import select_compute_type, select_device
+
+SAMPLE_RATE = 16000
+
+
+def load_audio(args):
+    """The whole recording as float32, or synthetic noise bursts the stub turns into words."""
+    if args.file:
+        with RecordingReader(args.file) as recording:
+            return np.concatenate([np.array(frame, dtype=np.float32) / 32768.0 for frame in recording])
+    rng = np.random.default_rng(0)
+    return rng.uniform(-0.3, 0.3, int(args.seconds * SAMPLE_RATE)).astype(np.float32)
+
+
+def run(engine, audio, chunk_seconds, context_tokens, overlap_seconds, language):
+    """Decode audio in chunks the way the server does. Returns (text, tokens decoded, prompt tokens,
+    decode seconds)."""
+    context = ChunkContext(overlap_seconds) if context_tokens else None
+    samples = int(chunk_seconds * SAMPLE_RATE)
+    texts, decoded, prompted, compute = [], 0, 0, 0.0
+    for start in range(0, len(audio), samples):
+        chunk, prompt = audio[start:start + samples], None
+        if context is not None:
+            chunk, prompt = context.prepare(chunk)
+            initial_prompt = engine.initial_prompt(prompt, context_tokens)
+            if initial_prompt:
+                prompted += engine.count_tokens(initial_prompt) if isinstance(initial_prompt, str) \
+                    else len(initial_prompt)
+        started = time.perf_counter()
+        text = engine.transcribe(chunk, language, prompt, context_tokens)[0]
+        compute += time.perf_counter() - started
+        # Words decoded again in the overlap count, the decoder spent the tokens either way.
+        decoded += engine.count_tokens(text)
+        texts.append(context.update(text) if context is not None else text)
+    return ' '.join(text for text in texts if text), decoded, prompted, compute
+
+
+def benchmark(args):
+    device = select_device(args.device)
+    engine = load_engine(args.engine, args.model, device=device, compute_type=select_compute_type(device),
+                         beam_size=args.beam_size)
+    audio = load_audio(args)
+    audio_seconds = len(audio) / SAMPLE_RATE
+    if args.reference:
+        with open(args.reference) as reference:
+            reference = reference.read()
+    else:
+        # Without a reference, one decode of the whole audio is the truth. It sees every word in context.
+        reference = ' '.join(engine.transcribe(audio[start:start + 30 * SAMPLE_RATE], args.language)[0]
+                             for start in range(0, len(audio), 30 * SAMPLE_RATE))
+    if args.engine == "stub":
+        print("The stub counts words as tokens and ignores the prompt, use a real engine for meaningful numbers")
+    print(f"{audio_seconds:.1f}s of audio, WER against a single decode of the whole audio"
+          if not args.reference else f"{audio_seconds:.1f}s of audio, WER against {args.reference}")
+    print(f"{'chunk s':>8} {'context':>8} {'tokens/s':>9} {'prompt tok/s':>13} {'decode s/s':>11} {'WER':>6}")
+    for chunk_seconds in args.chunk_seconds:
+        for context_tokens in (0, args.context_tokens):
+            text, decoded, prompted, compute = run(engine, audio, chunk_seconds, context_tokens, args.chunk_overlap,
+                                                   args.language)
+            print(f"{chunk_seconds:>8.1f} {context_tokens or 'off':>8} {decoded / audio_seconds:>9.2f} "
+                  f"{prompted / audio_seconds:>13.1f} {compute / audio_seconds:>11.3f} "
+                  f"{word_error_rate(reference, text):>6.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokens decoded per second of audio and accuracy of chunked "
+                                                 "transcription, with and without context carry-over.")
+    parser.add_argument("--engine", default="stub", choices=list(ENGINES), help="Inference backend.")
+    parser.add_argument("--model", default="tiny", help="Model size.", type=str)
+    parser.add_argument("--device", default="auto", choices=["auto", "cuda", "cpu"],
+                        help="Where to run the model, auto picks cuda when a GPU is available.")
+    parser.add_argument("--beam_size", default=5, help="Beam width of every decode.", type=int)
+    parser.add_argument("--language", default=None, help="Language of the audio, detected per chunk when omitted.",
+                        type=str)
+    parser.add_argument("--file", default=None, help="Recording made by microphone_recorder.py, synthetic audio "
+                                                     "when omitted.", type=str)
+    parser.add_argument("--seconds", default=30, help="Length of the synthetic audio.", type=float)
+    parser.add_argument("--reference", default=None, help="Text file with the reference transcript.", type=str)
+    parser.add_argument("--chunk_seconds", default=[1, 2, 5], nargs="+", type=float,
+                        help="Chunk lengths to compare.")
+    parser.add_argument("--context_tokens", default=128, help="Prompt budget with context carry-over.", type=int)
+    parser.add_argument("--chunk_overlap", default=0.5, help="Seconds of the previous chunk decoded again.",
+                        type=float)
+    benchmark(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
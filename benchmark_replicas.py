@@ -0,0 +1,75 @@
+import argparse
+import asyncio
+import functools
+import os
+import time
+
+import numpy as np
+
+import stub_engine
+from replica_pool import ReplicaPool
+
+SAMPLE_RATE = 16000
+
+
+def load_faster_whisper(model_size, cpu_threads=0):
+    from faster_whisper import WhisperModel
+    return WhisperModel(model_size, device="cpu", compute_type="int8", cpu_threads=cpu_threads, num_workers=1)
+
+
+def transcribe_chunk(audio_model, audio_np, beam_size=5):
+    segments, _ = audio_model.transcribe(audio_np, beam_size=beam_size)
+    return ' '.join(segment.text for segment in segments).strip()
+
+
+async def measure(pool, clients, requests_per_client, chunk):
+    async def client(index):
+        for _ in range(requests_per_client):
+            await pool.submit(transcribe_chunk, chunk, affinity=index)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[client(index) for index in range(clients)])
+    return clients * requests_per_client / (time.perf_counter() - started)
+
+
+async def benchmark(args):
+    rng = np.random.default_rng(0)
+    chunk = (0.1 * rng.standard_normal(int(args.chunk_seconds * SAMPLE_RATE))).astype(np.float32)
+    if args.engine == "stub":
+        # A CPU bound stub, one replica keeps exactly one core busy per chunk.
+        load_model = functools.partial(stub_engine.load_stub_model, cpu_bound=True,
+                                       call_overhead=args.stub_seconds, item_cost=0)
+    else:
+        load_model = functools.partial(load_faster_whisper, args.model)
+
+    print(f"{os.cpu_count()} CPUs, {args.threads_per_replica} thread(s) per replica, dispatch {args.dispatch}")
+    print(f"{'replicas':>8} {'chunks/s':>9} {'audio s/s':>10} {'speedup':>8}")
+    baseline = None
+    for replicas in args.replicas:
+        pool = ReplicaPool(load_model, replicas=replicas, threads_per_replica=args.threads_per_replica,
+                           dispatch=args.dispatch)
+        await pool.start()
+        throughput = await measure(pool, replicas * args.clients_per_replica, args.requests, chunk)
+        pool.shutdown()
+        baseline = baseline or throughput
+        print(f"{replicas:>8} {throughput:>9.2f} {throughput * args.chunk_seconds:>10.2f} "
+              f"{throughput / baseline:>7.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput scaling of the multi-replica worker pool.")
+    parser.add_argument("--engine", default="stub", choices=["stub", "faster_whisper"],
+                        help="Use a CPU bound stub model or a real faster_whisper model on CPU.")
+    parser.add_argument("--model", default="tiny", help="faster_whisper model size.", type=str)
+    parser.add_argument("--replicas", default=[1, 2, 4], nargs="+", type=int, help="Replica counts to compare.")
+    parser.add_argument("--threads_per_replica", default=1, help="Cores given to each replica.", type=int)
+    parser.add_argument("--dispatch", default="least_loaded", choices=["least_loaded", "affinity"])
+    parser.add_argument("--clients_per_replica", default=2, help="Concurrent clients per replica.", type=int)
+    parser.add_argument("--requests", default=5, help="Chunks sent by each client.", type=int)
+    parser.add_argument("--chunk_seconds", default=3, help="Length of each chunk.", type=float)
+    parser.add_argument("--stub_seconds", default=0.2, help="CPU time the stub spends per chunk.", type=float)
+    asyncio.run(benchmark(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
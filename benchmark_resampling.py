@@ -0,0 +1,69 @@
+import argparse
+import time
+
+import numpy as np
+
+from resampler import Resampler
+
+OUTPUT_RATE = 16000
+
+
+def test_signal(rate, seconds, channels):
+    """Interleaved channels of a 1 kHz tone, a speech band sweep and a little noise."""
+    t = np.arange(int(rate * seconds)) / rate
+    rng = np.random.default_rng(0)
+    mono = 0.3 * np.sin(2 * np.pi * 1000 * t) + 0.2 * np.sin(2 * np.pi * (200 + 1800 * t / seconds) * t)
+    stereo = [mono + 0.01 * rng.standard_normal(len(t)) for _ in range(channels)]
+    return np.stack(stereo, axis=1).reshape(-1).astype(np.float32)
+
+
+def tone_snr(rate):
+    """SNR in dB of a 1 kHz tone resampled to 16 kHz, against the exact tone."""
+    tone = (0.5 * np.sin(2 * np.pi * 1000 * np.arange(rate) / rate)).astype(np.float32)
+    output = Resampler(rate, OUTPUT_RATE).resample(tone)
+    exact = 0.5 * np.sin(2 * np.pi * 1000 * np.arange(len(output)) / OUTPUT_RATE)
+    # Skip the edges, where the filter sees the silence before and after the tone.
+    error = (output - exact)[200:-200]
+    return 10 * np.log10(np.mean(exact[200:-200] ** 2) / np.mean(error ** 2))
+
+
+def run(rate, channels, chunk_ms, seconds):
+    """Returns (input samples per CPU second, largest difference between chunked and whole-signal output)."""
+    signal = test_signal(rate, seconds, channels)
+    step = int(rate * chunk_ms / 1000) * channels
+    resampler = Resampler(rate, OUTPUT_RATE, channels=channels)
+    # CPU time of this process, so the rate is per core whatever else the machine does.
+    started = time.process_time()
+    chunks = [resampler.process(signal[start:start + step]) for start in range(0, len(signal), step)]
+    elapsed = time.process_time() - started
+    chunked = np.concatenate(chunks + [resampler.flush()])
+    whole = Resampler(rate, OUTPUT_RATE, channels=channels).resample(signal)
+    return len(signal) / elapsed, float(np.abs(chunked - whole).max())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput and accuracy of the server's ingest resampler.")
+    parser.add_argument("--rates", default=[8000, 22050, 44100, 48000], nargs="+", type=int,
+                        help="Capture rates to resample to 16 kHz.")
+    parser.add_argument("--channels", default=[1, 2], nargs="+", type=int, help="Channel counts to downmix.")
+    parser.add_argument("--chunk_ms", default=[20, 100, 1000], nargs="+", type=int,
+                        help="Frame sizes, as the server receives them.")
+    parser.add_argument("--seconds", default=30, help="Length of the test signal.", type=float)
+    args = parser.parse_args()
+
+    print("Samples are interleaved input samples, per second of CPU time on one core. Real time is how many "
+          "concurrent streams of that format one core keeps up with. Seam is the largest difference between "
+          "chunked and one-shot resampling.")
+    print(f"{'rate':>6} {'ch':>3} {'chunk ms':>9} {'Msamples/s':>11} {'x real time':>12} {'seam':>9} "
+          f"{'1 kHz SNR':>10}")
+    for rate in args.rates:
+        snr = tone_snr(rate)
+        for channels in args.channels:
+            for chunk_ms in args.chunk_ms:
+                samples_per_second, seam = run(rate, channels, chunk_ms, args.seconds)
+                print(f"{rate:>6} {channels:>3} {chunk_ms:>9} {samples_per_second / 1e6:>11.2f} "
+                      f"{samples_per_second / (rate * channels):>12.0f} {seam:>9.2g} {snr:>8.1f}dB")
+
+
+if __name__ == "__main__":
+    main()
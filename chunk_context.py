@@ -0,0 +1,58 @@
+import collections
+
+import numpy as np
+
+from streaming_transcriber import _normalize
+
+
+class ChunkContext:
+    """Carries context from one independently decoded chunk to the next.
+
+    The text transcribed so far is passed to the next decode as its prompt, so the decoder doesn't
+    have to re-establish names, spelling and punctuation from a second of audio. The engine keeps
+    the end of it that fits the token budget. The last overlap_seconds of each chunk's audio are
+    decoded again in front of the next chunk, so a word cut at the boundary is heard whole. The
+    words the decoder hears twice are dropped from the new text by matching its first words
+    against the end of the text already sent.
+
+    Calls alternate: prepare(audio_np) -> (audio to decode, prompt), then update(text) -> the new
+    text without the repeated words. pause() forgets the overlap after a silence.
+    """
+
+    def __init__(self, overlap_seconds=0.5, sample_rate=16000, max_overlap_words=4, history_words=256):
+        self.overlap_samples = int(overlap_seconds * sample_rate)
+        self.max_overlap_words = max_overlap_words
+        # Enough words for any prompt budget, Whisper prompts are at most 223 tokens.
+        self.words = collections.deque(maxlen=history_words)
+        self._tail = np.zeros(0, dtype=np.float32)
+        self._next_tail = self._tail
+        self._overlapped = False
+        self.repeated_words = 0
+
+    @property
+    def prompt(self):
+        return ' '.join(self.words)
+
+    def prepare(self, audio_np):
+        if self.overlap_samples:
+            self._next_tail = audio_np[-self.overlap_samples:].copy()
+        self._overlapped = len(self._tail) > 0
+        audio = np.concatenate([self._tail, audio_np]) if self._overlapped else audio_np
+        return audio, self.prompt
+
+    def update(self, text):
+        self._tail = self._next_tail
+        words = text.split()
+        normalized = [_normalize(word) for word in words]
+        history = [_normalize(word) for word in list(self.words)[-self.max_overlap_words:]]
+        # Without overlapping audio a repeated word is really spoken twice.
+        for n in range(min(len(history), len(words)) if self._overlapped else 0, 0, -1):
+            if history[-n:] == normalized[:n]:
+                words = words[n:]
+                self.repeated_words += n
+                break
+        self.words.extend(words)
+        return ' '.join(words)
+
+    def pause(self):
+        self._tail = self._next_tail = np.zeros(0, dtype=np.float32)
@@ -0,0 +1,292 @@
+import importlib.util
+import json
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import stub_engine
+from batch_scheduler import run_faster_whisper_batch
+from model_manager import make_warmup_clip, select_device
+from streaming_transcriber import faster_whisper_word_segments, whisper_word_segments
+
+SAMPLE_RATE = 16000
+# Whisper keeps the first half of its 448 token context for the prompt, minus the start token.
+MAX_PROMPT_TOKENS = 223
+
+
+class Engine:
+    """A loaded model behind the three calls the servers and the demo make.
+
+    transcribe(audio_np, language, prompt, prompt_tokens) returns (text, language,
+    language_probability, avg_logprob), with the probability None when the language was given or
+    the backend doesn't report one. prompt is earlier text to condition on, of which the last
+    prompt_tokens tokens are used. word_segments(audio_np, prompt, language) returns (segments,
+    DecodeInfo) in the form StreamingTranscriber.update() takes. transcribe_batch decodes several
+    chunks at once, the default just loops. With timestamps, transcribe and transcribe_batch add
+    the model's segments to each result, as (start, end, text) in seconds from the start of the
+    chunk. The beam size is fixed when the engine is loaded.
+    """
+
+    name = None
+    # Whether worker threads may call one loaded model at the same time.
+    thread_safe = False
+
+    def __init__(self, model, device, compute_type, beam_size=5):
+        self.model = model
+        self.device = device
+        self.compute_type = compute_type
+        self.beam_size = beam_size
+
+    def tokenize(self, text):
+        # Backends without a tokenizer count a word as a token.
+        return text.split()
+
+    def count_tokens(self, text):
+        return len(self.tokenize(text))
+
+    def initial_prompt(self, prompt, prompt_tokens=None):
+        """The end of prompt that fits in prompt_tokens, as the backend's initial_prompt takes it."""
+        if not prompt:
+            return None
+        return ' '.join(prompt.split()[-min(prompt_tokens or MAX_PROMPT_TOKENS, MAX_PROMPT_TOKENS):])
+
+    def transcribe(self, audio_np, language=None, prompt=None, prompt_tokens=None, timestamps=False):
+        raise NotImplementedError
+
+    def word_segments(self, audio_np, prompt=None, language=None):
+        raise NotImplementedError
+
+    def transcribe_batch(self, audio_batch, languages=None, prompts=None, prompt_tokens=None, timestamps=False):
+        return [self.transcribe(audio, language, prompt, prompt_tokens, timestamps)
+                for audio, language, prompt in zip(audio_batch, languages or [None] * len(audio_batch),
+                                                   prompts or [None] * len(audio_batch))]
+
+
+class FasterWhisperEngine(Engine):
+    name = "faster_whisper"
+    # ctranslate2 releases the GIL and serves num_workers calls in parallel from one model.
+    thread_safe = True
+
+    @classmethod
+    def load(cls, model_size, device, compute_type, cpu_threads=0, num_workers=1, beam_size=5):
+        from faster_whisper import WhisperModel
+        return cls(WhisperModel(model_size, device=device, compute_type=compute_type, cpu_threads=cpu_threads,
+                                num_workers=num_workers), device, compute_type, beam_size)
+
+    def tokenize(self, text):
+        return self.model.hf_tokenizer.encode(text, add_special_tokens=False).ids
+
+    def initial_prompt(self, prompt, prompt_tokens=None):
+        # faster_whisper takes the prompt as token ids too, so the trimmed ids go in as they are.
+        if not prompt:
+            return None
+        return self.tokenize(" " + prompt.strip())[-min(prompt_tokens or MAX_PROMPT_TOKENS, MAX_PROMPT_TOKENS):]
+
+    def transcribe(self, audio_np, language=None, prompt=None, prompt_tokens=None, timestamps=False):
+        segments, info = self.model.transcribe(audio_np, beam_size=self.beam_size, language=language,
+                                               initial_prompt=self.initial_prompt(prompt, prompt_tokens))
+        # segments is a lazy generator, this is where the decoding actually happens.
+        segments = list(segments)
+        text = ' '.join([segment.text for segment in segments]).strip()
+        avg_logprob = sum(segment.avg_logprob for segment in segments) / len(segments) if segments else None
+        result = text, info.language, None if language else info.language_probability, avg_logprob
+        if timestamps:
+            result += ([(segment.start, segment.end, segment.text.strip()) for segment in segments],)
+        return result
+
+    def word_segments(self, audio_np, prompt=None, language=None):
+        return faster_whisper_word_segments(self.model, audio_np, prompt, beam_size=self.beam_size,
+                                            language=language, return_info=True)
+
+    def transcribe_batch(self, audio_batch, languages=None, prompts=None, prompt_tokens=None, timestamps=False):
+        prompts = [self.initial_prompt(prompt, prompt_tokens) for prompt in prompts or [None] * len(audio_batch)]
+        return run_faster_whisper_batch(self.model, audio_batch, beam_size=self.beam_size, languages=languages,
+                                        prompts=prompts, timestamps=timestamps)
+
+
+class WhisperEngine(Engine):
+    name = "whisper"
+    # whisper installs per-call hooks on the model while decoding, so workers never share one.
+    thread_safe = False
+
+    @classmethod
+    def load(cls, model_size, device, compute_type, cpu_threads=0, num_workers=1, beam_size=5):
+        import torch
+        import whisper
+        if cpu_threads:
+            torch.set_num_threads(cpu_threads)
+        # whisper keeps its weights in float32 and casts per call: float16 on GPU unless asked for float32.
+        compute_type = "float16" if device == "cuda" and compute_type != "float32" else "float32"
+        return cls(whisper.load_model(model_size, device=device), device, compute_type, beam_size)
+
+    @property
+    def _options(self):
+        # whisper decodes greedily unless given a beam size, and 1 means the same.
+        beam = {"beam_size": self.beam_size} if self.beam_size > 1 else {}
+        return dict(fp16=self.compute_type == "float16", **beam)
+
+    @property
+    def _tokenizer(self):
+        from whisper.tokenizer import get_tokenizer
+        return get_tokenizer(self.model.is_multilingual)
+
+    def tokenize(self, text):
+        return self._tokenizer.encode(text)
+
+    def initial_prompt(self, prompt, prompt_tokens=None):
+        # whisper only takes the prompt as text, the trimmed tokens are decoded back.
+        if not prompt:
+            return None
+        tokens = self.tokenize(" " + prompt.strip())[-min(prompt_tokens or MAX_PROMPT_TOKENS, MAX_PROMPT_TOKENS):]
+        return self._tokenizer.decode(tokens)
+
+    def transcribe(self, audio_np, language=None, prompt=None, prompt_tokens=None, timestamps=False):
+        result = self.model.transcribe(audio_np, language=language,
+                                       initial_prompt=self.initial_prompt(prompt, prompt_tokens), **self._options)
+        logprobs = [segment['avg_logprob'] for segment in result['segments']]
+        # whisper doesn't expose the detection probability.
+        transcript = (result['text'].strip(), result['language'], None,
+                      sum(logprobs) / len(logprobs) if logprobs else None)
+        if timestamps:
+            transcript += ([(segment['start'], segment['end'], segment['text'].strip())
+                            for segment in result['segments']],)
+        return transcript
+
+    def word_segments(self, audio_np, prompt=None, language=None):
+        return whisper_word_segments(self.model, audio_np, prompt, language=language, return_info=True,
+                                     **self._options)
+
+
+class StubEngine(FasterWhisperEngine):
+    """The deterministic stub of stub_engine.py, for tests and load tests. It mimics faster_whisper's
+    objects, so everything but loading, batching and tokenizing is inherited."""
+
+    name = "stub"
+    tokenize = Engine.tokenize
+    initial_prompt = Engine.initial_prompt
+
+    @classmethod
+    def load(cls, model_size, device, compute_type, cpu_threads=0, num_workers=1, beam_size=5, **options):
+        return cls(stub_engine.load_stub_model(**options), device, compute_type, beam_size)
+
+    def transcribe_batch(self, audio_batch, languages=None, prompts=None, prompt_tokens=None, timestamps=False):
+        return self.model.transcribe_batch(audio_batch, beam_size=self.beam_size, languages=languages,
+                                           timestamps=timestamps)
+
+
+ENGINES = {engine.name: engine for engine in (FasterWhisperEngine, WhisperEngine, StubEngine)}
+# Python packages each engine needs.
+REQUIREMENTS = {"faster_whisper": "faster_whisper", "whisper": "whisper"}
+
+
+def available_engines():
+    """Engines whose backend is installed, the stub always is."""
+    return [name for name in ENGINES
+            if name not in REQUIREMENTS or importlib.util.find_spec(REQUIREMENTS[name]) is not None]
+
+
+def load_engine(engine, model_size, device="cpu", compute_type="auto", cpu_threads=0, num_workers=1, beam_size=5,
+                **options):
+    """Loader with the keywords ModelManager and ReplicaPool pass. A model size of 'stub' always
+    loads the stub, whatever the engine."""
+    if model_size == "stub":
+        engine = "stub"
+    return ENGINES[engine].load(model_size, device, compute_type, cpu_threads=cpu_threads,
+                                num_workers=num_workers, beam_size=beam_size, **options)
+
+
+# Jobs for InferenceExecutor, ReplicaPool and BatchScheduler. They're module level so they pickle
+# into process workers, and they take the engine where those pass the loaded model.
+def run_transcription(engine, audio_np, language=None, prompt=None, prompt_tokens=None):
+    return engine.transcribe(audio_np, language, prompt, prompt_tokens)
+
+
+def run_word_segments(engine, audio_np, prompt=None, language=None):
+    return engine.word_segments(audio_np, prompt, language)
+
+
+def run_batch_transcription(engine, audio_batch, languages=None, prompts=None, prompt_tokens=None):
+    return engine.transcribe_batch(audio_batch, languages, prompts, prompt_tokens)
+
+
+# Settings a bench result fixes for the server, see read_config().
+CONFIG_KEYS = ("engine", "model", "device", "compute_type", "beam_size", "cpu_threads")
+
+
+def bench_compute_types(engine, device):
+    """Compute types worth comparing for an engine on a device."""
+    if engine == "faster_whisper":
+        return ["float16", "int8_float16"] if device == "cuda" else ["int8", "float32"]
+    if engine == "whisper":
+        return ["float16", "float32"] if device == "cuda" else ["float32"]
+    return ["int8"]
+
+
+def _peak_rss_mib():
+    try:
+        import resource
+    except ImportError:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes.
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def _bench_one(config, audio_chunks):
+    """Runs in a fresh process, so the peak resident memory is this configuration's alone."""
+    started = time.perf_counter()
+    engine = load_engine(config["engine"], config["model"], device=config["device"],
+                         compute_type=config["compute_type"], cpu_threads=config["cpu_threads"],
+                         beam_size=config["beam_size"])
+    load_seconds = time.perf_counter() - started
+    engine.transcribe(make_warmup_clip())
+    started = time.perf_counter()
+    for audio in audio_chunks:
+        engine.transcribe(audio)
+    compute = time.perf_counter() - started
+    audio_seconds = sum(len(audio) for audio in audio_chunks) / SAMPLE_RATE
+    return dict(config, load_seconds=load_seconds, rtf=compute / audio_seconds, peak_mib=_peak_rss_mib())
+
+
+def bench(audio_chunks, engines, models, beam_sizes=(1, 5), cpu_threads=(0,), device="auto"):
+    """Measure the real-time factor (decode time over audio time, lower is faster), load time and
+    peak memory of every combination on this machine. Each one runs in its own process. Returns
+    the results, fastest first; configurations that fail to load are reported and skipped."""
+    device = select_device(device)
+    configs = [dict(engine=engine, model=model if engine != "stub" else "stub", device=device,
+                    compute_type=compute_type, beam_size=beam_size, cpu_threads=threads)
+               for engine in engines
+               for model in (models if engine != "stub" else models[:1])
+               for compute_type in bench_compute_types(engine, device)
+               for beam_size in beam_sizes
+               for threads in cpu_threads]
+    results = []
+    print(f"{'engine':>15} {'model':>8} {'compute':>13} {'beam':>5} {'threads':>8} {'load s':>7} {'RTF':>6} "
+          f"{'peak MiB':>9}")
+    for config in configs:
+        # Spawned, never forked, for the CUDA reason given in InferenceExecutor.__init__.
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            try:
+                result = pool.submit(_bench_one, config, audio_chunks).result()
+            except Exception as e:
+                print(f"{config['engine']:>15} {config['model']:>8} {config['compute_type']:>13} failed: {e}")
+                continue
+        results.append(result)
+        print(f"{result['engine']:>15} {result['model']:>8} {result['compute_type']:>13} {result['beam_size']:>5} "
+              f"{result['cpu_threads'] or 'auto':>8} {result['load_seconds']:>7.2f} {result['rtf']:>6.3f} "
+              f"{result['peak_mib']:>9.0f}")
+    return sorted(results, key=lambda result: result["rtf"])
+
+
+def write_config(path, result):
+    with open(path, "w") as file:
+        json.dump({key: result[key] for key in CONFIG_KEYS}, file, indent=2)
+        file.write("\n")
+
+
+def read_config(path):
+    """Server settings written by the bench, for use as argparse defaults."""
+    with open(path) as file:
+        config = json.load(file)
+    return {key: config[key] for key in CONFIG_KEYS if key in config}
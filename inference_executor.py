@@ -0,0 +1,135 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+
+# Per-worker model storage. Thread workers each get their own slot, and process workers
+# run jobs on their main thread, so a thread local covers both pool types.
+_worker_state = threading.local()
+# Models shared by every thread worker of an executor when the backend is safe to call
+# concurrently, keyed by the executor's loader so several executors can coexist.
+_shared_models = {}
+_shared_model_lock = threading.Lock()
+
+
+@dataclass
+class InferenceResult:
+    """Value returned by a job along with how long it queued and how long it ran."""
+    value: object
+    queue_wait: float
+    compute: float
+    batch_size: int = 1
+
+
+@dataclass
+class LoadTimings:
+    """How long one model replica took to load and to run its warmup clip."""
+    worker: str
+    load_seconds: float
+    warmup_seconds: float
+
+
+def timed_load(load_model, warmup=None):
+    """Load a model, run warmup(model) if given, and return (model, LoadTimings)."""
+    started = time.perf_counter()
+    model = load_model()
+    loaded = time.perf_counter()
+    if warmup is not None:
+        warmup(model)
+    warmed = time.perf_counter()
+    worker = f"{os.getpid()}:{threading.current_thread().name}"
+    return model, LoadTimings(worker, loaded - started, warmed - loaded)
+
+
+def _init_worker(load_model, warmup):
+    """Pool initializer: load and warm up one model replica for this worker."""
+    _worker_state.model, _worker_state.timings = timed_load(load_model, warmup)
+
+
+def _get_shared_model(shared_loader):
+    with _shared_model_lock:
+        if id(shared_loader) not in _shared_models:
+            _shared_models[id(shared_loader)] = timed_load(*shared_loader)
+        return _shared_models[id(shared_loader)]
+
+
+def _worker_timings(model):
+    return _worker_state.current_timings
+
+
+def _run_job(fn, args, kwargs, submitted_at, shared_loader=None):
+    """Run fn(model, *args, **kwargs) inside a worker and time it."""
+    # time.monotonic is system wide on the platforms we run on, so the queue wait is
+    # meaningful even when the job crossed into another process.
+    started = time.monotonic()
+    if shared_loader is not None:
+        model, timings = _get_shared_model(shared_loader)
+    else:
+        model, timings = _worker_state.model, _worker_state.timings
+    _worker_state.current_timings = timings
+    value = fn(model, *args, **kwargs)
+    finished = time.monotonic()
+    return value, started - submitted_at, finished - started
+
+
+class InferenceExecutor:
+    """Thread or process pool that owns the model(s) and runs inference off the event loop.
+
+    load_model must be a picklable zero-argument callable (a module level function or a
+    functools.partial of one) when mode is "process". warmup(model), if given, runs once on
+    every replica right after it loads, so the first real request doesn't pay for it.
+    """
+
+    def __init__(self, load_model, max_workers=1, mode="thread", shared_model=False, warmup=None):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown executor mode '{mode}', expected 'thread' or 'process'")
+        if shared_model and mode != "thread":
+            raise ValueError("A shared model is only possible with the thread executor")
+        self.mode = mode
+        self.max_workers = max_workers
+        self._shared_loader = (load_model, warmup) if shared_model else None
+        if mode == "thread":
+            initializer, initargs = (None, ()) if shared_model else (_init_worker, (load_model, warmup))
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference",
+                                            initializer=initializer, initargs=initargs)
+        else:
+            # CUDA cannot be re-initialized in a forked child, always spawn fresh workers.
+            self._pool = ProcessPoolExecutor(max_workers=max_workers,
+                                             mp_context=multiprocessing.get_context("spawn"),
+                                             initializer=_init_worker, initargs=(load_model, warmup))
+
+    @property
+    def replicas(self):
+        return 1 if self._shared_loader is not None else self.max_workers
+
+    async def submit(self, fn, *args, affinity=None, **kwargs):
+        """Run fn(model, *args, **kwargs) on a pool worker and await an InferenceResult.
+
+        affinity is accepted for compatibility with ReplicaPool; any free worker takes the job here.
+        """
+        loop = asyncio.get_running_loop()
+        value, queue_wait, compute = await loop.run_in_executor(
+            self._pool, _run_job, fn, args, kwargs, time.monotonic(), self._shared_loader)
+        return InferenceResult(value, queue_wait, compute)
+
+    async def start(self, poll_interval=0.1):
+        """Load and warm up every replica now instead of on first use.
+
+        Returns the LoadTimings of each replica once all of them are ready.
+        """
+        timings = {}
+        while len(timings) < self.replicas:
+            # A worker that finished loading may pick up several of these while another is
+            # still loading, so keep asking until every replica has answered.
+            results = await asyncio.gather(*[self.submit(_worker_timings) for _ in range(self.max_workers)])
+            for result in results:
+                timings[result.value.worker] = result.value
+            if len(timings) < self.replicas:
+                await asyncio.sleep(poll_interval)
+        return list(timings.values())
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
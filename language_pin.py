@@ -0,0 +1,61 @@
+import collections
+
+# Detections run and saved across every session of this server process.
+totals = collections.Counter()
+
+
+class LanguagePin:
+    """Detects a session's language once and reuses it for the rest of the session.
+
+    While nothing is pinned, language is None and the model detects the language itself. Each
+    decode is reported through observe(). The language is pinned once a detection reaches
+    min_probability, or after max_detections detections have run (the language with the highest
+    total probability wins). From then on, language holds the pinned code and callers pass it to
+    the model, which skips detection.
+
+    A pinned language is dropped again after repin_after consecutive decodes with an average
+    token log probability below min_logprob. That is the usual sign that the speaker switched
+    language. A language the client declared is never re-detected.
+    """
+
+    def __init__(self, language=None, min_probability=0.8, max_detections=3, min_logprob=-1.0, repin_after=2):
+        self.declared = language is not None
+        self.language = language
+        self.min_probability = min_probability
+        self.max_detections = max_detections
+        self.min_logprob = min_logprob
+        self.repin_after = repin_after
+        self._candidates = collections.Counter()
+        self._low_confidence = 0
+        self._attempts = 0
+        self.detections = 0
+        self.saved = 0
+        self.repins = 0
+
+    def observe(self, language, probability=None, avg_logprob=None):
+        """Record one decode: the language it used or detected, the detection probability (None
+        when the model doesn't report one) and the decode's average token log probability."""
+        if self.language is None:
+            self.detections += 1
+            self._attempts += 1
+            totals["detections"] += 1
+            self._candidates[language] += 1.0 if probability is None else probability
+            if probability is None or probability >= self.min_probability or self._attempts >= self.max_detections:
+                self.language = self._candidates.most_common(1)[0][0]
+            return
+        self.saved += 1
+        totals["saved"] += 1
+        if self.declared or avg_logprob is None:
+            return
+        self._low_confidence = self._low_confidence + 1 if avg_logprob < self.min_logprob else 0
+        if self._low_confidence >= self.repin_after:
+            print(f"Language '{self.language}' looks wrong (avg logprob {avg_logprob:.2f}), detecting again")
+            self.language = None
+            self._candidates.clear()
+            self._low_confidence = 0
+            self._attempts = 0
+            self.repins += 1
+
+    def summary(self):
+        return (f"language {self.language or 'unknown'}, {self.detections} detection(s) run, {self.saved} saved, "
+                f"{self.repins} re-detection(s); {totals['saved']} saved server wide")
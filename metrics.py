@@ -0,0 +1,194 @@
+import asyncio
+import bisect
+import json
+import random
+
+# Off until the server enables it (--metrics_port): every update then returns on its first line.
+enabled = False
+# Share of answered entries that print a trace line with their stage timings (--trace_sample).
+trace_sample = 0.0
+# Print every chunk's size, silence skipped and text like the servers used to (--verbose).
+verbose = False
+
+_registry = []
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RTF_BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 5.0)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    """One named metric in Prometheus' text format, optionally split by labels.
+
+    Label values are passed as a tuple in the order of label_names. A metric built with function
+    has no stored value, function() is read whenever the metrics are rendered.
+    """
+
+    kind = None
+
+    def __init__(self, name, help, label_names=(), function=None):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.function = function
+        self._values = {}
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if self.function is not None:
+            lines.append(f"{self.name} {self.function()}")
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, labels=()):
+        if not enabled:
+            return
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, labels=()):
+        if not enabled:
+            return
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+
+class Histogram(Metric):
+    """Cumulative bucket counts, sum and count per label set, as Prometheus histograms are."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = buckets
+
+    def observe(self, value, labels=()):
+        if not enabled:
+            return
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, labels, [('le', bound)])} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+# Stages of a request: receive (reading and enqueueing a message, including convert), convert
+# (codec decode and voice activity gate), queue (waiting in the session queue), inference_queue
+# (waiting for a model worker), inference (the model call), send (writing a reply) and, in cascade
+# mode, final (a completed phrase's decode by the main model, from the end of the phrase to its final).
+stage_seconds = Histogram("whisper_stage_seconds", "Time spent in each stage of a request.", ("stage",))
+latency_seconds = Histogram("whisper_latency_seconds",
+                            "From receiving a message to sending its answer, oldest message of a merged decode.")
+real_time_factor = Histogram("whisper_real_time_factor", "Inference time divided by the audio duration decoded.",
+                             buckets=RTF_BUCKETS)
+messages = Counter("whisper_messages_total", "Messages received, by kind.", ("kind",))
+received_bytes = Counter("whisper_received_bytes_total", "Bytes of audio received.")
+audio_seconds = Counter("whisper_audio_seconds_total", "Seconds of audio received and skipped as silence.",
+                        ("kind",))
+replies = Counter("whisper_replies_total", "Messages sent to clients, by kind.", ("kind",))
+cache_lookups = Counter("whisper_cache_lookups_total", "Transcription cache lookups, by result.", ("result",))
+sessions_total = Counter("whisper_sessions_total", "Connections served.")
+sessions_active = Gauge("whisper_sessions_active", "Connections open now.")
+inference_inflight = Gauge("whisper_inference_inflight", "Inference calls admitted and not yet finished.")
+# Read from the admission controller when the metrics are rendered, see the server's main().
+queue_depth = Gauge("whisper_queue_depth", "Chunks waiting for inference across all connections.",
+                    function=lambda: 0)
+
+
+def render():
+    """Every metric in Prometheus' text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """Stage timings of one sampled request, printed as one JSON line when it has been answered."""
+
+    def __init__(self, session_id, sequence, messages):
+        self.fields = {"session": session_id, "seq": sequence, "messages": messages}
+
+    def add(self, **stages):
+        for stage, seconds in stages.items():
+            self.fields[stage] = round(seconds, 6) if isinstance(seconds, float) else seconds
+
+    def finish(self):
+        print(f"trace {json.dumps(self.fields)}")
+
+
+def start_trace(session_id, sequence=None, messages=1):
+    """A Trace for a sampled fraction trace_sample of requests, None for the rest."""
+    if trace_sample <= 0 or random.random() >= trace_sample:
+        return None
+    return Trace(session_id, sequence, messages)
+
+
+def observe_inference(result, samples, trace=None, sample_rate=16000):
+    """Record an InferenceResult that decoded samples of audio."""
+    if trace is not None:
+        trace.add(inference_queue=result.queue_wait, inference=result.compute, audio_seconds=samples / sample_rate,
+                  batch_size=result.batch_size)
+    if not enabled:
+        return
+    stage_seconds.observe(result.queue_wait, ("inference_queue",))
+    stage_seconds.observe(result.compute, ("inference",))
+    if samples:
+        real_time_factor.observe(result.compute / (samples / sample_rate))
+
+
+async def _handle(reader, writer):
+    try:
+        request = await reader.readline()
+        while (await reader.readline()).strip():
+            pass
+        if request.split()[1:2] == [b"/metrics"]:
+            status, body = "200 OK", render()
+        else:
+            status, body = "404 Not Found", "Metrics are served at /metrics\n"
+        data = body.encode()
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+        await writer.drain()
+    except (ConnectionError, IndexError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host, port):
+    """Serve the metrics over HTTP on a side port, for a Prometheus scraper. Enables collection."""
+    global enabled
+    enabled = True
+    return await asyncio.start_server(_handle, host, port)
+
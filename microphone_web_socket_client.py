@@ -2,120 +2,186 @@
 
 import argparse
 import asyncio
-import os
+import collections
+import json
+import time
 import numpy as np
-import speech_recognition as sr
 import websockets
-from datetime import datetime, timedelta
-from queue import Queue, Empty
-from time import sleep
-from sys import platform
-
-
-import websockets
-
-# Global variable to store the WebSocket connection
-websocket_connection = None
-
-# Async function to establish WebSocket connection
-async def establish_websocket_connection(uri):
-    return await websockets.connect(uri)
-
-# Refactored WebSocket client function for continuous transmission
-async def transcribe_with_websocket(audio_bytes, websocket):
-    await websocket.send(audio_bytes)
-    transcription = await websocket.recv()
-    return transcription
+import protocol
+from audio_capture import LatencyStats, add_capture_arguments, open_source
+from audio_codecs import available_codecs, get_codec
+
+
+# Audio waiting for its transcription: sequence number, raw bytes and when it was captured.
+Chunk = collections.namedtuple("Chunk", ["sequence", "data", "captured_at"])
+
+
+class StreamingClient:
+    """Full-duplex websocket client: one persistent connection with independent send and receive tasks.
+
+    Speaks the JSON streaming protocol (protocol.py). Captured audio goes into an asyncio queue and
+    is sent once, as a sequence numbered frame, as soon as it arrives; the server keeps the
+    rolling audio and pushes partial and final results. Every result names the last frame it
+    covers, which acknowledges that frame and all before it. When the connection drops, the
+    client reconnects with exponential backoff, repeats the handshake and replays unacknowledged
+    chunks before new ones. end() asks for the last final; the client returns once it has it.
+    """
+
+    def __init__(self, uri, encoding="pcm_s16le", language=None, initial_backoff=0.5, max_backoff=30.0,
+                 sample_rate=16000, channels=1):
+        self.uri = uri
+        self.codec = get_codec(encoding)
+        # Native capture format, declared in the handshake. The server resamples to what the model takes.
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.language = language
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.queue = asyncio.Queue()
+        self.unacked = collections.deque()
+        self.latencies = []
+        self.capture_latency = LatencyStats("Capture to send")
+        self._sequence = 0
+        self._ending = False
+
+    def put_chunk(self, data, captured_at):
+        """Queue captured audio, must be called on the event loop thread. Encoded once, here."""
+        pcm = np.frombuffer(data, dtype=np.int16)
+        if self.codec.name == "flac":
+            # FLAC stores the channels itself, the other codecs just carry the interleaved samples.
+            pcm = pcm.reshape(-1, self.channels)
+        payload = self.codec.encode(pcm, self.sample_rate)
+        self.queue.put_nowait(Chunk(self._sequence, payload, captured_at))
+        self._sequence += 1
+
+    def end(self):
+        """No more audio, must be called on the event loop thread."""
+        self.queue.put_nowait(None)
+
+    async def run(self):
+        backoff = self.initial_backoff
+        while True:
+            try:
+                async with websockets.connect(self.uri) as websocket:
+                    await self._handshake(websocket)
+                    backoff = self.initial_backoff
+                    # Replay whatever the previous connection sent but never got an answer for.
+                    for chunk in list(self.unacked):
+                        await websocket.send(protocol.pack_frame(chunk.sequence, chunk.data))
+                    if self._ending:
+                        await websocket.send(protocol.encode("end"))
+                    tasks = {asyncio.create_task(self._send(websocket)), asyncio.create_task(self._receive(websocket))}
+                    try:
+                        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                        for task in done:
+                            task.result()
+                    finally:
+                        for task in tasks:
+                            task.cancel()
+                        await asyncio.gather(*tasks, return_exceptions=True)
+                    if self._ending and not self.unacked:
+                        return
+                    print("WebSocket connection closed by the server.")
+            except (websockets.exceptions.WebSocketException, OSError, protocol.ProtocolError) as e:
+                print(f"WebSocket error: {e}")
+            print(f"Reconnecting in {backoff:.1f}s, {len(self.unacked)} chunk(s) to replay.")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def _handshake(self, websocket):
+        await websocket.send(protocol.start_message(self.sample_rate, encoding=self.codec.name, language=self.language,
+                                                    channels=self.channels))
+        reply = protocol.parse_message(await websocket.recv())
+        if reply["type"] != "ready":
+            raise protocol.ProtocolError(reply.get("message", f"Unexpected reply to start: {reply}"))
+        print(f"Session {reply['session']} ready, model {reply['model']}, encoding {reply['encoding']}, "
+              f"{reply['sample_rate']} Hz, {reply.get('channels', 1)} channel(s), language {reply['language']}")
+
+    async def _send(self, websocket):
+        while True:
+            chunk = await self.queue.get()
+            if chunk is None:
+                # The server answers with the final and closes the connection.
+                self._ending = True
+                await websocket.send(protocol.encode("end"))
+                continue
+            # Track it before sending, a send that fails halfway still gets replayed.
+            self.unacked.append(chunk)
+            await websocket.send(protocol.pack_frame(chunk.sequence, chunk.data))
+            self.capture_latency.observe(chunk.captured_at)
+
+    async def _receive(self, websocket):
+        async for text in websocket:
+            message = json.loads(text)
+            if message["type"] == "error":
+                print(f"Server error: {message['message']}")
+                continue
+            # Everything up to message["seq"] has been answered, latency is measured per chunk.
+            while self.unacked and self.unacked[0].sequence <= message["seq"]:
+                chunk = self.unacked.popleft()
+                self.latencies.append(time.monotonic() - chunk.captured_at)
+            if message["type"] in ("partial", "final"):
+                latency = self.latencies[-1] * 1000 if self.latencies else 0.0
+                # Phrase numbers tie a final, which may come late, to the partials it replaces.
+                phrase = f" phrase {message['phrase']}" if "phrase" in message else ""
+                print(f"[{message['type']} {message['seq']}{phrase} {latency:.0f} ms] {message['text']}")
+            else:
+                print(f"[{message['type']} {message['seq']}] {message['frames']} chunk(s) not transcribed")
+
+    def print_latency_summary(self):
+        if self.latencies:
+            p50, p95 = np.percentile(self.latencies, [50, 95]) * 1000
+            print(f"{len(self.latencies)} chunks, end-to-end latency p50 {p50:.0f} ms, p95 {p95:.0f} ms")
+        print(self.capture_latency.summary())
+
+
+async def stream_microphone(uri, source, encoding="pcm_s16le", language=None):
+    client = StreamingClient(uri, encoding=encoding, language=language, sample_rate=source.sample_rate,
+                             channels=source.channels)
+    # Frames come from the capture thread through an asyncio queue, each is sent as soon as it arrives.
+    frames = source.async_queue()
+
+    async def capture():
+        while True:
+            frame = await frames.get()
+            if frame is None:
+                client.end()
+                return
+            client.put_chunk(frame.data, frame.captured_at)
 
-# Function to manage the WebSocket connection and communication
-async def manage_websocket_communication(audio_data):
-    global websocket_connection
+    capture_task = asyncio.create_task(capture())
+    print("Ready to transcribe.")
     try:
-        if websocket_connection is None or websocket_connection.closed:
-            websocket_connection = await establish_websocket_connection("wss://dym-cat.fiservcstaifactory.com:443")
-        return await transcribe_with_websocket(audio_data, websocket_connection)
-    except Exception as e:
-        print(f"WebSocket error: {e}")
-        return None
-
-# Main function adaptation to handle continuous WebSocket connection
-def handle_websocket_communication(audio_data):
-    return asyncio.get_event_loop().run_until_complete(manage_websocket_communication(audio_data))
+        await client.run()
+    finally:
+        capture_task.cancel()
+        source.stop()
+        client.print_latency_summary()
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--energy_threshold", default=1000, help="Energy level for mic to detect.", type=int)
-    parser.add_argument("--record_timeout", default=2, help="How real time the recording is in seconds.", type=float)
-    parser.add_argument("--phrase_timeout", default=3,
-                        help="How much empty space between recordings before we consider it a new line in the transcription.",
-                        type=float)
-    if 'linux' in platform:
-        parser.add_argument("--default_microphone", default='pulse',
-                            help="Default microphone name for SpeechRecognition. Run this with 'list' to view available Microphones.",
-                            type=str)
+    parser.add_argument("--uri", default="wss://dym-cat.fiservcstaifactory.com:443",
+                        help="WebSocket transcription server to stream to.", type=str)
+    parser.add_argument("--encoding", default="pcm_s16le", choices=available_codecs(),
+                        help="Wire codec for the audio, raw PCM by default. mulaw halves and ima_adpcm quarters "
+                             "the bandwidth, at some cost in accuracy.")
+    parser.add_argument("--language", default=None,
+                        help="Language spoken, e.g. 'en'. By default the server detects it.", type=str)
+    parser.add_argument("--sample_rate", default=16000,
+                        help="Capture rate, e.g. the microphone's native 48000. The server resamples.", type=int)
+    parser.add_argument("--channels", default=1, help="Capture channels, the server downmixes to mono.", type=int)
+    add_capture_arguments(parser)
     args = parser.parse_args()
 
-    phrase_time = None
-    data_queue = Queue()
-    recorder = sr.Recognizer()
-    recorder.energy_threshold = args.energy_threshold
-    recorder.dynamic_energy_threshold = False
-
-    # Microphone setup
-    if 'linux' in platform:
-        mic_name = args.default_microphone
-        if not mic_name or mic_name == 'list':
-            print("Available microphone devices are: ")
-            for index, name in enumerate(sr.Microphone.list_microphone_names()):
-                print(f"Microphone with name \"{name}\" found")
-            return
-        else:
-            source = next((sr.Microphone(sample_rate=16000, device_index=index) for index, name in
-                           enumerate(sr.Microphone.list_microphone_names()) if mic_name in name), None)
-            if source is None:
-                print(f"No microphone matching '{mic_name}' found.")
-                return
-    else:
-        source = sr.Microphone(sample_rate=16000)
-
-    record_timeout = args.record_timeout
-    phrase_timeout = args.phrase_timeout
-    transcription = ['']
-
-    with source:
-        recorder.adjust_for_ambient_noise(source)
-
-    def record_callback(_, audio: sr.AudioData) -> None:
-        data = audio.get_raw_data()
-        data_queue.put(data)
+    source = open_source(args)
+    if source is None:
+        return
 
-    recorder.listen_in_background(source, record_callback, phrase_time_limit=record_timeout)
-    print("Ready to transcribe.")
-
-    while True:
-        try:
-            now = datetime.utcnow()
-            if not data_queue.empty():
-                phrase_complete = False
-                if phrase_time and now - phrase_time > timedelta(seconds=phrase_timeout):
-                    phrase_complete = True
-                phrase_time = now
-
-                audio_data = b''.join(list(data_queue.queue))
-                data_queue.queue.clear()
-
-                # WebSocket communication for transcription
-                for x in range(1):
-                    text = handle_websocket_communication(audio_data)
-                    if text is not None:
-                        print(text)
-                    else:
-                        print("Error receiving transcription.")
-            else:
-                sleep(0.25)
-        except KeyboardInterrupt:
-            break
+    try:
+        asyncio.run(stream_microphone(args.uri, source, args.encoding, args.language))
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
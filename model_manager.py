@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import time
+
+import numpy as np
+
+from inference_executor import InferenceExecutor, timed_load
+
+
+def select_device(device="auto"):
+    """Pick "cuda" when a GPU is usable, otherwise "cpu". Never initializes a CUDA context."""
+    if device != "auto":
+        return device
+    try:
+        import ctranslate2
+        if ctranslate2.get_cuda_device_count() > 0:
+            return "cuda"
+    except ImportError:
+        pass
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+    except ImportError:
+        pass
+    return "cpu"
+
+
+def select_compute_type(device, compute_type="auto"):
+    """Half precision on GPU, int8 on CPU where float16 kernels are slow or missing."""
+    if compute_type != "auto":
+        return compute_type
+    return "float16" if device == "cuda" else "int8"
+
+
+def make_warmup_clip(seconds=2.0, sample_rate=16000):
+    """Short synthetic clip with voice-like energy, enough to exercise the encoder and decoder."""
+    t = np.arange(int(seconds * sample_rate), dtype=np.float32) / sample_rate
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+    tone = np.sin(2 * np.pi * 220 * t) + 0.5 * np.sin(2 * np.pi * 440 * t)
+    return (0.1 * envelope * tone).astype(np.float32)
+
+
+def run_warmup(transcribe, audio_model):
+    """Warmup hook for InferenceExecutor: one transcription of the synthetic clip."""
+    transcribe(audio_model, make_warmup_clip())
+
+
+def load_warm_model(load_model, transcribe, device="auto", compute_type="auto"):
+    """Synchronous variant for scripts without an executor. Returns (model, LoadTimings)."""
+    device = select_device(device)
+    compute_type = select_compute_type(device, compute_type)
+    return timed_load(functools.partial(load_model, device=device, compute_type=compute_type),
+                      functools.partial(run_warmup, transcribe))
+
+
+class ModelManager:
+    """Chooses device and compute_type, then loads and warms up models in the background.
+
+    load_model(device=..., compute_type=...) builds one replica, transcribe(model, audio_np) is used
+    for the warmup clip. Construction is cheap, so the websocket server can start accepting
+    connections right away; requests submitted before the model is ready just wait in the
+    executor queue. The executor is available as manager.executor, executor_class picks between
+    InferenceExecutor and replica_pool.ReplicaPool.
+
+    A failed load is printed and kept in manager.error, and the task start() returns raises it, so
+    the server can stop instead of accepting requests that will never be answered.
+    """
+
+    def __init__(self, load_model, transcribe, device="auto", compute_type="auto", executor_class=InferenceExecutor,
+                 **executor_options):
+        self.device = select_device(device)
+        self.compute_type = select_compute_type(self.device, compute_type)
+        self.executor = executor_class(
+            functools.partial(load_model, device=self.device, compute_type=self.compute_type),
+            warmup=functools.partial(run_warmup, transcribe), **executor_options)
+        self.load_timings = []
+        self.startup_seconds = None
+        self.error = None
+        self._loader = None
+
+    def start(self):
+        """Begin loading in the background and return immediately."""
+        if self._loader is None:
+            self._loader = asyncio.create_task(self._load())
+        return self._loader
+
+    async def _load(self):
+        started = time.perf_counter()
+        print(f"Loading model on {self.device} with compute_type {self.compute_type}")
+        try:
+            self.load_timings = await self.executor.start()
+        except Exception as e:
+            self.error = e
+            print(f"Model failed to load on {self.device} with compute_type {self.compute_type}: {e!r}")
+            raise
+        self.startup_seconds = time.perf_counter() - started
+        for timings in self.load_timings:
+            print(f"Replica {timings.worker} loaded in {timings.load_seconds:.2f}s, "
+                  f"warmed up in {timings.warmup_seconds:.2f}s")
+        print(f"Model ready after {self.startup_seconds:.2f}s")
+
+    def shutdown(self, wait=True):
+        if self._loader is not None:
+            self._loader.cancel()
+        self.executor.shutdown(wait=wait)
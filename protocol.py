@@ -0,0 +1,105 @@
+import json
+import struct
+
+# Streaming protocol, version 1.
+#
+# The client opens with a JSON text message
+#     {"type": "start", "version": 1, "sample_rate": 48000, "channels": 2, "encoding": "mulaw", "language": "en",
+#      "model": null}
+# and the server answers {"type": "ready", "version": 1, "session": ..., "sample_rate": ..., "channels": ...,
+# "encoding": ..., ...}. sample_rate and channels (interleaved) are the client's native capture
+# format, 16000 and 1 by default; the server downmixes and resamples to what the model takes.
+# Audio then goes out as binary frames: a little endian uint32 sequence number followed by the
+# audio in the negotiated encoding (audio_codecs.py, int16 PCM by default). Each frame is sent
+# once; the server keeps the session's rolling audio. The server pushes
+#     {"type": "partial", "seq": n, "text": ..., "committed": ..., "tentative": ..., "segments": [...], "timing": {...}}
+# after decoding frames up to seq n, and {"type": "final", ...} with the same fields when a
+# phrase ends (a pause, or a {"type": "end"} from the client, after which the server closes).
+# Results carry the number of the phrase they belong to. A cascade server decodes partials with a
+# small model and finals with a large one in the background, so a final can arrive after the
+# first partials of the next phrase; the client replaces that phrase's text when it does.
+# Frames that were not decoded are answered with {"type": "busy" | "dropped", "seq": n}, protocol
+# mistakes and failed decodes with {"type": "error", "message": ...}.
+#
+# A client whose first message is binary is a legacy client: raw PCM in, one bare text reply out.
+VERSION = 1
+LEGACY_VERSION = 0
+FRAME_HEADER = struct.Struct("<I")
+# Largest binary message the server accepts (websockets' default max_size, set explicitly), and
+# the most samples one frame can decode to: no codec packs a sample into fewer than 4 bits.
+MAX_FRAME_BYTES = 2 ** 20
+MAX_FRAME_SAMPLES = 2 * MAX_FRAME_BYTES
+
+
+class ProtocolError(Exception):
+    """The peer sent something this protocol version doesn't allow."""
+
+
+def pack_frame(sequence, pcm_bytes):
+    return FRAME_HEADER.pack(sequence) + pcm_bytes
+
+
+def unpack_frame(message):
+    """Split a binary frame into (sequence, payload). The payload is a zero-copy memoryview."""
+    if len(message) < FRAME_HEADER.size:
+        raise ProtocolError(f"Audio frame of {len(message)} bytes is shorter than its header")
+    (sequence,) = FRAME_HEADER.unpack_from(message)
+    return sequence, memoryview(message)[FRAME_HEADER.size:]
+
+
+def parse_message(text):
+    """Decode a JSON control message and check it has a type."""
+    try:
+        message = json.loads(text)
+    except ValueError as e:
+        raise ProtocolError(f"Control messages must be JSON: {e}")
+    if not isinstance(message, dict) or "type" not in message:
+        raise ProtocolError("Control messages must be JSON objects with a 'type'")
+    return message
+
+
+def parse_start(text):
+    """Validate the opening handshake and return it with defaults filled in."""
+    message = parse_message(text)
+    if message["type"] != "start":
+        raise ProtocolError(f"Expected a 'start' message, got '{message['type']}'")
+    if message.get("version", VERSION) != VERSION:
+        raise ProtocolError(f"Unsupported protocol version {message.get('version')}, this server speaks {VERSION}")
+    start = {"version": VERSION, "sample_rate": 16000, "channels": 1, "encoding": "pcm_s16le", "language": None,
+             "model": None}
+    start.update(message)
+    if not isinstance(start["sample_rate"], int) or start["sample_rate"] <= 0:
+        raise ProtocolError(f"Invalid sample_rate {start['sample_rate']!r}")
+    if not isinstance(start["channels"], int) or start["channels"] <= 0:
+        raise ProtocolError(f"Invalid channels {start['channels']!r}")
+    return start
+
+
+def encode(message_type, **fields):
+    return json.dumps({"type": message_type, **fields})
+
+
+def start_message(sample_rate=16000, encoding="pcm_s16le", language=None, model=None, channels=1):
+    return encode("start", version=VERSION, sample_rate=sample_rate, channels=channels, encoding=encoding,
+                  language=language, model=model)
+
+
+def ready_message(session, sample_rate, encoding, language, model, channels=1):
+    return encode("ready", version=VERSION, session=session, sample_rate=sample_rate, channels=channels,
+                  encoding=encoding, language=language, model=model)
+
+
+def error_message(text):
+    return encode("error", message=text)
+
+
+def result_message(message_type, sequence, committed, tentative, timing, **fields):
+    """A partial or final result. committed/tentative are lists of streaming_transcriber.Word."""
+    words = list(committed) + list(tentative)
+    return encode(message_type, seq=sequence, **fields,
+                  text=''.join(word.text for word in words).strip(),
+                  committed=''.join(word.text for word in committed).strip(),
+                  tentative=''.join(word.text for word in tentative).strip(),
+                  segments=[{"start": round(word.start, 3), "end": round(word.end, 3), "text": word.text.strip()}
+                            for word in words],
+                  timing=timing)
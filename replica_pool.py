@@ -0,0 +1,261 @@
+import asyncio
+import functools
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from inference_executor import InferenceResult, timed_load
+
+
+def _replica_main(index, load_model, warmup, cores, shm_name, slots_shape, requests, results):
+    """Worker process: load one replica, then serve jobs until a None arrives."""
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    try:
+        model, timings = timed_load(load_model, warmup)
+    except Exception as e:
+        results.put(("failed", index, RuntimeError(f"Replica {index} failed to load: {type(e).__name__}: {e}")))
+        raise
+    results.put(("ready", index, timings))
+    # Spawned children share the parent's resource tracker, so attaching here doesn't add a second
+    # owner; the segment is unlinked once, by the pool, on shutdown.
+    shm = SharedMemory(name=shm_name)
+    slots = np.ndarray(slots_shape, dtype=np.float32, buffer=shm.buf)[index]
+    try:
+        while True:
+            job = requests.get()
+            if job is None:
+                break
+            job_id, fn, slot, samples, args, kwargs, submitted_at = job
+            started = time.monotonic()
+            try:
+                if slot is not None:
+                    # Zero copy view of the audio the front end wrote into our slot.
+                    args = (slots[slot, :samples],) + args
+                value, error = fn(model, *args, **kwargs), None
+            except Exception as e:
+                # Not every exception pickles, send something that always does.
+                value, error = None, RuntimeError(f"{type(e).__name__}: {e}")
+            finished = time.monotonic()
+            results.put(("done", job_id, (value, error, started - submitted_at, finished - started)))
+    finally:
+        del slots
+        shm.close()
+
+
+class _Replica:
+    def __init__(self, index, requests, process, cores):
+        self.index = index
+        self.requests = requests
+        self.process = process
+        self.cores = cores
+        self.outstanding = 0
+        self.free_slots = None
+        # Set by the results reader once the process has died, the replica gets no more jobs.
+        self.error = None
+
+
+class ReplicaPool:
+    """N model replicas in separate processes, each pinned to its own slice of CPU cores.
+
+    Drop-in alternative to InferenceExecutor for CPU hosts where one model can't use every core.
+    Each replica gets threads_per_replica cores: load_model is called with cpu_threads set to that
+    count and the process is pinned to those cores. Float32 audio passed as the first job argument
+    travels through a shared memory slab (slots_per_replica slots of max_chunk_seconds each per
+    replica) instead of being pickled; other arguments and oversized chunks are pickled as usual.
+
+    dispatch is "least_loaded" (fewest outstanding jobs) or "affinity" (the same affinity key,
+    e.g. a connection, always lands on the same replica).
+
+    A replica process that dies is noticed by the results reader: while loading it fails start(),
+    later its pending jobs raise and nothing is routed to it anymore.
+    """
+
+    def __init__(self, load_model, replicas=2, threads_per_replica=None, dispatch="least_loaded", warmup=None,
+                 slots_per_replica=2, max_chunk_seconds=30, sample_rate=16000):
+        if dispatch not in ("least_loaded", "affinity"):
+            raise ValueError(f"Unknown dispatch policy '{dispatch}', expected 'least_loaded' or 'affinity'")
+        available_cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") \
+            else list(range(os.cpu_count() or 1))
+        self.threads_per_replica = threads_per_replica or max(1, len(available_cores) // replicas)
+        self.dispatch = dispatch
+        self.max_workers = replicas
+        self.replicas = replicas
+
+        slots_shape = (replicas, slots_per_replica, int(max_chunk_seconds * sample_rate))
+        self._shm = SharedMemory(create=True, size=int(np.prod(slots_shape)) * 4)
+        self._slots = np.ndarray(slots_shape, dtype=np.float32, buffer=self._shm.buf)
+        self._slots_per_replica = slots_per_replica
+
+        context = multiprocessing.get_context("spawn")
+        self._results = context.Queue()
+        self._replicas = []
+        for index in range(replicas):
+            cores = available_cores[index * self.threads_per_replica:(index + 1) * self.threads_per_replica]
+            # Oversubscribed hosts share cores instead of pinning.
+            cores = cores if len(cores) == self.threads_per_replica else None
+            requests = context.Queue()
+            process = context.Process(
+                target=_replica_main, daemon=True, name=f"replica-{index}",
+                args=(index, functools.partial(load_model, cpu_threads=self.threads_per_replica), warmup,
+                      cores, self._shm.name, slots_shape, requests, self._results))
+            process.start()
+            self._replicas.append(_Replica(index, requests, process, cores))
+
+        self._timings = [None] * replicas
+        self._all_ready = threading.Event()
+        self._load_error = None
+        self._closing = False
+        self._futures = {}
+        self._job_ids = itertools.count()
+        self._round_robin = itertools.count()
+        self._loop = None
+        self._reader = threading.Thread(target=self._read_results, name="replica-results", daemon=True)
+        self._reader.start()
+
+    def _read_results(self, poll_interval=0.5):
+        errors = {}
+        while True:
+            try:
+                message = self._results.get(timeout=poll_interval)
+            except queue.Empty:
+                message = ()
+            if message is None:
+                return
+            if message:
+                self._handle_result(message, errors)
+            # exitcode polls the child without blocking, cheap enough to check after every result.
+            dead = [replica for replica in self._replicas
+                    if replica.error is None and not self._closing and replica.process.exitcode is not None]
+            if dead:
+                # Whatever a replica sent before it exited is already in the pipe, take it first.
+                while True:
+                    try:
+                        message = self._results.get_nowait()
+                    except queue.Empty:
+                        break
+                    if message is None:
+                        return
+                    self._handle_result(message, errors)
+                for replica in dead:
+                    self._replica_died(replica, errors.get(replica.index))
+
+    def _handle_result(self, message, errors):
+        kind, key, payload = message
+        if kind == "ready":
+            self._timings[key] = payload
+            if all(self._timings):
+                self._all_ready.set()
+        elif kind == "failed":
+            errors[key] = payload
+        else:
+            self._loop.call_soon_threadsafe(self._complete, key, payload)
+
+    def _replica_died(self, replica, error=None):
+        """Reader thread: stop routing to a dead replica and fail what it still owed."""
+        replica.error = error or RuntimeError(f"Replica {replica.index} died with exit code "
+                                              f"{replica.process.exitcode}")
+        print(f"{replica.error}, {sum(other.error is None for other in self._replicas)} replica(s) left")
+        if self._timings[replica.index] is None:
+            # start() is still waiting for this one, it will never be ready.
+            self._load_error = replica.error
+            self._all_ready.set()
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._fail_jobs, replica)
+
+    def _fail_jobs(self, replica):
+        for job_id, (future, job_replica, slot) in list(self._futures.items()):
+            if job_replica is replica:
+                self._complete(job_id, (None, replica.error, 0.0, 0.0))
+
+    def _complete(self, job_id, payload):
+        if job_id not in self._futures:
+            # Already failed when its replica died.
+            return
+        future, replica, slot = self._futures.pop(job_id)
+        # The slot is only reusable once the replica is done reading it, even if the caller
+        # stopped waiting long ago.
+        replica.outstanding -= 1
+        if slot is not None:
+            replica.free_slots.put_nowait(slot)
+        if not future.done():
+            future.set_result(payload)
+
+    def _choose(self, affinity):
+        alive = [replica for replica in self._replicas if replica.error is None]
+        if not alive:
+            raise RuntimeError("Every model replica has died")
+        if self.dispatch == "affinity" and affinity is not None:
+            return alive[hash(affinity) % len(alive)]
+        fewest = min(replica.outstanding for replica in alive)
+        candidates = [replica for replica in alive if replica.outstanding == fewest]
+        return candidates[next(self._round_robin) % len(candidates)]
+
+    async def submit(self, fn, *args, affinity=None, **kwargs):
+        """Run fn(model, *args, **kwargs) on a replica and await an InferenceResult."""
+        self._loop = asyncio.get_running_loop()
+        replica = self._choose(affinity)
+        if replica.free_slots is None:
+            replica.free_slots = asyncio.Queue()
+            for slot in range(self._slots_per_replica):
+                replica.free_slots.put_nowait(slot)
+
+        replica.outstanding += 1
+        slot = None
+        try:
+            audio = args[0] if args else None
+            if isinstance(audio, np.ndarray) and audio.dtype == np.float32 and audio.ndim == 1 \
+                    and len(audio) <= self._slots.shape[2]:
+                slot = await replica.free_slots.get()
+                self._slots[replica.index, slot, :len(audio)] = audio
+                message_args, samples = args[1:], len(audio)
+            else:
+                message_args, samples = args, 0
+        except BaseException:
+            replica.outstanding -= 1
+            if slot is not None:
+                replica.free_slots.put_nowait(slot)
+            raise
+        job_id = next(self._job_ids)
+        future = self._loop.create_future()
+        self._futures[job_id] = (future, replica, slot)
+        if replica.error is not None:
+            # Died while this job waited for a slot, the reader already failed its other jobs.
+            self._complete(job_id, (None, replica.error, 0.0, 0.0))
+        else:
+            replica.requests.put((job_id, fn, slot, samples, message_args, kwargs, time.monotonic()))
+        value, error, queue_wait, compute = await future
+        if error is not None:
+            raise error
+        return InferenceResult(value, queue_wait, compute)
+
+    async def start(self):
+        """Wait until every replica has loaded and warmed up, returns their LoadTimings.
+
+        Raises the error of a replica that died before it was ready.
+        """
+        await asyncio.get_running_loop().run_in_executor(None, self._all_ready.wait)
+        if self._load_error is not None:
+            raise self._load_error
+        return list(self._timings)
+
+    def shutdown(self, wait=True):
+        self._closing = True
+        for replica in self._replicas:
+            replica.requests.put(None)
+        if wait:
+            for replica in self._replicas:
+                replica.process.join()
+        else:
+            for replica in self._replicas:
+                replica.process.terminate()
+        self._results.put(None)
+        del self._slots
+        self._shm.close()
+        self._shm.unlink()
@@ -0,0 +1,104 @@
+import functools
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+@functools.lru_cache(maxsize=32)
+def design_filter(input_rate, output_rate, zero_crossings=16, rolloff=0.9, beta=8.0):
+    """The polyphase filter for a rate pair, as (up, down, taps, phases).
+
+    Designed once per rate pair and parameters and shared by every Resampler, so the table is
+    read-only. Its size grows with up, which is why servers should only accept rates whose
+    reduced fraction is small.
+    """
+    divisor = math.gcd(input_rate, output_rate)
+    up = output_rate // divisor
+    down = input_rate // divisor
+    # The filter spans zero_crossings periods of the lower rate on each side, so decimating by
+    # more takes more input samples per output.
+    taps = 2 * zero_crossings * -(-max(up, down) // up)
+    length = taps * up
+    # Cut off below the lower of the two Nyquist frequencies, in cycles per upsampled sample.
+    cutoff = rolloff * 0.5 / max(up, down)
+    offsets = np.arange(length) - length // 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * offsets) * np.kaiser(length + 1, beta)[:length] * up
+    # phases[p, k] = kernel[p + k * up], stored reversed along k to match ascending input windows.
+    phases = np.ascontiguousarray(kernel.reshape(taps, up).T[:, ::-1], dtype=np.float32)
+    phases.flags.writeable = False
+    return up, down, taps, phases
+
+
+class Resampler:
+    """Streaming polyphase resampler with downmix, from input_rate to output_rate float32 mono.
+
+    The rate change is the reduced fraction up/down. A Kaiser windowed sinc low-pass is designed
+    for the upsampled rate, once per rate pair (design_filter), and split into up phases of taps
+    coefficients each; every output sample is one dot product of a phase with the last taps input
+    samples, so nothing is ever upsampled or filtered at the intermediate rate. All outputs of a
+    chunk are computed in one vectorized gather and multiply-add.
+
+    Chunks are resampled as one continuous stream: the last taps - 1 input samples and the
+    position of the next output carry over, so chunk boundaries leave no seam. Output n is
+    aligned with input time n / output_rate, which needs taps / 2 input samples of lookahead;
+    flush() returns what is still held back at the end of a stream. Interleaved input with
+    channels > 1 is averaged to mono first.
+    """
+
+    def __init__(self, input_rate, output_rate=16000, channels=1, zero_crossings=16, rolloff=0.9, beta=8.0):
+        self.input_rate = input_rate
+        self.output_rate = output_rate
+        self.channels = channels
+        self.up, self.down, self.taps, self.phases = design_filter(input_rate, output_rate, zero_crossings,
+                                                                   rolloff, beta)
+        self._history = np.zeros(self.taps - 1, dtype=np.float32)
+        # Upsampled index of the next output, relative to the first sample of the next chunk.
+        self._position = self.taps * self.up // 2
+        self._inputs = 0
+        self._outputs = 0
+
+    @property
+    def passthrough(self):
+        return self.up == self.down and self.channels == 1
+
+    def process(self, audio_np):
+        """Resample the next chunk of the stream. Returns float32 at output_rate, possibly empty."""
+        audio_np = np.asarray(audio_np, dtype=np.float32)
+        if self.channels > 1:
+            if len(audio_np) % self.channels:
+                raise ValueError(f"{len(audio_np)} samples are not a whole number of {self.channels} channel frames")
+            audio_np = audio_np.reshape(-1, self.channels).mean(axis=1, dtype=np.float32)
+        if self.up == self.down:
+            return audio_np
+        self._inputs += len(audio_np)
+        samples = np.concatenate([self._history, audio_np])
+        # Output n needs input samples up to position // up, the last one this chunk has is len - 1.
+        end = len(audio_np) * self.up
+        count = max(0, -(-(end - self._position) // self.down))
+        positions = self._position + self.down * np.arange(count)
+        # Windows of taps samples ending at each output's newest input, index shifted by the history.
+        windows = sliding_window_view(samples, self.taps)[positions // self.up]
+        if self.up == 1:
+            # Integer decimation (48 kHz, 32 kHz) has a single phase, one matrix-vector product.
+            output = windows @ self.phases[0]
+        else:
+            output = np.einsum("nk,nk->n", windows, self.phases[positions % self.up])
+        self._position += count * self.down - end
+        self._history = samples[len(samples) - (self.taps - 1):]
+        self._outputs += count
+        return output
+
+    def flush(self):
+        """The outputs still waiting for lookahead at the end of the stream, with silence after it."""
+        if self.up == self.down:
+            return np.zeros(0, dtype=np.float32)
+        expected = -(-self._inputs * self.up // self.down)
+        channels, self.channels = self.channels, 1
+        tail = self.process(np.zeros(self.taps, dtype=np.float32))
+        self.channels = channels
+        return tail[:max(0, expected - self._outputs + len(tail))]
+
+    def resample(self, audio_np):
+        """A whole signal in one call, output_rate / input_rate times as long."""
+        return np.concatenate([self.process(audio_np), self.flush()])
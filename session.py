@@ -0,0 +1,429 @@
+import asyncio
+import collections
+import itertools
+import struct
+import time
+
+import metrics
+import protocol
+from admission import BUSY_REPLY, DROPPED_REPLY, SessionQueue
+from audio_buffer import AudioRingBuffer, FrameArena
+from audio_codecs import CODECS, available_codecs
+from language_pin import LanguagePin
+from resampler import Resampler
+from streaming_transcriber import StreamingTranscriber, Word, join_words
+from vad import VoiceActivityGate
+
+# Queue marker for a protocol client's {"type": "end"}.
+END_OF_STREAM = "[end]"
+# Capture formats a protocol client may declare, resampled to the model's rate on ingest. Only
+# standard rates: the filter table grows with the reduced rate fraction, and 191999 Hz against
+# 16 kHz would need hundreds of MiB to design.
+INPUT_RATES = (8000, 11025, 16000, 22050, 24000, 32000, 44100, 48000, 88200, 96000, 192000)
+MAX_CHANNELS = 8
+
+_session_ids = itertools.count(1)
+
+
+class Session:
+    """Server side state of one connection, shared by both websocket servers.
+
+    The first message decides the mode. A JSON start message opens a protocol session (see
+    protocol.py): frames are sent once, the rolling audio lives here in a StreamingTranscriber and
+    results are pushed as partial and final JSON messages. Binary audio first means a legacy
+    client, answered with one bare text reply per message as before.
+
+    The server passes in its coroutines transcribe_audio(audio_np, session) -> text and
+    transcribe_stream(stream, audio_np, session) -> (newly committed, tentative, InferenceResult).
+    transcribe_audio carries context from chunk to chunk through chunk_context when it is set (see
+    chunk_context.py); a silent message breaks the overlap.
+
+    A protocol client may send audio at its native rate and channel count, declared in the
+    handshake. The session keeps one Resampler, so the filter state runs on from frame to frame
+    and the model always gets sample_rate mono. Its filter is designed off the event loop, and
+    only once per rate server wide.
+
+    Cascade mode, for protocol sessions: with transcribe_final(audio_np, prompt, session) ->
+    (segments, InferenceResult), partials still come from transcribe_stream (a small, fast model)
+    and each completed phrase is decoded again as a whole by the large model for its final. Final
+    decodes run in the background, one at a time per session and in phrase order, so the worker
+    keeps producing partials for the next phrase meanwhile.
+
+    Every stage is recorded in metrics.py. trace is the sampled Trace of the entry being decoded,
+    None for most of them; the transcribe coroutines add their inference timings to it.
+
+    A failed decode is printed and answered with an error (an empty reply per message for legacy
+    clients) and the session carries on. If the worker itself stops on an error, e.g. a failed
+    send, the connection is closed so the client doesn't wait for replies that never come.
+    """
+
+    def __init__(self, websocket, admission, transcribe_audio, transcribe_stream, model=None, streaming=False,
+                 vad=True, queue_size=4, overflow_policy="merge", sample_rate=16000, language_confidence=0.8,
+                 transcribe_final=None, max_phrase_seconds=30.0, chunk_context=None):
+        self.id = f"{next(_session_ids):06d}"
+        self.websocket = websocket
+        self.admission = admission
+        self.transcribe_audio = transcribe_audio
+        self.transcribe_stream = transcribe_stream
+        self.model = model
+        self.sample_rate = sample_rate
+        self.language = None
+        # Language used for decoding: detected once and pinned, or the one the client declared.
+        self.language_confidence = language_confidence
+        self.language_pin = LanguagePin(min_probability=language_confidence)
+        self.codec = CODECS["pcm_s16le"]
+        # Format of the client's audio, and the resampler to sample_rate mono when it differs.
+        self.input_rate = sample_rate
+        self.channels = 1
+        self.resampler = None
+        self.version = None
+        self.streaming = streaming
+        self.gate = VoiceActivityGate(sample_rate=sample_rate) if vad else None
+        # Reading never waits for inference, the bounded queue and its overflow policy absorb bursts.
+        self.queue = SessionQueue(admission, maxsize=queue_size, policy=overflow_policy, sample_rate=sample_rate)
+        # Frames are decoded in place into the arena and queued as views of it. A reservation is
+        # tagged with its message's place in the queue and freed once the worker has answered it.
+        self.arena = FrameArena(frames=queue_size + 2, max_samples=protocol.MAX_FRAME_SAMPLES)
+        self._answered_messages = 0
+        self.stream = None
+        self.chunk_context = chunk_context
+        # Protocol sessions: next expected sequence number, receive time of frames not yet
+        # answered, and where the current phrase starts in stream.committed.
+        self.next_sequence = 0
+        self._received = collections.deque()
+        self._phrase_start = 0
+        self._phrase = 0
+        # Cascade mode: the current phrase's audio for the final decode, the task chain that sends
+        # finals in order, and the previous finals' text as the large model's prompt.
+        self.transcribe_final = transcribe_final
+        self.phrase_audio = AudioRingBuffer(max_phrase_seconds, sample_rate) if transcribe_final else None
+        self._finals = None
+        self._context = ""
+        self.trace = None
+
+    async def serve(self):
+        worker = asyncio.create_task(self._worker())
+        worker.add_done_callback(self._worker_done)
+        metrics.sessions_total.inc()
+        metrics.sessions_active.inc()
+        try:
+            async for message in self.websocket:
+                started = time.perf_counter()
+                if self.version is None:
+                    await self._open(message)
+                if self.version == protocol.VERSION:
+                    self._receive_protocol(message)
+                else:
+                    self._receive_legacy(message)
+                metrics.stage_seconds.observe(time.perf_counter() - started, ("receive",))
+                if worker.done():
+                    # The worker stops when the client ended the stream, or sending failed.
+                    break
+        finally:
+            metrics.sessions_active.dec()
+            worker.cancel()
+            if self._finals is not None:
+                self._finals.cancel()
+            self.queue.close()
+            context = (f"; {self.chunk_context.repeated_words} word(s) heard again in chunk overlaps dropped"
+                       if self.chunk_context is not None else "")
+            print(f"Session {self.id} closed: {self.queue.merged} chunks merged, {self.queue.dropped} dropped, "
+                  f"{self.queue.rejected} rejected; {self.language_pin.summary()}{context}")
+
+    def _worker_done(self, worker):
+        if worker.cancelled() or worker.exception() is None:
+            return
+        print(f"Session {self.id} worker stopped: {worker.exception()!r}")
+        asyncio.ensure_future(self.websocket.close())
+
+    async def _open(self, message):
+        if isinstance(message, bytes):
+            self.version = protocol.LEGACY_VERSION
+            self.stream = StreamingTranscriber(sample_rate=self.sample_rate) if self.streaming else None
+            return
+        try:
+            start = protocol.parse_start(message)
+        except protocol.ProtocolError as e:
+            # Not a handshake either, treat it as a legacy client's stray text message.
+            self.version = protocol.LEGACY_VERSION
+            self.stream = StreamingTranscriber(sample_rate=self.sample_rate) if self.streaming else None
+            print(f"Session {self.id}: {e}, continuing as a legacy session")
+            return
+        self.version = protocol.VERSION
+        self.language = start["language"]
+        self.language_pin = LanguagePin(self.language, min_probability=self.language_confidence)
+        self.stream = StreamingTranscriber(sample_rate=self.sample_rate)
+        if start["sample_rate"] not in INPUT_RATES or start["channels"] > MAX_CHANNELS:
+            self.queue.put_reply(protocol.error_message(
+                f"{start['sample_rate']} Hz {start['channels']} channel audio is not supported, send one of "
+                f"{', '.join(map(str, INPUT_RATES))} Hz with at most {MAX_CHANNELS} channels"))
+            self.queue.put_reply(END_OF_STREAM)
+        elif start["encoding"] not in available_codecs():
+            self.queue.put_reply(protocol.error_message(
+                f"Unsupported encoding '{start['encoding']}', this server accepts {available_codecs()}"))
+            self.queue.put_reply(END_OF_STREAM)
+        elif start["model"] not in (None, self.model):
+            self.queue.put_reply(protocol.error_message(
+                f"This server runs model '{self.model}', not '{start['model']}'"))
+            self.queue.put_reply(END_OF_STREAM)
+        else:
+            self.codec = CODECS[start["encoding"]]
+            self.input_rate, self.channels = start["sample_rate"], start["channels"]
+            # FLAC payloads carry their own channel layout and decode to mono already. A rate's
+            # first session designs the filter, on a thread so other sessions aren't held up.
+            resampler = await asyncio.get_running_loop().run_in_executor(
+                None, Resampler, self.input_rate, self.sample_rate, 1 if self.codec.name == "flac" else self.channels)
+            self.resampler = None if resampler.passthrough else resampler
+            self.queue.put_reply(protocol.ready_message(self.id, self.input_rate, self.codec.name, self.language,
+                                                        self.model, channels=self.channels))
+        print(f"Session {self.id} started protocol version {self.version}, encoding {start['encoding']}, "
+              f"{start['sample_rate']} Hz, {start['channels']} channel(s), language {self.language}")
+
+    def _to_float(self, payload):
+        # Decode straight to the float32 samples the model consumes, into the arena when it has room.
+        started = time.perf_counter()
+        samples = self.codec.samples(payload)
+        out = self.arena.reserve(samples, self.queue.enqueued) if samples is not None else None
+        audio_np = self.codec.decode(payload, self.input_rate, out=out)
+        if self.resampler is not None:
+            audio_np = self.resampler.process(audio_np)
+        metrics.received_bytes.inc(len(payload))
+        metrics.audio_seconds.inc(len(audio_np) / self.sample_rate, ("received",))
+        if self.gate is not None:
+            audio_np, skipped = self.gate.process(audio_np)
+            metrics.audio_seconds.inc(skipped, ("silence",))
+            if metrics.verbose:
+                print(f"VAD skipped {skipped:.2f}s of silence ({self.gate.skipped_seconds:.1f}s of "
+                      f"{self.gate.total_seconds:.1f}s this session)")
+        metrics.stage_seconds.observe(time.perf_counter() - started, ("convert",))
+        return audio_np
+
+    def _receive_legacy(self, message):
+        if isinstance(message, bytes):
+            metrics.messages.inc(labels=("audio",))
+            if metrics.verbose:
+                print(f"Received audio sample of size: {len(message)} bytes")
+            self.queue.put_audio(self._to_float(message))
+        else:
+            metrics.messages.inc(labels=("invalid",))
+            print("Received non-binary message")
+            # Optionally, respond for non-binary messages as well
+            self.queue.put_reply("Expected binary data")
+
+    def _receive_protocol(self, message):
+        if not isinstance(message, bytes):
+            try:
+                control = protocol.parse_message(message)
+            except protocol.ProtocolError as e:
+                metrics.messages.inc(labels=("invalid",))
+                self.queue.put_reply(protocol.error_message(str(e)))
+                return
+            metrics.messages.inc(labels=("control",))
+            if control["type"] == "end":
+                self.queue.put_reply(END_OF_STREAM, self.next_sequence - 1)
+            elif control["type"] != "start":
+                self.queue.put_reply(protocol.error_message(f"Unknown message type '{control['type']}'"))
+            return
+        try:
+            sequence, payload = protocol.unpack_frame(message)
+            audio_np = self._to_float(payload)
+        except (protocol.ProtocolError, ValueError, RuntimeError, struct.error) as e:
+            metrics.messages.inc(labels=("invalid",))
+            self.queue.put_reply(protocol.error_message(f"Undecodable {self.codec.name} frame: {e}"))
+            return
+        if sequence != self.next_sequence:
+            print(f"Session {self.id}: expected frame {self.next_sequence}, got {sequence}")
+        self.next_sequence = sequence + 1
+        metrics.messages.inc(labels=("audio",))
+        self._received.append((sequence, time.monotonic()))
+        self.queue.put_audio(audio_np, sequence)
+
+    async def _worker(self):
+        """Decode the connection's queued audio one entry at a time and answer in order."""
+        while True:
+            entry = await self.queue.get()
+            decoded = entry.live
+            if decoded:
+                waited = time.monotonic() - entry.received_at
+                metrics.stage_seconds.observe(waited, ("queue",))
+                self.trace = metrics.start_trace(self.id, entry.sequence, entry.messages)
+                if self.trace is not None:
+                    self.trace.add(queue=waited)
+            try:
+                if self.version == protocol.VERSION:
+                    if not await self._answer_protocol(entry):
+                        await self.websocket.close()
+                        return
+                else:
+                    await self._answer_legacy(entry)
+            except Exception as e:
+                # One failed decode doesn't end the session, the client still gets its answer.
+                print(f"Session {self.id} failed to answer {entry.messages} message(s): {e!r}")
+                self.trace = None
+                await self._answer_failed(entry, e)
+                self._release(entry)
+                continue
+            self._release(entry)
+            if decoded:
+                latency = time.monotonic() - entry.received_at
+                metrics.latency_seconds.observe(latency)
+                if self.trace is not None:
+                    self.trace.add(latency=latency)
+                    self.trace.finish()
+                    self.trace = None
+
+    def _release(self, entry):
+        # Nothing reads the answered messages' audio anymore, their arena space is free again.
+        self._answered_messages += entry.messages
+        self.arena.release(self._answered_messages)
+
+    async def _answer_failed(self, entry, error):
+        if self.version == protocol.VERSION:
+            self._answered(entry.sequence)
+            await self._send(protocol.error_message(f"Transcription failed: {error}"), "error")
+        else:
+            for _ in range(entry.messages):
+                await self._send("", "error")
+
+    async def _send(self, message, kind):
+        started = time.perf_counter()
+        await self.websocket.send(message)
+        elapsed = time.perf_counter() - started
+        metrics.stage_seconds.observe(elapsed, ("send",))
+        metrics.replies.inc(labels=(kind,))
+        if self.trace is not None and kind in ("text", "partial"):
+            self.trace.add(send=elapsed)
+
+    async def _decode(self, audio_np):
+        # The global in-flight cap keeps a burst of sessions from flooding the executor.
+        async with self.admission.inflight:
+            metrics.inference_inflight.inc()
+            try:
+                # Transcribe the received audio
+                if self.stream is not None:
+                    return await self.transcribe_stream(self.stream, audio_np, self)
+                return await self.transcribe_audio(audio_np, self)
+            finally:
+                metrics.inference_inflight.dec()
+
+    async def _answer_legacy(self, entry):
+        if entry.reply is not None:
+            # Merged away, dropped, rejected or not audio: answer without touching the model.
+            replies = [entry.reply] * entry.messages
+        else:
+            if entry.audio is None:
+                # Nothing but silence. Clients wait for one reply per message, so still answer; in
+                # streaming mode the pause also ends the phrase and settles its tentative words.
+                transcribed_text = join_words(self.stream.finish()) if self.stream is not None else ""
+                if self.chunk_context is not None:
+                    self.chunk_context.pause()
+            elif self.stream is not None:
+                newly_committed, tentative, _ = await self._decode(entry.audio)
+                transcribed_text = join_words(newly_committed + tentative)
+            else:
+                transcribed_text = await self._decode(entry.audio)
+            if entry.audio is not None and metrics.verbose:
+                print(f"Transcribed text: {transcribed_text}")
+            # Chunks merged into this decode get an empty reply, the text goes with the last one.
+            replies = [""] * (entry.messages - 1) + [transcribed_text]
+        kind = {BUSY_REPLY: "busy", DROPPED_REPLY: "dropped"}.get(entry.reply, "text")
+        # Respond to the client with the transcribed text
+        for reply in replies:
+            await self._send(reply, kind)
+
+    async def _answer_protocol(self, entry):
+        """Push the result for one entry. Returns False once the session should close."""
+        if entry.reply in (BUSY_REPLY, DROPPED_REPLY):
+            kind = "busy" if entry.reply == BUSY_REPLY else "dropped"
+            await self._send(protocol.encode(kind, seq=entry.sequence, frames=entry.messages), kind)
+            self._answered(entry.sequence)
+        elif entry.reply == END_OF_STREAM:
+            # The client waits for this one, send it even when the phrase is empty.
+            await self._send_final(entry.sequence, always=True)
+            return False
+        elif entry.reply is not None:
+            await self._send(entry.reply, "control")
+        elif entry.audio is None:
+            # A pause ends the phrase. Silence with no phrase open needs no message.
+            await self._send_final(entry.sequence)
+        else:
+            if self.phrase_audio is not None:
+                if len(self.phrase_audio) + len(entry.audio) > self.phrase_audio.capacity:
+                    # Longer than the large model's window, finish the phrase here.
+                    await self._send_final(entry.sequence - entry.messages)
+                self.phrase_audio.append(entry.audio)
+            newly_committed, tentative, result = await self._decode(entry.audio)
+            await self._send(protocol.result_message(
+                "partial", entry.sequence, self.stream.committed[self._phrase_start:], tentative,
+                self._timing(entry.sequence, result, len(entry.audio)), phrase=self._phrase), "partial")
+        return True
+
+    async def _send_final(self, sequence, always=False):
+        self.stream.finish()
+        phrase = self.stream.committed[self._phrase_start:]
+        self._phrase_start = len(self.stream.committed)
+        if self.phrase_audio is not None and len(self.phrase_audio):
+            # Copy the phrase out, the buffer starts collecting the next one right away.
+            audio_np = self.phrase_audio.view().copy()
+            self.phrase_audio.clear()
+            offset = self.stream.buffer_offset - len(audio_np) / self.sample_rate
+            self._answered(sequence)
+            self._finals = asyncio.create_task(self._send_cascade_final(
+                self._finals, self._phrase, sequence, audio_np, offset, phrase))
+            self._phrase += 1
+            if always:
+                # The session is ending, every final has to be out before it closes.
+                await self._finals
+        elif phrase or always:
+            if self._finals is not None:
+                # Keep phrase order behind any final still being decoded.
+                await self._finals
+            await self._send(protocol.result_message("final", sequence, phrase, [], self._timing(sequence),
+                                                     phrase=self._phrase), "final")
+            if metrics.verbose:
+                print(f"Session {self.id} final: {join_words(phrase)}")
+            self._phrase += 1
+        else:
+            self._answered(sequence)
+
+    async def _send_cascade_final(self, previous, phrase_number, sequence, audio_np, offset, fallback):
+        """Decode a whole phrase with the large model and send it as the phrase's final."""
+        if previous is not None:
+            # Finals go out in phrase order, whatever happened to the one before.
+            await asyncio.gather(previous, return_exceptions=True)
+        started = time.monotonic()
+        timing = {}
+        try:
+            async with self.admission.final_inflight:
+                segments, result = await self.transcribe_final(audio_np, self._context, self)
+            words = [Word(offset + start, offset + end, text) for _, segment_words in segments
+                     for start, end, text in segment_words]
+            timing = {"queue_wait": round(result.queue_wait, 4), "inference": round(result.compute, 4)}
+        except Exception as e:
+            # The partial model's words are still better than no final at all.
+            print(f"Session {self.id} final decode failed, sending the partial text: {e!r}")
+            words = fallback
+        timing.update(final_delay=round(time.monotonic() - started, 4),
+                      audio_seconds=round(len(audio_np) / self.sample_rate, 3))
+        metrics.stage_seconds.observe(timing["final_delay"], ("final",))
+        self._context = (self._context + ''.join(word.text for word in words))[-200:]
+        await self._send(protocol.result_message("final", sequence, words, [], timing, phrase=phrase_number),
+                         "final")
+        if metrics.verbose:
+            print(f"Session {self.id} final: {join_words(words)}")
+
+    def _timing(self, sequence, result=None, samples=0):
+        """Timing metadata for a result covering frames up to sequence."""
+        timing = {"server_seconds": round(self._answered(sequence), 4)}
+        if result is not None:
+            timing.update(queue_wait=round(result.queue_wait, 4), inference=round(result.compute, 4),
+                          audio_seconds=round(samples / self.sample_rate, 3))
+        return timing
+
+    def _answered(self, sequence):
+        """Forget receive times up to sequence and return how long the oldest of them waited."""
+        received_at = None
+        while self._received and sequence is not None and self._received[0][0] <= sequence:
+            _, received = self._received.popleft()
+            received_at = received if received_at is None else received_at
+        return time.monotonic() - received_at if received_at is not None else 0.0
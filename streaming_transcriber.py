@@ -0,0 +1,160 @@
+import re
+from collections import namedtuple
+
+from audio_buffer import AudioRingBuffer
+
+# A word with absolute start/end times in seconds since the stream started.
+Word = namedtuple("Word", ["start", "end", "text"])
+
+
+def _normalize(text):
+    return re.sub(r"[^\w']", "", text.lower())
+
+
+def join_words(words):
+    return ''.join(word.text for word in words).strip()
+
+
+class StreamingTranscriber:
+    """Incremental transcription of a growing audio stream using local agreement.
+
+    Audio is appended to a rolling buffer and the buffer is re-decoded on every tick, but a word
+    is only committed once two consecutive hypotheses agree on it. Committed audio is trimmed off
+    the front of the buffer at a segment boundary, so each decode only covers the uncommitted tail
+    plus the segment it sits in, and the committed text is passed back as the prompt instead.
+
+    Decoding is split in two so it can run on an executor: prepare() returns the audio and prompt
+    to decode, and update() takes the resulting segments as [(segment_end, [(start, end, text)])]
+    with times relative to the audio that was passed in. The audio returned by prepare() is a
+    view into a preallocated AudioRingBuffer and stays valid until the next insert.
+    """
+
+    def __init__(self, sample_rate=16000, max_buffer_seconds=15.0, prompt_chars=200):
+        self.sample_rate = sample_rate
+        self.max_buffer_seconds = max_buffer_seconds
+        self.prompt_chars = prompt_chars
+        # Twice the trim threshold is the hard ceiling, reached only if nothing ever gets committed.
+        self.buffer = AudioRingBuffer(2 * max_buffer_seconds, sample_rate)
+        # Stream time of the first buffered sample.
+        self.buffer_offset = 0.0
+        self.committed = []
+        self.tentative = []
+
+    @property
+    def committed_text(self):
+        return join_words(self.committed)
+
+    @property
+    def tentative_text(self):
+        return join_words(self.tentative)
+
+    @property
+    def buffer_seconds(self):
+        return self.buffer.seconds
+
+    def insert_audio(self, audio_np):
+        self._track_dropped(self.buffer.append, audio_np)
+
+    def insert_pcm(self, pcm_bytes):
+        """Like insert_audio for raw int16 PCM, converted in place without temporaries."""
+        self._track_dropped(self.buffer.append_pcm, pcm_bytes)
+
+    def _track_dropped(self, append, audio):
+        dropped = self.buffer.dropped
+        append(audio)
+        # Audio pushed out at the ceiling is skipped, later words keep their stream times.
+        self.buffer_offset += (self.buffer.dropped - dropped) / self.sample_rate
+
+    def prepare(self):
+        """Audio and prompt for the next decode."""
+        return self.buffer.view(), self.committed_text[-self.prompt_chars:]
+
+    def update(self, segments):
+        """Merge a new hypothesis and return (newly committed words, tentative words)."""
+        offset = self.buffer_offset
+        words = [Word(offset + start, offset + end, text) for _, segment_words in segments
+                 for start, end, text in segment_words]
+        last_committed_end = self.committed[-1].end if self.committed else 0.0
+        # The decoder sees audio from before the last committed word, drop what it re-heard.
+        words = [word for word in words if word.start > last_committed_end - 0.1]
+        if words and self.committed and words[0].start - last_committed_end < 1.0:
+            for n in range(min(5, len(self.committed), len(words)), 0, -1):
+                tail = [_normalize(word.text) for word in self.committed[-n:]]
+                if tail == [_normalize(word.text) for word in words[:n]]:
+                    words = words[n:]
+                    break
+
+        # Commit the longest prefix this hypothesis shares with the previous one.
+        agreed = 0
+        while (agreed < len(words) and agreed < len(self.tentative)
+               and _normalize(words[agreed].text) == _normalize(self.tentative[agreed].text)):
+            agreed += 1
+        newly_committed = words[:agreed]
+        self.committed.extend(newly_committed)
+        self.tentative = words[agreed:]
+
+        self._trim([offset + segment_end for segment_end, _ in segments])
+        return newly_committed, self.tentative
+
+    def process(self, transcribe):
+        """Synchronous tick: transcribe(audio, prompt) -> segments, see update()."""
+        return self.update(transcribe(*self.prepare()))
+
+    def finish(self):
+        """End of phrase: commit whatever is tentative and start a fresh buffer."""
+        newly_committed = self.tentative
+        self.committed.extend(newly_committed)
+        self.tentative = []
+        self.buffer_offset += self.buffer_seconds
+        self.buffer.clear()
+        return newly_committed
+
+    def _trim(self, segment_ends):
+        if not self.committed:
+            return
+        last_committed_end = self.committed[-1].end
+        # Prefer cutting where the model itself ended a segment, it keeps words whole.
+        cut = max((end for end in segment_ends if end <= last_committed_end), default=None)
+        if cut is None and self.buffer_seconds > self.max_buffer_seconds:
+            cut = last_committed_end
+        if cut is None or cut <= self.buffer_offset:
+            return
+        samples = min(int((cut - self.buffer_offset) * self.sample_rate), len(self.buffer))
+        self.buffer.consume(samples)
+        self.buffer_offset += samples / self.sample_rate
+
+
+# What a decode reported besides the words, for callers that track the language (see language_pin.py).
+DecodeInfo = namedtuple("DecodeInfo", ["language", "language_probability", "avg_logprob"])
+
+
+def _mean_logprob(logprobs):
+    return sum(logprobs) / len(logprobs) if logprobs else None
+
+
+def faster_whisper_word_segments(audio_model, audio_np, prompt, return_info=False, **options):
+    """Decode with faster_whisper and return segments in StreamingTranscriber.update() form, or
+    (segments, DecodeInfo) with return_info."""
+    segments, info = audio_model.transcribe(audio_np, initial_prompt=prompt or None, word_timestamps=True,
+                                            condition_on_previous_text=False, **options)
+    segments = list(segments)
+    words = [(segment.end, [(word.start, word.end, word.word) for word in segment.words or []])
+             for segment in segments]
+    if not return_info:
+        return words
+    # A language passed in options was used as is, only a detection has a meaningful probability.
+    probability = None if options.get("language") else info.language_probability
+    return words, DecodeInfo(info.language, probability, _mean_logprob([segment.avg_logprob for segment in segments]))
+
+
+def whisper_word_segments(audio_model, audio_np, prompt, return_info=False, **options):
+    """Decode with openai-whisper and return segments in StreamingTranscriber.update() form, or
+    (segments, DecodeInfo) with return_info. whisper doesn't report a detection probability."""
+    result = audio_model.transcribe(audio_np, initial_prompt=prompt or None, word_timestamps=True,
+                                    condition_on_previous_text=False, **options)
+    words = [(segment['end'], [(word['start'], word['end'], word['word']) for word in segment.get('words', [])])
+             for segment in result['segments']]
+    if not return_info:
+        return words
+    return words, DecodeInfo(result['language'], None,
+                             _mean_logprob([segment['avg_logprob'] for segment in result['segments']]))
@@ -0,0 +1,88 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# Shapes mirror the objects faster_whisper returns, so the stub can stand in for a WhisperModel.
+StubWord = namedtuple("StubWord", ["start", "end", "word", "probability"])
+StubSegment = namedtuple("StubSegment", ["start", "end", "text", "words", "avg_logprob"])
+StubInfo = namedtuple("StubInfo", ["language", "language_probability", "duration"])
+
+_VOCABULARY = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel",
+               "india", "juliet", "kilo", "lima", "mike", "november", "oscar", "papa"]
+
+
+class StubWhisperModel:
+    """Deterministic, dependency free stand-in for faster_whisper.WhisperModel.
+
+    Emits one word per word_seconds of non-silent audio, picked from its loudness, so the same
+    audio always gives the same text and a growing buffer keeps a stable prefix. Inference
+    cost is simulated as call_overhead + item_cost * batch_size seconds, which roughly matches how a
+    real encoder amortizes its fixed cost over a batch. The time is slept away by default; with
+    cpu_bound=True it is spent spinning while holding the GIL, so it occupies one core the way a
+    real decode would and only separate processes can run it in parallel. word_error_rate swaps
+    that share of words for a wrong one (deterministically), to stand in for a less accurate model.
+    """
+
+    def __init__(self, sample_rate=16000, word_seconds=0.5, call_overhead=0.15, item_cost=0.02,
+                 silence_rms=0.005, language="en", cpu_bound=False, word_error_rate=0.0):
+        self.sample_rate = sample_rate
+        self.word_seconds = word_seconds
+        self.call_overhead = call_overhead
+        self.item_cost = item_cost
+        self.silence_rms = silence_rms
+        self.language = language
+        self.cpu_bound = cpu_bound
+        self.word_error_rate = word_error_rate
+
+    def _spend(self, seconds):
+        if not self.cpu_bound:
+            time.sleep(seconds)
+            return
+        deadline = time.thread_time() + seconds
+        while time.thread_time() < deadline:
+            pass
+
+    def _segments(self, audio):
+        word_samples = int(self.word_seconds * self.sample_rate)
+        segments = []
+        for index in range(len(audio) // word_samples):
+            window = audio[index * word_samples:(index + 1) * word_samples]
+            if np.sqrt(np.mean(np.square(window, dtype=np.float64))) < self.silence_rms:
+                continue
+            start = index * self.word_seconds
+            end = start + self.word_seconds
+            # Quantize the loudness to quarter octaves, so codecs and resamplers that barely change
+            # the signal don't change the word, just as they wouldn't change a real model's.
+            key = int(np.floor(np.log2(np.mean(np.abs(window), dtype=np.float64)) * 4))
+            if (key * 2654435761) % 1000 < self.word_error_rate * 1000:
+                key += 7
+            word = _VOCABULARY[key % len(_VOCABULARY)]
+            segments.append(StubSegment(start, end, " " + word, [StubWord(start, end, " " + word, 1.0)], -0.3))
+        return segments
+
+    def transcribe(self, audio, beam_size=5, **kwargs):
+        """Same call shape as WhisperModel.transcribe: returns (segments, info)."""
+        self._spend(self.call_overhead + self.item_cost)
+        info = StubInfo(kwargs.get("language") or self.language, 1.0, len(audio) / self.sample_rate)
+        return iter(self._segments(audio)), info
+
+    def transcribe_batch(self, audio_batch, beam_size=5, languages=None, timestamps=False):
+        """Transcribe several chunks in one simulated forward pass. With timestamps, each result
+        ends with its segments as (start, end, text)."""
+        self._spend(self.call_overhead + self.item_cost * len(audio_batch))
+        results = []
+        for audio, language in zip(audio_batch, languages or [None] * len(audio_batch)):
+            segments = self._segments(audio)
+            text = ''.join(segment.text for segment in segments).strip()
+            avg_logprob = sum(segment.avg_logprob for segment in segments) / len(segments) if segments else None
+            result = text, language or self.language, None if language else 1.0, avg_logprob
+            if timestamps:
+                result += ([(segment.start, segment.end, segment.text.strip()) for segment in segments],)
+            results.append(result)
+        return results
+
+
+def load_stub_model(device=None, compute_type=None, cpu_threads=None, **kwargs):
+    """Loader with the same keywords ModelManager and ReplicaPool pass to real models."""
+    return StubWhisperModel(**kwargs)
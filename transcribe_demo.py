@@ -1,144 +1,196 @@
 #! python3.7
 
 import argparse
+import functools
 import os
 import numpy as np
-import speech_recognition as sr
-import whisper
-import torch
-device = torch.device('cuda')
-print(torch.cuda.is_available())  # Returns True if GPU is available
-print(torch.cuda.device_count())  # Number of available GPUs
-print(torch.cuda.current_device())  # Device number of the active GPU (e.g., 0)
+from audio_buffer import AudioRingBuffer
+from audio_codecs import decode_pcm
+from audio_capture import LatencyStats, add_capture_arguments, open_source
+from engines import available_engines, load_engine, run_transcription
+from model_manager import load_warm_model
+from streaming_transcriber import StreamingTranscriber, join_words
+from vad import VoiceActivityGate
 
 
-from datetime import datetime, timedelta
-from queue import Queue
-from time import sleep
-from sys import platform
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty
+
+
+def transcribe_words(engine, audio, prompt=None):
+    segments, _ = engine.word_segments(audio, prompt)
+    return segments
+
+
+def transcribe_text(engine, audio):
+    return engine.transcribe(audio)[0]
 
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--model", default="medium", help="Model to use",
+    # openai-whisper when it is installed, as always, otherwise the first real backend that is.
+    installed = [name for name in available_engines() if name != "stub"]
+    parser.add_argument("--engine", default="whisper" if "whisper" in installed else next(iter(installed), None),
+                        choices=available_engines(), help="Inference backend, see engines.py. Defaults to whisper, "
+                                                          "or another installed backend without it.")
+    parser.add_argument("--model", default="small", help="Model to use",
+                        choices=["tiny", "base", "small", "medium", "large"])
+    parser.add_argument("--final_model", default=None,
+                        help="Larger model that transcribes each finished phrase again in the background. "
+                             "--model then only has to keep up with the partial text.",
                         choices=["tiny", "base", "small", "medium", "large"])
     parser.add_argument("--non_english", action='store_true',
                         help="Don't use the english model.")
-    parser.add_argument("--energy_threshold", default=1000,
-                        help="Energy level for mic to detect.", type=int)
-    parser.add_argument("--record_timeout", default=2,
-                        help="How real time the recording is in seconds.", type=float)
+    parser.add_argument("--device", default="auto", choices=["auto", "cuda", "cpu"],
+                        help="Where to run the model, auto picks cuda when a GPU is available.")
     parser.add_argument("--phrase_timeout", default=3,
-                        help="How much empty space between recordings before we "
+                        help="How much silence before we "
                              "consider it a new line in the transcription.", type=float)
-    if 'linux' in platform:
-        parser.add_argument("--default_microphone", default='pulse',
-                            help="Default microphone name for SpeechRecognition. "
-                                 "Run this with 'list' to view available Microphones.", type=str)
+    add_capture_arguments(parser)
     args = parser.parse_args()
+    if args.engine is None:
+        parser.error("no inference backend is installed: pip install openai-whisper or faster-whisper, "
+                     "or pass --engine stub to try the demo without a model")
 
-    # The last time a recording was retrieved from the queue.
-    phrase_time = None
-    # Thread safe Queue for passing data from the threaded recording callback.
-    data_queue = Queue()
-    # We use SpeechRecognizer to record our audio because it has a nice feature where it can detect when speech ends.
-    recorder = sr.Recognizer()
-    recorder.energy_threshold = args.energy_threshold
-    # Definitely do this, dynamic energy compensation lowers the energy threshold dramatically to a point where the SpeechRecognizer never stops recording.
-    recorder.dynamic_energy_threshold = False
-
-    # Important for linux users.
-    # Prevents permanent application hang and crash by using the wrong Microphone
-    if 'linux' in platform:
-        mic_name = args.default_microphone
-        if not mic_name or mic_name == 'list':
-            print("Available microphone devices are: ")
-            for index, name in enumerate(sr.Microphone.list_microphone_names()):
-                print(f"Microphone with name \"{name}\" found")
-            return
-        else:
-            for index, name in enumerate(sr.Microphone.list_microphone_names()):
-                if mic_name in name:
-                    source = sr.Microphone(sample_rate=16000, device_index=index)
-                    break
-    else:
-        source = sr.Microphone(sample_rate=16000)
+    source = open_source(args)
+    if source is None:
+        return
 
     # Load / Download model
-    model = args.model
-    model = 'small'
-    if args.model != "large" and not args.non_english:
-        model = model + ".en"
-    audio_model = whisper.load_model(model)
+    def model_name(model):
+        if model != "large" and not args.non_english:
+            model = model + ".en"
+        return model
+    # Load in the background so the download and warmup overlap with microphone calibration.
+    model_loader = ThreadPoolExecutor(max_workers=1)
+    model_future = model_loader.submit(load_warm_model,
+                                       functools.partial(load_engine, args.engine, model_name(args.model)),
+                                       run_transcription, device=args.device)
+    if args.final_model:
+        final_future = model_loader.submit(load_warm_model,
+                                           functools.partial(load_engine, args.engine, model_name(args.final_model)),
+                                           run_transcription, device=args.device)
 
-    record_timeout = args.record_timeout
     phrase_timeout = args.phrase_timeout
+    # Seconds of audio captured since the last frame with speech in it, None while no phrase is open.
+    silence = None
 
+    # Committed lines of text. The line being spoken is the committed words of the current phrase
+    # followed by the words the model hasn't settled on yet.
     transcription = ['']
-
-    with source:
-        recorder.adjust_for_ambient_noise(source)
-
-    def record_callback(_, audio:sr.AudioData) -> None:
-        """
-        Threaded callback function to receive audio data when recordings finish.
-        audio: An AudioData containing the recorded bytes.
-        """
-        # Grab the raw bytes and push it into the thread safe queue.
-        data = audio.get_raw_data()
-        data_queue.put(data)
-
-    # Create a background thread that will pass us raw audio bytes.
-    # We could do this manually but SpeechRecognizer provides a nice helper.
-    recorder.listen_in_background(source, record_callback, phrase_time_limit=record_timeout)
+    phrase_words = []
+    stream = StreamingTranscriber()
+    # With a final model the whole phrase is kept and decoded again once it ends. Those decodes run
+    # on the loader thread while this loop carries on with the next phrase; pending_finals maps
+    # line numbers to their futures.
+    phrase_audio = AudioRingBuffer() if args.final_model else None
+    pending_finals = {}
+    # Speech is told apart from silence per frame, against a noise floor learned from the microphone.
+    gate = VoiceActivityGate(sample_rate=source.sample_rate)
+    # Every frame is scaled to float once, into this array, for the gate and the buffers alike.
+    frame_audio = np.zeros(source.frame_samples, dtype=np.float32)
+    latency = LatencyStats("Capture to text")
+
+    # The capture thread puts fixed-size frames on this queue as they are recorded.
+    frames = source.blocking_queue()
+
+    # Audio queues up while we wait for the model to finish loading.
+    audio_model, load_timings = model_future.result()
+    if args.final_model:
+        final_model, final_timings = final_future.result()
+    else:
+        model_loader.shutdown()
 
     # Cue the user that we're ready to go.
-    print("Model loaded.\n")
-
-    while True:
+    print(f"Model loaded in {load_timings.load_seconds:.2f}s on {audio_model.device}, "
+          f"warmed up in {load_timings.warmup_seconds:.2f}s.")
+    if args.final_model:
+        print(f"Final model loaded in {final_timings.load_seconds:.2f}s, "
+              f"warmed up in {final_timings.warmup_seconds:.2f}s.")
+    print()
+
+    def finish_phrase():
+        """A pause ends the phrase: settle its remaining words and start a fresh line."""
+        nonlocal phrase_words
+        phrase_words.extend(stream.finish())
+        transcription[-1] = join_words(phrase_words)
+        if phrase_audio is not None and len(phrase_audio):
+            pending_finals[len(transcription) - 1] = model_loader.submit(
+                transcribe_text, final_model, phrase_audio.view().copy())
+            phrase_audio.clear()
+        transcription.append('')
+        phrase_words = []
+
+    ended = False
+    while not ended:
         try:
-            now = datetime.utcnow()
-            # Pull raw recorded audio from the queue.
-            if not data_queue.empty():
-                phrase_complete = False
-                # If enough time has passed between recordings, consider the phrase complete.
-                # Clear the current working audio buffer to start over with the new data.
-                if phrase_time and now - phrase_time > timedelta(seconds=phrase_timeout):
-                    phrase_complete = True
-                # This is the last time we received new audio data from the queue.
-                phrase_time = now
-                
-                # Combine audio data from queue
-                audio_data = b''.join(data_queue.queue)
-                data_queue.queue.clear()
-                
-                # Convert in-ram buffer to something the model can use directly without needing a temp file.
-                # Convert data from 16 bit wide integers to floating point with a width of 32 bits.
-                # Clamp the audio stream frequency to a PCM wavelength compatible default of 32768hz max.
-                audio_np = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
-
-                # Read the transcription.
-                result = audio_model.transcribe(audio_np, fp16=torch.cuda.is_available())
-
-                text = result['text'].strip()
-
-                # If we detected a pause between recordings, add a new item to our transcription.
-                # Otherwise edit the existing one.
-                if phrase_complete:
-                    transcription.append(text)
+            # Sleep until the next frame is captured, then take every frame that queued up while
+            # the last decode ran.
+            captured = [frames.get()]
+            while True:
+                try:
+                    captured.append(frames.get_nowait())
+                except Empty:
+                    break
+            if captured[-1] is None:
+                # The input file is over.
+                ended = True
+                captured.pop()
+
+            voiced = []
+            redraw = False
+            for frame in captured:
+                audio_np = decode_pcm(frame.data, out=frame_audio)
+                if gate.process(audio_np)[0] is not None:
+                    voiced.append(frame)
+                    silence = 0.0
                 else:
-                    transcription[-1] = text
-
-                # Clear the console to reprint the updated transcription.
+                    if silence is not None:
+                        silence += source.frame_seconds
+                        # If enough silence has passed since the last speech, consider the phrase complete.
+                        if silence > phrase_timeout:
+                            finish_phrase()
+                            silence = None
+                            redraw = True
+                    continue
+                # Copy the frame into the stream's preallocated buffer, nothing is joined.
+                stream.insert_audio(audio_np)
+                if phrase_audio is not None:
+                    phrase_audio.append(audio_np)
+
+            if voiced:
+                # Only the uncommitted tail of the phrase is decoded again, committed words are
+                # trimmed from the buffer and passed as the prompt instead.
+                newly_committed, tentative = stream.process(
+                    lambda audio, prompt: transcribe_words(audio_model, audio, prompt))
+                phrase_words.extend(newly_committed)
+                transcription[-1] = join_words(phrase_words + tentative)
+                for frame in voiced:
+                    latency.observe(frame.captured_at)
+                redraw = True
+            if ended:
+                if silence is not None:
+                    finish_phrase()
+                for future in pending_finals.values():
+                    future.result()
+
+            # Swap in the final model's text for phrases it has finished.
+            for line in [line for line, future in pending_finals.items() if future.done()]:
+                transcription[line] = pending_finals.pop(line).result()
+                redraw = True
+
+            if redraw or ended:
+                # Clear the console to reprint the updated transcription. Earlier lines are only
+                # shown when a final model may still rewrite them.
                 os.system('cls' if os.name=='nt' else 'clear')
-                print(transcription[len(transcription)-1])
+                for line in transcription if args.final_model or ended else transcription[-1:]:
+                    print(line)
                 # Flush stdout.
                 print('', end='', flush=True)
-            else:
-                # Infinite loops are bad for processors, must sleep.
-                sleep(0.25)
         except KeyboardInterrupt:
             break
+    source.stop()
+    print(latency.summary())
 
 
 
@@ -0,0 +1,165 @@
+import asyncio
+import collections
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Bookkeeping per cached entry on top of the key and value (dict slot, tuple, string headers).
+ENTRY_OVERHEAD = 200
+
+
+def audio_key(audio_np, **params):
+    """Content address of a transcription: a hash of the exact samples and every parameter that
+    changes the result (model, language, beam size, ...). blake2b hashes well over 1 GB/s, so
+    keying a chunk costs far less than decoding it."""
+    digest = hashlib.blake2b(np.ascontiguousarray(audio_np), digest_size=16)
+    digest.update(json.dumps(params, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class TranscriptionCache:
+    """Bounded LRU of transcription results, with an optional directory that survives restarts.
+
+    Values are tuples of JSON types, e.g. run_transcription's (text, language, ...). The memory
+    tier evicts the least recently used entries once their estimated size passes max_bytes. With
+    a directory, every result is also written there as one small JSON file; a memory miss falls
+    back to disk and moves the entry back into memory. The disk tier is bounded by max_disk_bytes
+    the same way, least recently used first.
+
+    get() is a coroutine for the event loop. Only the memory tier is consulted on the loop: disk
+    reads, writes and trimming all run on the cache's own thread, which owns the disk tier's
+    bookkeeping, so no session waits on the disk. close() waits for pending writes.
+    """
+
+    def __init__(self, max_bytes=64 * 2 ** 20, directory=None, max_disk_bytes=1024 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = collections.OrderedDict()
+        self.bytes = 0
+        self._files = collections.OrderedDict()
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._disk = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+            self._disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix="transcription-cache")
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def get(self, key):
+        """The cached value, or None. Counts a hit or a miss."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        # A key that was never written is a miss without a trip to the disk thread.
+        value = None
+        if self._disk is not None and key in self._files:
+            value = await asyncio.get_running_loop().run_in_executor(self._disk, self._read, key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        value = tuple(value)
+        self._remember(key, value)
+        if self._disk is not None:
+            # The caller doesn't wait for the file to be written.
+            self._disk.submit(self._write, key, value)
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.shutdown(wait=True)
+
+    def summary(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        rate = (self.hits + self.disk_hits) / lookups if lookups else 0.0
+        disk = f", {len(self._files)} on disk ({self.disk_bytes / 2 ** 20:.1f} MiB)" if self.directory else ""
+        return (f"cache {self.hits} hit(s), {self.disk_hits} from disk, {self.misses} miss(es), hit rate {rate:.0%}; "
+                f"{len(self)} entries ({self.bytes / 2 ** 20:.1f} MiB){disk}, {self.evictions} evicted")
+
+    def _remember(self, key, value):
+        size = len(key) + len(json.dumps(value)) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous[1]
+        self._entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def _scan(self):
+        """Index the files a previous run left behind, oldest use first."""
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(".json"):
+                    stat = os.stat(os.path.join(root, name))
+                    files.append((stat.st_mtime, name[:-5], stat.st_size))
+        for _, key, size in sorted(files):
+            self._files[key] = size
+            self.disk_bytes += size
+        self._trim_disk()
+
+    def _read(self, key):
+        if key not in self._files:
+            return None
+        path = self._path(key)
+        try:
+            with open(path) as file:
+                value = tuple(json.load(file))
+            # The modification time is the use time the next _scan() orders by.
+            os.utime(path)
+        except (OSError, ValueError):
+            self.disk_bytes -= self._files.pop(key)
+            return None
+        self._files.move_to_end(key)
+        return value
+
+    def _write(self, key, value):
+        if key in self._files:
+            return
+        path = self._path(key)
+        data = json.dumps(value).encode()
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written aside and renamed, so a crash never leaves a truncated entry behind.
+            with open(path + ".tmp", "wb") as file:
+                file.write(data)
+            os.replace(path + ".tmp", path)
+        except OSError as error:
+            print(f"Transcription cache: could not write {path}: {error}")
+            return
+        self._files[key] = len(data)
+        self.disk_bytes += len(data)
+        self._trim_disk()
+
+    def _trim_disk(self):
+        while self.disk_bytes > self.max_disk_bytes and self._files:
+            key, size = self._files.popitem(last=False)
+            self.disk_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
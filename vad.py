@@ -0,0 +1,95 @@
+import numpy as np
+
+
+class VoiceActivityGate:
+    """Frame based voice activity detection for one session, fully vectorized with NumPy.
+
+    Each message is cut into frame_ms frames and every frame gets a short-time RMS energy and a
+    zero-crossing rate. A frame is voiced when its energy is well above the session's noise floor
+    and its zero-crossing rate looks like speech rather than hiss; strong frames pass regardless
+    of ZCR so fricatives aren't lost. Decisions are smoothed with a hangover (speech keeps the
+    gate open for hangover_ms after it stops, also into the next message when that one has speech)
+    and a short pre-roll.
+
+    The noise floor is learned per session from the frames judged silent, so the threshold follows
+    each client's microphone and room instead of a hardcoded energy value.
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=30, energy_ratio=3.0, min_rms=0.001,
+                 max_speech_zcr=0.35, hangover_ms=300, preroll_ms=150, noise_adaptation=0.05):
+        self.sample_rate = sample_rate
+        self.frame_length = int(sample_rate * frame_ms / 1000)
+        self.energy_ratio = energy_ratio
+        self.min_rms = min_rms
+        self.max_speech_zcr = max_speech_zcr
+        self.hangover_frames = int(hangover_ms / frame_ms)
+        self.preroll_frames = int(preroll_ms / frame_ms)
+        self.noise_adaptation = noise_adaptation
+        self.noise_floor = None
+        # Hangover frames still owed from the end of the previous message.
+        self._carried_hangover = 0
+        self.total_seconds = 0.0
+        self.skipped_seconds = 0.0
+
+    @property
+    def threshold(self):
+        return max(self.min_rms, (self.noise_floor or 0.0) * self.energy_ratio)
+
+    def frame_features(self, audio_np):
+        """Per-frame RMS energy and zero-crossing rate. A trailing partial frame is zero padded."""
+        frames = -(-len(audio_np) // self.frame_length)
+        padded = np.zeros(frames * self.frame_length, dtype=np.float32)
+        padded[:len(audio_np)] = audio_np
+        framed = padded.reshape(frames, self.frame_length)
+        energy = np.sqrt(np.mean(np.square(framed), axis=1))
+        signs = np.signbit(framed)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (self.frame_length - 1)
+        return energy, zcr
+
+    def speech_mask(self, audio_np):
+        """Smoothed per-frame speech decisions for a message, updating the noise floor."""
+        energy, zcr = self.frame_features(audio_np)
+        if self.noise_floor is None:
+            # Bootstrap from the quietest frames of the first message, capped so a session that
+            # opens mid-sentence doesn't start with a floor made of speech.
+            self.noise_floor = min(float(np.percentile(energy, 10)), self.min_rms * 10)
+        threshold = self.threshold
+        voiced = (energy > threshold) & ((zcr < self.max_speech_zcr) | (energy > threshold * 4))
+
+        silent = energy[~voiced]
+        if len(silent):
+            # Follow a quieter room quickly but a louder one slowly, so speech can't drag the floor up.
+            level = float(np.median(silent))
+            rate = self.noise_adaptation if level > self.noise_floor else 0.5
+            self.noise_floor += rate * (level - self.noise_floor)
+
+        # Hangover extends each voiced frame forward, pre-roll extends it backward. Both are a
+        # dilation of the boolean mask, done as one convolution.
+        kernel = np.ones(self.hangover_frames + self.preroll_frames + 1)
+        dilated = np.convolve(voiced, kernel)[self.preroll_frames:self.preroll_frames + len(voiced)] > 0
+        voiced_frames = np.flatnonzero(voiced)
+        if not len(voiced_frames):
+            # The hangover owed from the previous message only bridges into more speech. A message
+            # with none stays closed, so a pause never sends pure silence to the model.
+            self._carried_hangover = 0
+            return dilated
+        dilated[:self._carried_hangover] = True
+        self._carried_hangover = max(0, self.hangover_frames - (len(voiced) - 1 - voiced_frames[-1]))
+        return dilated
+
+    def process(self, audio_np):
+        """Gate one message. Returns (audio with silence trimmed or None if all silent, seconds skipped)."""
+        duration = len(audio_np) / self.sample_rate
+        self.total_seconds += duration
+        if not len(audio_np):
+            return None, 0.0
+        mask = self.speech_mask(audio_np)
+        speech_frames = np.flatnonzero(mask)
+        if not len(speech_frames):
+            self.skipped_seconds += duration
+            return None, duration
+        start = speech_frames[0] * self.frame_length
+        end = min((speech_frames[-1] + 1) * self.frame_length, len(audio_np))
+        skipped = (len(audio_np) - (end - start)) / self.sample_rate
+        self.skipped_seconds += skipped
+        return audio_np[start:end], skipped
@@ -1,25 +1,162 @@
+import argparse
 import asyncio
+import collections
+import json
+import time
+import numpy as np
 import websockets
+import protocol
+from audio_codecs import available_codecs, get_codec
+from audio_recording import RecordingReader
 
-# WebSocket client function to send audio data and receive transcription
-async def transcribe_with_websocket(audio_bytes):
-    uri = ""  # Assuming the WebSocket server is running on this URI
-    async with websockets.connect(uri) as websocket:
-        await websocket.send(audio_bytes)
-        transcription = await websocket.recv()
-        return transcription
-
-# Function to read audio data from file and send for transcription
-async def process_audio_file_and_transcribe(file_path):
-    with open(file_path, "rb") as file:
-        for line in file:
-            transcription = await transcribe_with_websocket(line.strip())
-            print(transcription)
+# Replays a recording through the server with M concurrent simulated clients, each on one
+# persistent connection, and reports throughput, real-time factor and chunk latency.
+
+# One simulated client: send every frame on schedule while a receiver task matches replies to
+# chunks in order, so sending never waits for the server.
+# With use_protocol the client speaks the JSON streaming protocol: a result acknowledges every
+# frame up to its seq, and after the last frame an end message asks for the final result.
+async def replay_client(uri, frames, speed, start_delay, latencies, verbose, use_protocol=False,
+                        encoding="pcm_s16le"):
+    await asyncio.sleep(start_delay)
+    async with websockets.connect(uri, max_size=None) as websocket:
+        in_flight = collections.deque()
+        if use_protocol:
+            await websocket.send(protocol.start_message(encoding=encoding))
+            ready = protocol.parse_message(await websocket.recv())
+            if ready["type"] != "ready":
+                raise protocol.ProtocolError(ready.get("message", f"Unexpected reply to start: {ready}"))
+
+        async def receive():
+            for _ in frames:
+                transcription = await websocket.recv()
+                latencies.append(time.monotonic() - in_flight.popleft()[1])
+                if verbose:
+                    print(transcription)
+
+        async def receive_protocol():
+            async for text in websocket:
+                message = protocol.parse_message(text)
+                while in_flight and "seq" in message and in_flight[0][0] <= message["seq"]:
+                    latencies.append(time.monotonic() - in_flight.popleft()[1])
+                if verbose and message["type"] in ("final", "error"):
+                    print(message.get("text", message.get("message")))
+
+        receiver = asyncio.create_task(receive_protocol() if use_protocol else receive())
+        started = time.monotonic()
+        try:
+            for sequence, (offset, audio_bytes) in enumerate(frames):
+                # Pace frames like the original capture, speed 2 replays twice as fast, 0 as fast as possible.
+                if speed > 0:
+                    delay = started + offset / speed - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                in_flight.append((sequence, time.monotonic()))
+                await websocket.send(protocol.pack_frame(sequence, audio_bytes) if use_protocol else audio_bytes)
+            if use_protocol:
+                # The server answers with the final result and closes the connection.
+                await websocket.send(protocol.encode("end"))
+            await receiver
+        finally:
+            receiver.cancel()
+
+def client_frames(recording, codec, client):
+    """Encoded frames as (capture offset, payload) for one simulated client.
+
+    Every client but the first adds its own inaudible +-1 LSB dither, so the server's transcription
+    cache can't answer one client's chunks with another's results and the load is really decoded.
+    """
+    rng = np.random.default_rng(client) if client else None
+    frames = []
+    for offset, frame in zip(recording.starts, recording):
+        if rng is not None:
+            frame = np.clip(frame + rng.integers(-1, 2, len(frame)), -32768, 32767).astype(np.int16)
+        frames.append((float(offset), codec.encode(frame, recording.sample_rate)))
+    return frames
+
+# Function to replay a recording through the server and summarise how it held up
+async def process_audio_file_and_transcribe(file_path, uri, clients=1, speed=0.0, ramp_up=0.0, verbose=True,
+                                            use_protocol=False, encoding="pcm_s16le", identical_audio=False):
+    codec = get_codec(encoding)
+    with RecordingReader(file_path) as recording:
+        # Send times follow the capture timestamps, gaps between captures included. Frames are
+        # encoded up front, so encoding never holds up sending.
+        frames = [client_frames(recording, codec, 0 if identical_audio else client) for client in range(clients)]
+        audio_seconds = recording.duration
+    latencies = []
+    started = time.monotonic()
+    results = await asyncio.gather(*[replay_client(uri, frames[client], speed, ramp_up * client / clients, latencies,
+                                                   verbose and clients == 1, use_protocol, encoding)
+                                     for client in range(clients)], return_exceptions=True)
+    elapsed = time.monotonic() - started
+    errors = [f"{type(result).__name__}: {result}" for result in results if isinstance(result, BaseException)]
+
+    total_audio = audio_seconds * (clients - len(errors))
+    report = {
+        "clients": clients,
+        "speed": speed,
+        "encoding": encoding,
+        # Audio payload bytes sent by all clients, frame and websocket headers excluded.
+        "bytes_sent": sum(len(audio_bytes) for client_frames, result in zip(frames, results)
+                          if not isinstance(result, BaseException) for _, audio_bytes in client_frames),
+        "chunks": len(latencies),
+        "audio_seconds": total_audio,
+        "elapsed_seconds": elapsed,
+        "chunks_per_second": len(latencies) / elapsed,
+        "audio_seconds_per_second": total_audio / elapsed,
+        # Wall time per second of audio across all clients, below 1 keeps up with real time.
+        "real_time_factor": elapsed / total_audio if total_audio else None,
+        "errors": errors,
+    }
+    if latencies:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        report["latency_ms"] = {"p50": p50, "p95": p95, "p99": p99, "mean": float(np.mean(latencies)) * 1000,
+                                "max": float(np.max(latencies)) * 1000}
+    return report
+
+def print_summary(report):
+    print(f"{report['clients']} client(s), {report['chunks']} chunks, {report['audio_seconds']:.1f}s of audio "
+          f"in {report['elapsed_seconds']:.1f}s")
+    print(f"{report['bytes_sent'] / 1024:.0f} KiB of {report['encoding']} audio sent")
+    print(f"Throughput {report['chunks_per_second']:.2f} chunks/s, {report['audio_seconds_per_second']:.2f} audio s/s")
+    if report["real_time_factor"] is not None:
+        print(f"Real-time factor {report['real_time_factor']:.3f}")
+    if "latency_ms" in report:
+        latency = report["latency_ms"]
+        print(f"Chunk latency p50 {latency['p50']:.0f} ms, p95 {latency['p95']:.0f} ms, p99 {latency['p99']:.0f} ms")
+    for error in report["errors"]:
+        print(f"Client failed: {error}")
 
 # Main function to run the asyncio event loop
 def main():
-    file_path = "recorded_audio_data.txt"
-    asyncio.run(process_audio_file_and_transcribe(file_path))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--uri", default="ws://localhost:8765", help="WebSocket transcription server.", type=str)
+    parser.add_argument("--file", default="recorded_audio.wrta", help="Recording made by microphone_recorder.py.",
+                        type=str)
+    parser.add_argument("--clients", default=1, help="Concurrent simulated clients.", type=int)
+    parser.add_argument("--speed", default=0, help="Replay pace, 1 is real time, 0 sends as fast as possible.",
+                        type=float)
+    parser.add_argument("--ramp_up", default=0, help="Seconds over which client start times are spread.",
+                        type=float)
+    parser.add_argument("--protocol", action='store_true',
+                        help="Speak the JSON streaming protocol instead of one bare text reply per chunk.")
+    parser.add_argument("--encoding", default="pcm_s16le", choices=available_codecs(),
+                        help="Wire codec for the audio, anything but pcm_s16le needs --protocol.")
+    parser.add_argument("--identical_audio", action='store_true',
+                        help="Send every client exactly the same audio, e.g. to measure the server's transcription "
+                             "cache. By default each client's audio is dithered differently.")
+    parser.add_argument("--json", default=None, help="Also write the report to this file as JSON.", type=str)
+    args = parser.parse_args()
+    if args.encoding != "pcm_s16le" and not args.protocol:
+        parser.error("--encoding is negotiated in the protocol handshake, add --protocol")
+    report = asyncio.run(process_audio_file_and_transcribe(args.file, args.uri, args.clients, args.speed,
+                                                           args.ramp_up, use_protocol=args.protocol,
+                                                           encoding=args.encoding,
+                                                           identical_audio=args.identical_audio))
+    print_summary(report)
+    if args.json:
+        with open(args.json, "w") as report_file:
+            json.dump(report, report_file, indent=2)
 
 if __name__ == "__main__":
     main()
@@ -1,53 +1,346 @@
 #! python3.7
 
+import argparse
 import asyncio
+import functools
+import os
+import sys
 import websockets
-import numpy as np
-import torch
-from faster_whisper import WhisperModel  # Importing faster_whisper
-
-device = torch.device('cuda')
-print(torch.cuda.is_available())  # Returns True if GPU is available
-print(torch.cuda.device_count())  # Number of available GPUs
-print(torch.cuda.current_device())  # Device number of the active GPU (e.g., 0)
+import metrics
+import protocol
+from audio_recording import RecordingReader
+from batch_scheduler import BatchScheduler
+from chunk_context import ChunkContext
+from engines import (available_engines, bench, load_engine, read_config, run_batch_transcription,
+                     run_transcription, run_word_segments, write_config, ENGINES)
+from model_manager import ModelManager, make_warmup_clip
+from replica_pool import ReplicaPool
+from admission import AdmissionController
+from session import Session
+from transcription_cache import TranscriptionCache, audio_key
 
 from datetime import datetime
 
+# Inference backend, see engines.py. Every engine is driven through the same calls.
+engine_name = "faster_whisper"
 # Load Whisper model (you might want to adjust the model size based on your needs)
 model_size = "base"  # You can adjust this as needed
-# Adjust model loading for faster_whisper with appropriate compute_type
-audio_model = WhisperModel(model_size, device="cuda", compute_type="float16")
-
-async def transcribe_audio(audio_bytes):
-    """Transcribe the given audio bytes using Whisper model."""
-    # Convert data from 16 bit wide integers to floating point with a width of 32 bits.
-    # Clamp the audio stream frequency to a PCM wavelength compatible default of 32768hz max.
-    audio_np = np.frombuffer(audio_bytes, dtype=np.int16).astype(np.float32) / 32768.0
-    # Transcribe the audio
-    segments, info = audio_model.transcribe(audio_np, beam_size=5)
-    # Constructing the full transcription text from segments
-    text = ' '.join([segment.text for segment in segments]).strip()
-    print(f"Detected language '{info.language}' with probability {info.language_probability}")
-    return text
-
-async def audio_receiver(websocket, path):
-    async for message in websocket:
-        if isinstance(message, bytes):
-            print(f"Received audio sample of size: {len(message)} bytes")
-            # Transcribe the received audio
-            transcribed_text = await transcribe_audio(message)
-            # Respond to the client with the transcribed text
-            await websocket.send(transcribed_text)
-            print(f"Transcribed text: {transcribed_text}")
-        else:
-            print("Received non-binary message")
-            # Optionally, respond for non-binary messages as well
-            await websocket.send("Expected binary data")
-
-async def main():
-    async with websockets.serve(audio_receiver, "localhost", 8765):
-        print("WebSocket server started. Listening on ws://localhost:8765")
-        await asyncio.Future()  # Run forever
+compute_type = "auto"
+beam_size = 5
+# Server side voice activity gate, drops silent messages and trims silence before inference.
+vad_enabled = True
+# Backpressure: per connection queue bound and what to do when it is full, see admission.py.
+session_queue_size = 4
+overflow_policy = "merge"
+# Server wide in-flight inference cap and load shedding, created in main().
+admission = None
+# Detection probability at which a session's language is pinned and detection stops, see language_pin.py.
+language_confidence = 0.8
+# When set, legacy connections are transcribed incrementally as one continuous stream; clients
+# speaking the JSON protocol (protocol.py) always are.
+streaming_mode = False
+# Loads the model in the background on the best available device, created in main().
+model_manager = None
+# Executor that owns the model and runs inference off the event loop, created in main().
+inference_executor = None
+# Optional micro-batching front end for the executor, created in main() when --batch_size > 1.
+batch_scheduler = None
+# Context carry-over for per-chunk decodes (--context_tokens): prompt budget in tokens, 0 is off,
+# and how much of the previous chunk's audio is decoded again in front of the next.
+context_tokens = 0
+chunk_overlap = 0.5
+# Results of earlier transcriptions by audio content, created in main() unless --cache_mb is 0.
+transcription_cache = None
+# Cascade mode (--partial_model): a small model on its own executor produces the partials, the
+# main model only decodes completed phrases for the finals.
+partial_manager = None
+partial_executor = None
+
+async def transcribe_audio(audio_np, session=None):
+    """Transcribe the given audio samples using Whisper model."""
+    # A session whose language is pinned skips language detection.
+    language = session.language_pin.language if session is not None else None
+    # The session's earlier text becomes the prompt, and the end of the previous chunk is decoded again.
+    context = session.chunk_context if session is not None else None
+    prompt = None
+    if context is not None:
+        audio_np, prompt = context.prepare(audio_np)
+    # Resent audio (reconnect retries, replays) is answered from the cache without a decode.
+    key = None
+    if transcription_cache is not None:
+        key = audio_key(audio_np, engine=engine_name, model=model_size, compute_type=compute_type, language=language,
+                        beam_size=beam_size, prompt=prompt, prompt_tokens=context_tokens)
+        cached = await transcription_cache.get(key)
+        metrics.cache_lookups.inc(labels=("miss" if cached is None else "hit",))
+        if cached is not None:
+            if metrics.verbose:
+                print(f"Answered from the transcription {transcription_cache.summary()}")
+            return context.update(cached[0]) if context is not None else cached[0]
+    # Transcribe the audio on the executor so other connections keep being served
+    if batch_scheduler is not None:
+        result = await batch_scheduler.submit(audio_np, language=language, prompt=prompt)
+    else:
+        result = await inference_executor.submit(run_transcription, audio_np, language, prompt, context_tokens,
+                                                 affinity=session)
+    if key is not None:
+        transcription_cache.put(key, result.value)
+    text, language, language_probability, avg_logprob = result.value
+    if language_probability is not None:
+        print(f"Detected language '{language}' with probability {language_probability}")
+    if session is not None:
+        session.language_pin.observe(language, language_probability, avg_logprob)
+    metrics.observe_inference(result, len(audio_np), session.trace if session is not None else None)
+    if metrics.verbose:
+        print(f"Queue wait {result.queue_wait:.3f}s, inference {result.compute:.3f}s, batch of {result.batch_size}")
+    return context.update(text) if context is not None else text
+
+async def transcribe_stream(stream, audio_np, session=None):
+    """Append audio to a connection's stream and return (newly committed, tentative, InferenceResult)."""
+    stream.insert_audio(audio_np)
+    audio_np, prompt = stream.prepare()
+    language = session.language_pin.language if session is not None else None
+    result = await (partial_executor or inference_executor).submit(run_word_segments, audio_np, prompt, language,
+                                                                   affinity=session)
+    segments, info = result.value
+    if session is not None:
+        session.language_pin.observe(*info)
+    newly_committed, tentative = stream.update(segments)
+    metrics.observe_inference(result, len(audio_np), session.trace if session is not None else None)
+    if metrics.verbose:
+        print(f"Queue wait {result.queue_wait:.3f}s, inference {result.compute:.3f}s, "
+              f"{len(audio_np) / stream.sample_rate:.1f}s of uncommitted audio decoded")
+    return newly_committed, tentative, result
+
+async def transcribe_final(audio_np, prompt, session=None):
+    """Cascade mode: decode a completed phrase with the main model. Returns (segments, InferenceResult)."""
+    language = session.language_pin.language if session is not None else None
+    result = await inference_executor.submit(run_word_segments, audio_np, prompt, language, affinity=session)
+    # The worker has moved on to the next partial, this decode is not part of its trace.
+    metrics.observe_inference(result, len(audio_np))
+    if metrics.verbose:
+        print(f"Final decode of {len(audio_np) / 16000:.1f}s: queue wait {result.queue_wait:.3f}s, "
+              f"inference {result.compute:.3f}s")
+    return result.value[0], result
+
+async def audio_receiver(websocket, path=None):
+    session = Session(websocket, admission, transcribe_audio, transcribe_stream, model=model_size,
+                      streaming=streaming_mode, vad=vad_enabled, queue_size=session_queue_size,
+                      overflow_policy=overflow_policy, language_confidence=language_confidence,
+                      transcribe_final=transcribe_final if partial_executor is not None else None,
+                      chunk_context=ChunkContext(chunk_overlap) if context_tokens > 0 else None)
+    await session.serve()
+
+def bench_main(argv):
+    """The bench subcommand: time every engine configuration on this machine and save the fastest."""
+    parser = argparse.ArgumentParser(prog=f"{os.path.basename(sys.argv[0])} bench",
+                                     description="Measure real-time factor and memory of each engine, model, "
+                                                 "compute type, beam size and thread count, and write the fastest "
+                                                 "configuration for --engine_config.")
+    parser.add_argument("--engines", default=[name for name in available_engines() if name != "stub"] or ["stub"],
+                        nargs="+", choices=list(ENGINES), help="Engines to compare, every installed one by default.")
+    parser.add_argument("--models", default=["tiny", "base"], nargs="+",
+                        help="Model sizes to compare. Only list sizes accurate enough for you, the fastest wins.")
+    parser.add_argument("--beam_sizes", default=[1, 5], nargs="+", type=int, help="Beam sizes to compare.")
+    parser.add_argument("--cpu_threads", default=[0], nargs="+", type=int,
+                        help="Thread counts to compare, 0 is the backend's default.")
+    parser.add_argument("--device", default="auto", choices=["auto", "cuda", "cpu"],
+                        help="Where to run the models, auto picks cuda when a GPU is available.")
+    parser.add_argument("--file", default=None, help="Recording made by microphone_recorder.py to transcribe. "
+                                                     "A synthetic clip is used when omitted.", type=str)
+    parser.add_argument("--seconds", default=30, help="Length of the synthetic audio.", type=float)
+    parser.add_argument("--output", default="engine_config.json", help="Where to write the fastest configuration.",
+                        type=str)
+    args = parser.parse_args(argv)
+    if args.file:
+        with RecordingReader(args.file) as recording:
+            audio = [frame.astype("float32") / 32768.0 for frame in recording]
+    else:
+        # Real speech decodes differently from a synthetic clip, pass --file for representative numbers.
+        audio = [make_warmup_clip(args.seconds)]
+    results = bench(audio, args.engines, args.models, args.beam_sizes, args.cpu_threads, args.device)
+    if not results:
+        print("No configuration could be loaded, nothing written")
+        return
+    write_config(args.output, results[0])
+    print(f"Fastest: {results[0]['engine']} {results[0]['model']} {results[0]['compute_type']} beam "
+          f"{results[0]['beam_size']}, real-time factor {results[0]['rtf']:.3f}. Written to {args.output}, "
+          f"start the server with --engine_config {args.output}")
+
+async def main(**defaults):
+    """Run the server. defaults override the built-in flag defaults, an --engine_config file overrides
+    both, and flags given on the command line override everything."""
+    global engine_name, model_size, model_manager, inference_executor, streaming_mode, vad_enabled
+    global admission, session_queue_size, overflow_policy, batch_scheduler, language_confidence
+    global partial_manager, partial_executor, compute_type, beam_size, transcription_cache
+    global context_tokens, chunk_overlap
+    parser = argparse.ArgumentParser(epilog="Run with 'bench' as the first argument to find the fastest engine "
+                                            "configuration for this machine.")
+    parser.add_argument("--engine", default=engine_name, choices=list(ENGINES),
+                        help="Inference backend: faster_whisper, openai-whisper, or a deterministic stub for tests.")
+    parser.add_argument("--engine_config", default=None,
+                        help="JSON file written by the bench subcommand with the engine, model, device, compute "
+                             "type, beam size and thread count to use.", type=str)
+    parser.add_argument("--model", default=model_size,
+                        help="Model size to load, or 'stub' for a fake model.", type=str)
+    parser.add_argument("--host", default="localhost", help="Interface to listen on.", type=str)
+    parser.add_argument("--port", default=8765, help="Port to listen on.", type=int)
+    parser.add_argument("--device", default="auto", choices=["auto", "cuda", "cpu"],
+                        help="Where to run the model, auto picks cuda when a GPU is available.")
+    parser.add_argument("--compute_type", default="auto",
+                        help="Compute type, auto uses float16 on GPU and int8 on CPU. openai-whisper only "
+                             "distinguishes float16 from float32.", type=str)
+    parser.add_argument("--beam_size", default=beam_size, help="Beam width of every decode, 1 is greedy.", type=int)
+    parser.add_argument("--cpu_threads", default=0,
+                        help="Threads per model on CPU, 0 leaves it to the backend. --replicas sets its own.",
+                        type=int)
+    parser.add_argument("--workers", default=1, help="Number of concurrent inference workers.", type=int)
+    parser.add_argument("--executor", default="thread", choices=["thread", "process"],
+                        help="Run inference on a thread pool sharing one model, or on a process pool "
+                             "with one model replica per process.")
+    parser.add_argument("--replicas", default=0,
+                        help="Run this many model replicas in separate processes, each pinned to its own "
+                             "cores and fed through shared memory. Overrides --workers/--executor.", type=int)
+    parser.add_argument("--threads_per_replica", default=0,
+                        help="Cores per replica, 0 splits the available cores evenly.", type=int)
+    parser.add_argument("--dispatch", default="least_loaded", choices=["least_loaded", "affinity"],
+                        help="Send each chunk to the least loaded replica, or keep a connection on one replica.")
+    parser.add_argument("--partial_model", default=None,
+                        help="Cascade mode: decode partials with this small model (e.g. tiny) and run --model "
+                             "only on completed phrases for the finals. Applies to protocol clients.", type=str)
+    parser.add_argument("--partial_compute_type", default="int8",
+                        help="Compute type of the partial model.", type=str)
+    parser.add_argument("--partial_workers", default=1, help="Inference workers of the partial model.", type=int)
+    parser.add_argument("--max_final_inflight", default=0,
+                        help="Final decodes in flight across all connections in cascade mode, 0 picks half of "
+                             "--max_inflight.", type=int)
+    parser.add_argument("--batch_size", default=1,
+                        help="Max chunks from different connections decoded together. 1 disables batching.", type=int)
+    parser.add_argument("--batch_wait_ms", default=10,
+                        help="How long the first chunk of a batch waits for others to join it.", type=float)
+    parser.add_argument("--streaming", action='store_true',
+                        help="Treat each legacy connection as one continuous stream: re-decode only the uncommitted "
+                             "tail and reply with newly committed text followed by the tentative words.")
+    parser.add_argument("--context_tokens", default=0,
+                        help="Prompt each per-chunk decode with up to this many tokens of the connection's earlier "
+                             "text, so short chunks keep their context. 0 decodes every chunk on its own.", type=int)
+    parser.add_argument("--chunk_overlap", default=0.5,
+                        help="With --context_tokens, seconds of the previous chunk decoded again in front of the "
+                             "next, so words cut at a chunk boundary are heard whole. Repeated words are dropped.",
+                        type=float)
+    parser.add_argument("--cache_mb", default=64,
+                        help="Memory for transcriptions of audio already seen, answered without a decode. "
+                             "0 disables the cache.", type=float)
+    parser.add_argument("--cache_dir", default=None,
+                        help="Also keep cached transcriptions in this directory, so they survive restarts.", type=str)
+    parser.add_argument("--cache_disk_mb", default=1024, help="Size limit of --cache_dir.", type=float)
+    parser.add_argument("--no_vad", action='store_true',
+                        help="Send every message to the model, even when it is silent.")
+    parser.add_argument("--language_confidence", default=0.8,
+                        help="Pin a connection's language once detection is this confident and stop detecting it "
+                             "on every chunk.", type=float)
+    parser.add_argument("--session_queue", default=4,
+                        help="Chunks a connection may have waiting for inference before the overflow policy applies.",
+                        type=int)
+    parser.add_argument("--overflow", default="merge", choices=["merge", "drop", "reject"],
+                        help="When a connection's queue is full: decode queued chunks together, drop the "
+                             "oldest one, or answer the new one with [busy].")
+    parser.add_argument("--max_inflight", default=0,
+                        help="Inference calls in flight across all connections, 0 picks twice the worker count.",
+                        type=int)
+    parser.add_argument("--shed_threshold", default=64,
+                        help="Queued chunks across all connections above which new audio is answered with [busy].",
+                        type=int)
+    parser.add_argument("--metrics_port", default=0,
+                        help="Serve Prometheus metrics at http://host:port/metrics, 0 disables collecting them.",
+                        type=int)
+    parser.add_argument("--trace_sample", default=0.0,
+                        help="Share of decoded chunks that print a trace line with their stage timings, e.g. 0.01.",
+                        type=float)
+    parser.add_argument("--verbose", action='store_true',
+                        help="Print every received chunk, skipped silence, text and inference timing.")
+    parser.set_defaults(**defaults)
+    args, _ = parser.parse_known_args()
+    if args.engine_config:
+        parser.set_defaults(**read_config(args.engine_config))
+    args = parser.parse_args()
+    engine_name = args.engine
+    model_size = args.model
+    beam_size = args.beam_size
+    context_tokens = args.context_tokens
+    chunk_overlap = args.chunk_overlap
+    compute_type = args.compute_type
+    language_confidence = args.language_confidence
+    streaming_mode = args.streaming
+    vad_enabled = not args.no_vad
+    metrics.verbose = args.verbose
+    metrics.trace_sample = args.trace_sample
+    if args.cache_mb > 0:
+        transcription_cache = TranscriptionCache(max_bytes=int(args.cache_mb * 2 ** 20), directory=args.cache_dir,
+                                                 max_disk_bytes=int(args.cache_disk_mb * 2 ** 20))
+    session_queue_size = args.session_queue
+    overflow_policy = args.overflow
+    admission = AdmissionController(max_inflight=args.max_inflight or 2 * max(args.workers, args.replicas, args.batch_size),
+                                    shed_threshold=args.shed_threshold,
+                                    max_final_inflight=args.max_final_inflight or None)
+
+    shared = ENGINES[args.engine].thread_safe and args.executor == "thread"
+    load_model = functools.partial(load_engine, args.engine, args.model, beam_size=args.beam_size,
+                                   cpu_threads=args.cpu_threads)
+    if args.replicas > 0:
+        model_manager = ModelManager(load_model, run_transcription,
+                                     device=args.device, compute_type=args.compute_type,
+                                     executor_class=ReplicaPool, replicas=args.replicas,
+                                     threads_per_replica=args.threads_per_replica or None,
+                                     dispatch=args.dispatch)
+    elif shared:
+        # faster_whisper releases the GIL and can serve num_workers transcriptions in parallel
+        # from a single model, so the threads share it.
+        model_manager = ModelManager(functools.partial(load_model, num_workers=args.workers), run_transcription,
+                                     device=args.device, compute_type=args.compute_type,
+                                     max_workers=args.workers, shared_model=True)
+    else:
+        # One replica per worker, whisper can't be called from several threads at once.
+        model_manager = ModelManager(load_model, run_transcription,
+                                     device=args.device, compute_type=args.compute_type,
+                                     max_workers=args.workers, mode=args.executor)
+    inference_executor = model_manager.executor
+    if args.batch_size > 1:
+        batch_scheduler = BatchScheduler(inference_executor, run_batch_transcription,
+                                         max_batch_size=args.batch_size, max_wait=args.batch_wait_ms / 1000,
+                                         prompt_tokens=context_tokens)
+
+    if args.partial_model:
+        # Its own workers, so partials never wait behind a final decode of the main model.
+        partial_manager = ModelManager(functools.partial(load_engine, args.engine, args.partial_model,
+                                                         beam_size=args.beam_size, cpu_threads=args.cpu_threads,
+                                                         num_workers=args.partial_workers),
+                                       run_transcription, device=args.device, compute_type=args.partial_compute_type,
+                                       max_workers=args.partial_workers, shared_model=shared)
+        partial_executor = partial_manager.executor
+
+    # Accept connections while the model loads, early requests queue until it is ready.
+    loaders = [model_manager.start()]
+    if partial_manager is not None:
+        loaders.append(partial_manager.start())
+    if args.metrics_port:
+        metrics.queue_depth.function = lambda: admission.queued
+        await metrics.serve(args.host, args.metrics_port)
+        print(f"Metrics at http://{args.host}:{args.metrics_port}/metrics")
+    try:
+        async with websockets.serve(audio_receiver, args.host, args.port, max_size=protocol.MAX_FRAME_BYTES):
+            print(f"WebSocket server started. Listening on ws://{args.host}:{args.port}")
+            # Run forever, unless a model fails to load: nothing could be answered then, so the
+            # server stops with the load error instead of leaving clients waiting.
+            await asyncio.gather(asyncio.Future(), *loaders)
+    finally:
+        model_manager.shutdown(wait=False)
+        if partial_manager is not None:
+            partial_manager.shutdown(wait=False)
+        if transcription_cache is not None:
+            transcription_cache.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if sys.argv[1:2] == ["bench"]:
+        bench_main(sys.argv[2:])
+    else:
+        asyncio.run(main())